@@ -27,11 +27,12 @@
 import json
 import uuid
 from datetime import datetime
-from collections import OrderedDict, defaultdict
+from collections import OrderedDict, defaultdict, Counter
 
 from settings import NoIndexWords
 from db import SessionContext, DataError, desc
 from db.models import Article as ArticleRow, Word, Root
+from db.queries import ChartsQuery, WordFrequencyQuery, PersonGraphQuery
 from fetcher import Fetcher
 from reynir import TOK
 from reynir.fastparser import Fast_Parser, ParseError, ParseForestDumper
@@ -46,6 +47,11 @@ from treeutil import TreeUtility
 MAX_SENTENCE_TOKENS = 90
 
 
+def _day(ts):
+    """ Return the day (midnight) of the given time stamp """
+    return ts.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
 class Article:
 
     """ An Article represents a new article typically scraped from a web site,
@@ -241,9 +247,30 @@ class Article:
             add_entity_to_register(name, register, session, all_names=all_names)
         return register
 
-    def _store_words(self, session):
-        """ Store word stems """
+    def _old_words(self, session, criterion):
+        """ Return (stem, cat, timestamp, cnt) tuples for the words
+            stored for the article rows matching the given criterion """
+        return (
+            session.query(Word.stem, Word.cat, ArticleRow.timestamp, Word.cnt)
+            .join(ArticleRow, ArticleRow.id == Word.article_id)
+            .filter(criterion)
+            .all()
+        )
+
+    def _store_words(self, session, old_words):
+        """ Store word stems, and update the daily word frequencies and
+            the person graph by the difference between the stems in
+            old_words (from previous versions of this article) and
+            the new ones """
         assert session is not None
+        deltas = defaultdict(int)
+        old_persons = Counter()
+        new_persons = Counter()
+        for stem, cat, ts, cnt in old_words:
+            if ts is not None:
+                deltas[(stem, cat, _day(ts))] -= cnt
+            if PersonGraphQuery.is_graph_person(stem, cat):
+                old_persons[stem] += 1
         # Delete previously stored words for this article
         session.execute(Word.table().delete().where(Word.article_id == self._uuid))
         # Index the words by storing them in the words table
@@ -261,6 +288,33 @@ class Article:
                 # Interesting word: let's index it
                 w = Word(article_id=self._uuid, stem=word.stem, cat=word.cat, cnt=cnt)
                 session.add(w)
+                if self._timestamp is not None:
+                    deltas[(word.stem, word.cat, _day(self._timestamp))] += cnt
+                if PersonGraphQuery.is_graph_person(word.stem, word.cat):
+                    new_persons[word.stem] += 1
+        WordFrequencyQuery.update(session, deltas)
+        PersonGraphQuery.update(session, old_persons, new_persons)
+
+    def _update_stats(self, session, old_rows):
+        """ Update the daily article statistics rollup by subtracting the
+            contributions of the (root_id, timestamp, num_sentences,
+            num_parsed) tuples in old_rows, which describe previous
+            versions of this article, and adding the contribution
+            of the new version """
+        deltas = defaultdict(lambda: [0, 0, 0])
+
+        def add(root_id, ts, num_sentences, num_parsed, sign):
+            if root_id is None or ts is None:
+                return
+            d = deltas[(root_id, _day(ts))]
+            d[0] += sign
+            d[1] += sign * (num_sentences or 0)
+            d[2] += sign * (num_parsed or 0)
+
+        for root_id, ts, num_sentences, num_parsed in old_rows:
+            add(root_id, ts, num_sentences, num_parsed, -1)
+        add(self._root_id, self._timestamp, self._num_sentences, self._num_parsed, 1)
+        ChartsQuery.update_days(session, deltas)
 
     def _parse(self, enclosing_session=None, verbose=False):
         """ Parse the article content to yield parse trees and annotated token list """
@@ -383,6 +437,20 @@ class Article:
                     tree=self._tree,
                     tokens=self._tokens,
                 )
+                # Note the root, day and counts of any existing rows with the
+                # same URL, since their contributions to the daily statistics
+                # need to be subtracted
+                old_rows = (
+                    session.query(
+                        ArticleRow.root_id,
+                        ArticleRow.timestamp,
+                        ArticleRow.num_sentences,
+                        ArticleRow.num_parsed,
+                    )
+                    .filter(ArticleRow.url == self._url)
+                    .all()
+                )
+                old_words = self._old_words(session, ArticleRow.url == self._url)
                 # Delete any existing rows with the same URL
                 session.execute(
                     ArticleRow.table().delete().where(ArticleRow.url == self._url)
@@ -390,9 +458,10 @@ class Article:
                 # Add the new row with a fresh UUID
                 session.add(ar)
                 # Store the word stems occurring in the article
-                self._store_words(session)
+                self._store_words(session, old_words)
                 # Offload the new data from Python to PostgreSQL
                 session.flush()
+                self._update_stats(session, old_rows)
                 return True
 
             # Update an already existing row by UUID
@@ -406,6 +475,8 @@ class Article:
                 # UUID not found: something is wrong here...
                 return False
 
+            old_rows = [(ar.root_id, ar.timestamp, ar.num_sentences, ar.num_parsed)]
+            old_words = self._old_words(session, ArticleRow.id == self._uuid)
             # Update the columns
             # UUID is immutable
             ar.url = self._url
@@ -431,9 +502,10 @@ class Article:
             # If the article has been parsed, update the index of word stems
             # (This may cause all stems for the article to be deleted, if
             # there are no successfully parsed sentences in the article)
-            self._store_words(session)
+            self._store_words(session, old_words)
             # Offload the new data from Python to PostgreSQL
             session.flush()
+            self._update_stats(session, old_rows)
             return True
 
     def prepare(self, enclosing_session=None, verbose=False, reload_parser=False):
@@ -22,12 +22,20 @@
     This module exports check_grammar(), a function called from main.py
     to apply grammar and spelling annotations to user-supplied text.
 
+    Long texts can be split into chunks of whole paragraphs using
+    split_text(), checked chunk by chunk (possibly in parallel), and the
+    statistics of the chunks combined using merge_stats().
+
 """
 
 import reynir_correct
 import nertokenizer
 
 
+# Texts are split into chunks of about this many characters for checking
+_CHUNK_SIZE = 4000
+
+
 class RecognitionPipeline(reynir_correct.CorrectionPipeline):
 
     """ Derived class that adds a named entity recognition pass
@@ -119,3 +127,41 @@ def check_grammar(text, *, progress_func=None):
     )
 
     return pgs, stats
+
+
+def split_text(text, chunk_size=_CHUNK_SIZE):
+    """ Split a text into chunks of whole paragraphs (lines), each of
+        roughly chunk_size characters unless a single paragraph is longer.
+        Checking the chunks separately yields the same paragraphs as
+        checking the whole text, since each line is a paragraph. """
+    chunks = []
+    chunk = []
+    length = 0
+    for pg in text.split("\n"):
+        if not pg.strip():
+            continue
+        if chunk and length + len(pg) > chunk_size:
+            chunks.append("\n".join(chunk))
+            chunk = []
+            length = 0
+        chunk.append(pg)
+        length += len(pg) + 1
+    if chunk:
+        chunks.append("\n".join(chunk))
+    return chunks
+
+
+def merge_stats(stats_list):
+    """ Combine the statistics returned by check_grammar()
+        for several chunks of a text """
+    num_tokens = sum(s["num_tokens"] for s in stats_list)
+    return dict(
+        num_tokens=num_tokens,
+        num_sentences=sum(s["num_sentences"] for s in stats_list),
+        num_parsed=sum(s["num_parsed"] for s in stats_list),
+        # The ambiguity is an average, weighted by the number of tokens
+        ambiguity=(
+            sum(s["ambiguity"] * s["num_tokens"] for s in stats_list) / num_tokens
+            if num_tokens else 0.0
+        ),
+    )
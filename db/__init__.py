@@ -23,7 +23,11 @@
 
 """
 
-from sqlalchemy import create_engine
+import os
+import time
+import logging
+
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import sessionmaker
 
 from settings import Settings, ConfigError
@@ -32,32 +36,101 @@ from sqlalchemy.exc import SQLAlchemyError as DatabaseError
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy.exc import DataError
 from sqlalchemy.exc import OperationalError
+from sqlalchemy.exc import DisconnectionError
 from sqlalchemy import desc
 from sqlalchemy import func as dbfunc
 
 from .models import Base
 
 
+# Timeout for connecting to the read-only database server, in seconds
+_READONLY_CONNECT_TIMEOUT = 3
+# Time to wait before trying the read-only server again after
+# a connection failure, in seconds
+_READONLY_RETRY_INTERVAL = 60.0
+
+# Database connections and engines inherited from a parent process.
+# These are kept referenced so that their connections are never closed
+# in the child process, which would terminate the parent's sessions on
+# the database server.
+_inherited = []
+
+
+def _create_engine(conn_str, **kwargs):
+    """ Create an engine with the configured connection pool settings,
+        which also discards connections that were inherited from a
+        parent process upon fork, instead of sharing their sockets """
+    engine = create_engine(
+        conn_str,
+        pool_size=Settings.DB_POOL_SIZE,
+        max_overflow=Settings.DB_MAX_OVERFLOW,
+        pool_timeout=Settings.DB_POOL_TIMEOUT,
+        pool_recycle=Settings.DB_POOL_RECYCLE,
+        pool_pre_ping=Settings.DB_POOL_PRE_PING,
+        **kwargs
+    )
+
+    @event.listens_for(engine, "connect")
+    def connect(dbapi_connection, connection_record):
+        connection_record.info["pid"] = os.getpid()
+
+    @event.listens_for(engine, "checkout")
+    def checkout(dbapi_connection, connection_record, connection_proxy):
+        pid = os.getpid()
+        if connection_record.info["pid"] != pid:
+            # This connection was opened by a parent process: detach it
+            # from the pool without closing it, and make the pool
+            # open a new one
+            _inherited.append(dbapi_connection)
+            connection_record.connection = connection_proxy.connection = None
+            raise DisconnectionError(
+                "Connection record belongs to pid {0}, "
+                "attempting to check out in pid {1}".format(
+                    connection_record.info["pid"], pid
+                )
+            )
+
+    return engine
+
+
 class Scraper_DB:
     """ Wrapper around the SQLAlchemy connection, engine and session """
 
     def __init__(self):
         """ Initialize the SQLAlchemy connection to the scraper database """
 
-        # Assemble the connection string, using psycopg2cffi which
-        # supports both PyPy and CPython
-        conn_str = "postgresql+{0}://{1}:{2}@{3}:{4}/scraper".format(
+        # Create engine and bind session
+        self._engine = _create_engine(
+            self._conn_str(Settings.DB_HOSTNAME, Settings.DB_PORT)
+        )
+        self._Session = sessionmaker(bind=self._engine)
+
+        # Create a separate engine for read-only sessions, if configured
+        self._ro_engine = None
+        self._ROSession = None
+        self._ro_failed = 0.0
+        if Settings.DB_READONLY_HOSTNAME:
+            self._ro_engine = _create_engine(
+                self._conn_str(
+                    Settings.DB_READONLY_HOSTNAME,
+                    Settings.DB_READONLY_PORT or Settings.DB_PORT,
+                ),
+                connect_args=dict(connect_timeout=_READONLY_CONNECT_TIMEOUT),
+            )
+            self._ROSession = sessionmaker(bind=self._ro_engine)
+
+    @staticmethod
+    def _conn_str(hostname, port):
+        """ Assemble the connection string, using psycopg2cffi which
+            supports both PyPy and CPython """
+        return "postgresql+{0}://{1}:{2}@{3}:{4}/scraper".format(
             "psycopg2cffi",
             Settings.DB_USERNAME,
             Settings.DB_PASSWORD,
-            Settings.DB_HOSTNAME,
-            Settings.DB_PORT,
+            hostname,
+            port,
         )
 
-        # Create engine and bind session
-        self._engine = create_engine(conn_str)
-        self._Session = sessionmaker(bind=self._engine)
-
     def create_tables(self):
         """ Create all missing tables in the database """
         Base.metadata.create_all(self._engine)
@@ -71,6 +144,38 @@ class Scraper_DB:
         """ Returns a freshly created Session instance from the sessionmaker """
         return self._Session()
 
+    @property
+    def read_only_session(self):
+        """ Returns a freshly created Session instance bound to the
+            read-only engine, or None if there is no read-only engine
+            or it failed recently """
+        if self._ROSession is None:
+            return None
+        if time.monotonic() - self._ro_failed < _READONLY_RETRY_INTERVAL:
+            return None
+        return self._ROSession()
+
+    def pool_status(self):
+        """ Return a dict of connection pool metrics for each engine """
+
+        def status(pool):
+            return dict(
+                size=pool.size(),
+                checked_in=pool.checkedin(),
+                checked_out=pool.checkedout(),
+                overflow=pool.overflow(),
+            )
+
+        result = dict(primary=status(self._engine.pool))
+        if self._ro_engine is not None:
+            result["read_only"] = status(self._ro_engine.pool)
+        return result
+
+    def read_only_failed(self):
+        """ Note that connecting to the read-only engine failed,
+            so that the primary engine is used for a while """
+        self._ro_failed = time.monotonic()
+
 
 class classproperty:
 
@@ -85,12 +190,18 @@ class SessionContext:
     """ Context manager for database sessions """
 
     _db = None  # Singleton instance of Scraper_DB
+    _db_pid = None  # Id of the process that created the singleton
 
     # pylint: disable=no-self-argument
     @classproperty
     def db(cls):
-        if cls._db is None:
+        if cls._db is None or cls._db_pid != os.getpid():
+            # Create a new instance, also if the current one was
+            # inherited from a parent process via fork
+            if cls._db is not None:
+                _inherited.append(cls._db)
             cls._db = Scraper_DB()
+            cls._db_pid = os.getpid()
         return cls._db
 
     @classmethod
@@ -104,19 +215,40 @@ class SessionContext:
             # Create a new session that will be automatically committed
             # (if commit == True) and closed upon exit from the context
             # pylint: disable=no-member
-            self._session = self.db.session  # Creates a new Scraper_DB instance if needed
             self._new_session = True
             if read_only:
+                self._session = self._read_only_session()
                 # Set the transaction as read only, which can save resources
                 self._session.execute("SET TRANSACTION READ ONLY")
                 self._commit = True
             else:
+                self._session = self.db.session  # Creates a new Scraper_DB instance if needed
                 self._commit = commit
         else:
             self._new_session = False
             self._session = session
             self._commit = False
 
+    def _read_only_session(self):
+        """ Return a session on the read-only engine, if available,
+            falling back to the primary engine """
+        # pylint: disable=no-member
+        db = self.db  # Creates a new Scraper_DB instance if needed
+        session = db.read_only_session
+        if session is not None:
+            try:
+                # Make sure that we can connect to the read-only server
+                session.connection()
+                return session
+            except OperationalError as e:
+                logging.warning(
+                    "Unable to connect to read-only database, "
+                    "using primary: {0}".format(e)
+                )
+                session.close()
+                db.read_only_failed()
+        return db.session
+
     def __enter__(self):
         """ Python context manager protocol """
         # Return the wrapped database session
@@ -180,6 +180,52 @@ class Article(Base):
         )
 
 
+class ArticleStats(Base):
+    """ Represents a daily rollup of article, sentence and parse counts
+        for a scraper root, maintained as articles are stored """
+
+    __tablename__ = "articlestats"
+
+    # The day (midnight UTC) of the article time stamps
+    day = Column(DateTime, nullable=False)
+
+    # Foreign key to a root
+    root_id = Column(
+        Integer,
+        ForeignKey("roots.id", onupdate="CASCADE", ondelete="CASCADE"),
+        nullable=False,
+    )
+
+    # Number of articles, sentences and parsed sentences
+    articles = Column(Integer, nullable=False, default=0)
+    sentences = Column(Integer, nullable=False, default=0)
+    parsed = Column(Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        PrimaryKeyConstraint("day", "root_id", name="articlestats_pkey"),
+    )
+
+    def __repr__(self):
+        return "ArticleStats(day='{0}', root_id='{1}', articles='{2}')".format(
+            self.day, self.root_id, self.articles
+        )
+
+
+class QueryStats(Base):
+    """ Represents a daily rollup of the number of logged queries """
+
+    __tablename__ = "querystats"
+
+    # The day (midnight UTC) of the query time stamps
+    day = Column(DateTime, primary_key=True)
+
+    # Number of queries
+    queries = Column(Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return "QueryStats(day='{0}', queries='{1}')".format(self.day, self.queries)
+
+
 class Person(Base):
     """ Represents a person """
 
@@ -368,6 +414,73 @@ class Word(Base):
         )
 
 
+class WordFrequency(Base):
+    """ Represents the number of occurrences of a word stem
+        in articles on a given day, maintained as articles are stored """
+
+    __tablename__ = "wordfreqs"
+
+    # The word stem
+    stem = Column(String(Word.MAX_WORD_LEN), nullable=False)
+
+    # The word category
+    cat = Column(String(16), nullable=False)
+
+    # The day (midnight UTC) of the article time stamps
+    day = Column(DateTime, nullable=False)
+
+    # Count of occurrences
+    cnt = Column(Integer, nullable=False)
+
+    __table_args__ = (
+        PrimaryKeyConstraint("stem", "cat", "day", name="wordfreqs_pkey"),
+    )
+
+    def __repr__(self):
+        return "WordFrequency(stem='{0}', cat='{1}', day='{2}', cnt='{3}')".format(
+            self.stem, self.cat, self.day, self.cnt
+        )
+
+
+class PersonMention(Base):
+    """ Represents the number of mentions of a person name (with at
+        least two parts) in articles, maintained as articles are stored """
+
+    __tablename__ = "personmentions"
+
+    # The person name
+    name = Column(String(Word.MAX_WORD_LEN), primary_key=True)
+
+    # Count of (name, category) occurrences in the words table
+    cnt = Column(Integer, index=True, nullable=False)
+
+    def __repr__(self):
+        return "PersonMention(name='{0}', cnt='{1}')".format(self.name, self.cnt)
+
+
+class PersonLink(Base):
+    """ Represents the number of articles where two person names
+        occur together, maintained as articles are stored """
+
+    __tablename__ = "personlinks"
+
+    # The person names, where name1 < name2 in code point order
+    name1 = Column(String(Word.MAX_WORD_LEN), nullable=False)
+    name2 = Column(String(Word.MAX_WORD_LEN), index=True, nullable=False)
+
+    # Count of articles
+    cnt = Column(Integer, nullable=False)
+
+    __table_args__ = (
+        PrimaryKeyConstraint("name1", "name2", name="personlinks_pkey"),
+    )
+
+    def __repr__(self):
+        return "PersonLink(name1='{0}', name2='{1}', cnt='{2}')".format(
+            self.name1, self.name2, self.cnt
+        )
+
+
 class Topic(Base):
     """ Represents a topic for an article """
 
@@ -23,6 +23,8 @@
 
 """
 
+from itertools import combinations
+
 from . import SessionContext
 
 
@@ -98,11 +100,87 @@ class ChartsQuery(_BaseQuery):
             order by name
         """
 
+    # Daily statistics from the articlestats rollup table. Roots
+    # without any articles in the period yield a single row with
+    # a NULL day.
+    _Q_DAILY = """
+        select r.description AS name,
+            s.day,
+            s.articles AS cnt,
+            s.sentences AS sent,
+            s.parsed
+            from roots as r
+            left join articlestats as s on r.id = s.root_id
+            and s.day >= :start and s.day < :end
+            where r.visible and r.scrape
+            order by name, s.day
+        """
+
+    # Add (possibly negative) deltas to the rollup row for a single root
+    # and day. Deltas, rather than recounts, are applied so that concurrent
+    # transactions storing articles for the same root and day don't
+    # overwrite each other's contributions.
+    _Q_UPDATE = """
+        insert into articlestats (day, root_id, articles, sentences, parsed)
+            values (:day, :root_id, :articles, :sentences, :parsed)
+        on conflict (day, root_id) do update
+            set articles = articlestats.articles + excluded.articles,
+                sentences = articlestats.sentences + excluded.sentences,
+                parsed = articlestats.parsed + excluded.parsed
+        """
+
+    _Q_DELETE = """
+        delete from articlestats where day >= :start and day < :end
+        """
+
+    _Q_REBUILD = """
+        insert into articlestats (day, root_id, articles, sentences, parsed)
+            select date_trunc('day', timestamp) as d, root_id,
+                count(id),
+                coalesce(sum(num_sentences),0),
+                coalesce(sum(num_parsed),0)
+                from articles
+                where root_id is not null
+                and timestamp >= :start and timestamp < :end
+                group by d, root_id
+        """
+
     @classmethod
     def period(cls, start, end, enclosing_session=None):
         with SessionContext(session=enclosing_session, commit=False) as session:
             return cls().execute(session, start=start, end=end)
 
+    @classmethod
+    def daily(cls, start, end, enclosing_session=None):
+        """ Return (name, day, cnt, sent, parsed) tuples for each source
+            and day within the given time period. Days without
+            articles are omitted. """
+        with SessionContext(session=enclosing_session, commit=False) as session:
+            return cls().execute_q(session, cls._Q_DAILY, start=start, end=end)
+
+    @classmethod
+    def update_days(cls, session, deltas):
+        """ Add the given deltas, a dict of (root_id, day) ->
+            (articles, sentences, parsed), to the daily rollup,
+            where day is a datetime at midnight UTC """
+        # Update the rows in a consistent order, to avoid
+        # deadlocks between concurrent transactions
+        params = [
+            dict(root_id=root_id, day=day, articles=a, sentences=s, parsed=p)
+            for (root_id, day), (a, s, p) in sorted(deltas.items())
+            if a or s or p
+        ]
+        if params:
+            session.execute(cls._Q_UPDATE, params)
+
+    @classmethod
+    def rebuild(cls, start, end, enclosing_session=None):
+        """ Rebuild the daily rollup for the given time period
+            from the articles table """
+        with SessionContext(session=enclosing_session, commit=True) as session:
+            session.execute(cls._Q_DELETE, dict(start=start, end=end))
+            session.execute(cls._Q_REBUILD, dict(start=start, end=end))
+
 
 class QueriesQuery(_BaseQuery):
     """ Statistics on the number of queries received over a given time period. """
@@ -112,11 +190,57 @@ class QueriesQuery(_BaseQuery):
             where timestamp >= :start and timestamp < :end
         """
 
+    # Daily query counts from the querystats rollup table
+    _Q_DAILY = """
+        select day, queries from querystats
+            where day >= :start and day < :end
+            order by day
+        """
+
+    _Q_INCREMENT = """
+        insert into querystats (day, queries)
+            values (date_trunc('day', cast(:ts as timestamp)), 1)
+        on conflict (day) do update
+            set queries = querystats.queries + 1
+        """
+
+    _Q_DELETE = """
+        delete from querystats where day >= :start and day < :end
+        """
+
+    _Q_REBUILD = """
+        insert into querystats (day, queries)
+            select date_trunc('day', timestamp) as d, count(id)
+                from queries
+                where timestamp >= :start and timestamp < :end
+                group by d
+        """
+
     @classmethod
     def period(cls, start, end, enclosing_session=None):
         with SessionContext(session=enclosing_session, commit=False) as session:
             return cls().execute(session, start=start, end=end)
 
+    @classmethod
+    def daily(cls, start, end, enclosing_session=None):
+        """ Return (day, count) tuples for each day within the given
+            time period. Days without queries are omitted. """
+        with SessionContext(session=enclosing_session, commit=False) as session:
+            return cls().execute_q(session, cls._Q_DAILY, start=start, end=end)
+
+    @classmethod
+    def count_query(cls, session, ts):
+        """ Add a query logged at the given time stamp to the daily rollup """
+        session.execute(cls._Q_INCREMENT, dict(ts=ts))
+
+    @classmethod
+    def rebuild(cls, start, end, enclosing_session=None):
+        """ Rebuild the daily rollup for the given time period
+            from the queries table """
+        with SessionContext(session=enclosing_session, commit=True) as session:
+            session.execute(cls._Q_DELETE, dict(start=start, end=end))
+            session.execute(cls._Q_REBUILD, dict(start=start, end=end))
+
 
 class QueryTypesQuery(_BaseQuery):
     """ Stats on the most frequent query types over a given time period. """
@@ -270,10 +394,120 @@ class ArticleListQuery(_BaseQuery):
             )
 
 
+class PersonGraphQuery(_BaseQuery):
+    """ A query for the most frequently mentioned persons and the
+        links between them, i.e. the number of articles in which
+        they are mentioned together. The personmentions and
+        personlinks tables are maintained via update() as the
+        word stems of articles are stored. """
+
+    _Q = """
+        select name, cnt from personmentions
+            where cnt > 0
+            order by cnt desc
+            limit :limit;
+        """
+
+    _Q_LINKS = """
+        select name1, name2, cnt from personlinks
+            where name1 in :names and name2 in :names and cnt > 0;
+        """
+
+    _Q_UPDATE_MENTIONS = """
+        insert into personmentions (name, cnt)
+            values (:name, :delta)
+        on conflict (name) do update
+            set cnt = personmentions.cnt + excluded.cnt
+        """
+
+    _Q_UPDATE_LINKS = """
+        insert into personlinks (name1, name2, cnt)
+            values (:name1, :name2, :delta)
+        on conflict (name1, name2) do update
+            set cnt = personlinks.cnt + excluded.cnt
+        """
+
+    _Q_REBUILD = """
+        delete from personmentions;
+        delete from personlinks;
+        insert into personmentions (name, cnt)
+            select stem, count(*)
+                from words
+                where cat like 'person_%' and stem like '% %'
+                group by stem;
+        insert into personlinks (name1, name2, cnt)
+            select w1.stem, w2.stem, count(distinct w1.article_id)
+                from words w1
+                join words w2 on w1.article_id = w2.article_id
+                and w1.stem collate "C" < w2.stem collate "C"
+                where w1.cat like 'person_%' and w1.stem like '% %'
+                and w2.cat like 'person_%' and w2.stem like '% %'
+                group by w1.stem, w2.stem;
+        """
+
+    @staticmethod
+    def is_graph_person(stem, cat):
+        """ Return True if the given word stem is a person name
+            that should be included in the person graph """
+        return cat.startswith("person_") and " " in stem
+
+    @classmethod
+    def top(cls, limit, enclosing_session=None):
+        """ Return a list of (name, count) tuples for the most frequently
+            mentioned persons, and a list of (name1, name2, count) tuples
+            for the links between them """
+        with SessionContext(session=enclosing_session, commit=False) as session:
+            persons = cls().execute(session, limit=limit)
+            if not persons:
+                return persons, []
+            names = tuple(p[0] for p in persons)
+            links = cls().execute_q(session, cls._Q_LINKS, names=names)
+            return persons, links
+
+    @classmethod
+    def update(cls, session, old_persons, new_persons):
+        """ Update the person mentions and links, given Counters of
+            person name occurrences in the old and new versions
+            of an article """
+        # The rows are updated in a consistent order, to avoid
+        # deadlocks between concurrent transactions
+        mentions = [
+            dict(name=name, delta=new_persons[name] - old_persons[name])
+            for name in sorted(set(old_persons) | set(new_persons))
+            if new_persons[name] != old_persons[name]
+        ]
+        if mentions:
+            session.execute(cls._Q_UPDATE_MENTIONS, mentions)
+
+        def pairs(names):
+            # The names in a pair are ordered by code point, as by the "C"
+            # collation in the rebuild query, regardless of the database's
+            # collation, so that both always use the same row for a pair
+            return set(combinations(sorted(names), 2))
+
+        old_pairs = pairs(old_persons)
+        new_pairs = pairs(new_persons)
+        links = sorted(
+            [dict(name1=a, name2=b, delta=1) for (a, b) in new_pairs - old_pairs]
+            + [dict(name1=a, name2=b, delta=-1) for (a, b) in old_pairs - new_pairs],
+            key=lambda d: (d["name1"], d["name2"]),
+        )
+        if links:
+            session.execute(cls._Q_UPDATE_LINKS, links)
+
+    @classmethod
+    def rebuild(cls, enclosing_session=None):
+        """ Rebuild the person mentions and links from the words table """
+        with SessionContext(session=enclosing_session, commit=True) as session:
+            session.execute(cls._Q_REBUILD)
+
+
 class WordFrequencyQuery(_BaseQuery):
     """ A query yielding the number of times a given word occurs in
         articles over a given period of time, broken down by day
-        (or longer periods, specified via the by_num_days arg). """
+        (or longer periods, specified via the by_num_days arg).
+        The counts are read from the wordfreqs table, which
+        contains daily totals for each word stem. """
 
     _Q = """
         with days as (
@@ -285,13 +519,12 @@ class WordFrequencyQuery(_BaseQuery):
             ) d
         ),
         appearances as (
-            select to_char(a.timestamp, 'YYYY-MM-DD') date, sum(w.cnt) cnt
-            from words w, articles a
-            where w.stem = :stem
-            and w.cat = :cat
-            and w.article_id = a.id
-            and a.timestamp >= :start
-            and a.timestamp <= :end
+            select to_char(f.day, 'YYYY-MM-DD') date, sum(f.cnt) cnt
+            from wordfreqs f
+            where f.stem = :stem
+            and f.cat = :cat
+            and f.day >= :start
+            and f.day <= :end
             group by date
             order by date
         )
@@ -299,6 +532,27 @@ class WordFrequencyQuery(_BaseQuery):
         left outer join appearances on days.date = appearances.date;
         """
 
+    # Add (possibly negative) deltas to the daily counts
+    _Q_UPDATE = """
+        insert into wordfreqs (stem, cat, day, cnt)
+            values (:stem, :cat, :day, :delta)
+        on conflict (stem, cat, day) do update
+            set cnt = wordfreqs.cnt + excluded.cnt
+        """
+
+    _Q_DELETE = """
+        delete from wordfreqs where day >= :start and day < :end
+        """
+
+    _Q_REBUILD = """
+        insert into wordfreqs (stem, cat, day, cnt)
+            select w.stem, w.cat, date_trunc('day', a.timestamp) as d, sum(w.cnt)
+                from words w, articles a
+                where w.article_id = a.id
+                and a.timestamp >= :start and a.timestamp < :end
+                group by w.stem, w.cat, d
+        """
+
     @classmethod
     def fetch(cls, stem, cat, start, end, by_num_days=1, enclosing_session=None):
         with SessionContext(session=enclosing_session, commit=False) as session:
@@ -310,3 +564,25 @@ class WordFrequencyQuery(_BaseQuery):
                 end=end,
                 by_num_days=by_num_days,
             )
+
+    @classmethod
+    def update(cls, session, deltas):
+        """ Add the given deltas, a dict of (stem, cat, day) -> delta,
+            to the daily word counts """
+        # Update the rows in a consistent order, to avoid
+        # deadlocks between concurrent transactions
+        params = [
+            dict(stem=stem, cat=cat, day=day, delta=delta)
+            for (stem, cat, day), delta in sorted(deltas.items())
+            if delta
+        ]
+        if params:
+            session.execute(cls._Q_UPDATE, params)
+
+    @classmethod
+    def rebuild(cls, start, end, enclosing_session=None):
+        """ Rebuild the daily word counts for the given time period
+            from the words and articles tables """
+        with SessionContext(session=enclosing_session, commit=True) as session:
+            session.execute(cls._Q_DELETE, dict(start=start, end=end))
+            session.execute(cls._Q_REBUILD, dict(start=start, end=end))
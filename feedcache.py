@@ -0,0 +1,206 @@
+"""
+
+    Greynir: Natural language processing for Icelandic
+
+    Feed cache module
+
+    Copyright (C) 2020 Miðeind ehf.
+
+       This program is free software: you can redistribute it and/or modify
+       it under the terms of the GNU General Public License as published by
+       the Free Software Foundation, either version 3 of the License, or
+       (at your option) any later version.
+       This program is distributed in the hope that it will be useful,
+       but WITHOUT ANY WARRANTY; without even the implied warranty of
+       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+       GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see http://www.gnu.org/licenses/.
+
+
+    This module implements a stale-while-revalidate cache for data
+    feeds that are fetched from external APIs, such as exchange rates,
+    petrol prices and TV schedules.
+
+    The last good value of each feed is kept in memory and persisted in
+    a JSON file that is shared by all worker processes. A background
+    thread refreshes each feed shortly before it expires, with a file
+    lock ensuring that only one worker process fetches a given feed at
+    a time. Callers are thus served the last good value immediately,
+    and only block on the remote API if no value has ever been fetched.
+
+"""
+
+import os
+import json
+import time
+import fcntl
+import logging
+import tempfile
+import threading
+
+
+# Directory for the persisted feed data
+_FEED_CACHE_DIR = os.environ.get(
+    "GREYNIR_FEED_CACHE_DIR", os.path.join(tempfile.gettempdir(), "greynir_feeds")
+)
+
+# A feed is refreshed when this fraction of its time-to-live has passed
+_REFRESH_AT = 0.8
+
+# Interval between checks for feeds that need refreshing, in seconds
+_CHECK_INTERVAL = 15.0
+
+
+class Feed:
+
+    """ A cached data feed, wrapping a function that fetches its data
+        from a remote API. The function should return a JSON-serializable
+        value, or None if the fetch failed. """
+
+    # All feeds in this process, keyed by name
+    _feeds = dict()
+    _feeds_lock = threading.Lock()
+    _refresher = None
+
+    def __init__(self, name, fetch_func, ttl):
+        self._name = name
+        self._fetch_func = fetch_func
+        self._ttl = ttl
+        self._value = None
+        # Time stamp (seconds since the epoch) of the last good fetch
+        self._ts = 0.0
+        self._lock = threading.Lock()
+        self._path = os.path.join(_FEED_CACHE_DIR, name + ".json")
+        with Feed._feeds_lock:
+            Feed._feeds[name] = self
+
+    @property
+    def name(self):
+        return self._name
+
+    def _age(self):
+        return time.time() - self._ts
+
+    def needs_refresh(self):
+        """ Return True if the feed is about to expire (or has expired) """
+        return self._age() >= self._ttl * _REFRESH_AT
+
+    def _load(self):
+        """ Load the persisted feed value, if it is newer than ours """
+        try:
+            with open(self._path, "r", encoding="utf-8") as f:
+                d = json.load(f)
+            if d["ts"] > self._ts:
+                self._value, self._ts = d["data"], d["ts"]
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logging.warning("Unable to load feed {0}: {1}".format(self._name, e))
+
+    def _store(self):
+        """ Persist the feed value, atomically replacing the previous file """
+        try:
+            os.makedirs(_FEED_CACHE_DIR, exist_ok=True)
+            tmp_path = "{0}.{1}.tmp".format(self._path, os.getpid())
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(dict(ts=self._ts, data=self._value), f, ensure_ascii=False)
+            os.replace(tmp_path, self._path)
+        except Exception as e:
+            logging.warning("Unable to store feed {0}: {1}".format(self._name, e))
+
+    def refresh(self, block=False):
+        """ Fetch fresh data for the feed, unless another worker process
+            is already doing so. If block is True, wait for that process
+            to finish instead of returning immediately. """
+        with self._lock:
+            # Another process may already have refreshed the feed
+            self._load()
+            if not self.needs_refresh():
+                return
+            try:
+                os.makedirs(_FEED_CACHE_DIR, exist_ok=True)
+                lock_file = open(self._path + ".lock", "a")
+            except OSError as e:
+                logging.warning("Unable to lock feed {0}: {1}".format(self._name, e))
+                lock_file = None
+            try:
+                if lock_file is not None:
+                    try:
+                        fcntl.flock(
+                            lock_file, fcntl.LOCK_EX | (0 if block else fcntl.LOCK_NB)
+                        )
+                    except BlockingIOError:
+                        # Another process is fetching this feed
+                        return
+                    # Check again, now that we hold the lock
+                    self._load()
+                    if not self.needs_refresh():
+                        return
+                try:
+                    value = self._fetch_func()
+                except Exception as e:
+                    logging.warning(
+                        "Exception when fetching feed {0}: {1}".format(self._name, e)
+                    )
+                    value = None
+                if value is not None:
+                    self._value, self._ts = value, time.time()
+                    self._store()
+            finally:
+                if lock_file is not None:
+                    lock_file.close()
+
+    def get(self):
+        """ Return the last good value of the feed. This only blocks
+            if no value has been fetched yet, by any worker process. """
+        Feed._start_refresher()
+        if self._value is None:
+            with self._lock:
+                self._load()
+            if self._value is None:
+                # Nothing to serve: we have to wait for the data
+                self.refresh(block=True)
+        elif self.needs_refresh() and self._lock.acquire(blocking=False):
+            # Pick up a value refreshed by another worker process, if any,
+            # but don't wait if a refresh is in progress in this process
+            try:
+                self._load()
+            finally:
+                self._lock.release()
+        return self._value
+
+    def __call__(self):
+        return self.get()
+
+    @classmethod
+    def _start_refresher(cls):
+        """ Start the background thread that refreshes feeds before they expire """
+        with cls._feeds_lock:
+            if cls._refresher is not None and cls._refresher.is_alive():
+                return
+
+            def refresh_feeds():
+                while True:
+                    time.sleep(_CHECK_INTERVAL)
+                    with cls._feeds_lock:
+                        feeds = list(cls._feeds.values())
+                    for feed in feeds:
+                        if feed.needs_refresh():
+                            feed.refresh()
+
+            cls._refresher = threading.Thread(
+                target=refresh_feeds, name="feed-refresher", daemon=True
+            )
+            cls._refresher.start()
+
+
+def cached_feed(name, ttl):
+    """ Decorator that turns a fetch function into a cached Feed,
+        which is called without arguments to obtain its value """
+
+    def decorator(fetch_func):
+        return Feed(name, fetch_func, ttl)
+
+    return decorator
@@ -42,7 +42,6 @@ import logging
 from datetime import datetime
 
 from flask import Flask, send_from_directory, render_template
-from flask_caching import Cache
 from flask_cors import CORS
 
 from werkzeug.middleware.proxy_fix import ProxyFix
@@ -55,6 +54,7 @@ import reynir_correct
 
 from settings import Settings, ConfigError
 from article import Article as ArticleProxy
+from sharedcache import SharedCache, cache_config
 
 # RUNNING_AS_SERVER is True if we're executing under nginx/Gunicorn,
 # but False if the program was invoked directly as a Python main module.
@@ -81,10 +81,10 @@ app.config["TEMPLATES_AUTO_RELOAD"] = not RUNNING_AS_SERVER
 # and other functions access to app instance via current_app
 app.app_context().push()
 
-# Set up caching
+# Set up caching, using a cache that is shared between worker processes
 # Caching is disabled if app is invoked via the command line
-cache_type = "simple" if RUNNING_AS_SERVER else "null"
-cache = Cache(app, config={"CACHE_TYPE": cache_type})
+cache_type = Settings.CACHE_TYPE if RUNNING_AS_SERVER else "null"
+cache = SharedCache(app, config=cache_config(cache_type))
 app.config["CACHE"] = cache
 
 # Register blueprint routes
@@ -92,6 +92,23 @@ from routes import routes, max_age
 
 app.register_blueprint(routes)
 
+# Expensive pages whose cached responses are recomputed before they expire
+_KEEP_WARM_URLS = (
+    "/stats",
+    "/people",
+    "/locations_icemap",
+    "/locations_worldmap",
+    "/news",
+)
+
+if RUNNING_AS_SERVER and cache_type != "null":
+
+    @app.before_first_request
+    def start_cache_warmer():
+        """ Start keeping expensive pages warm in the cache,
+            once the worker process is serving requests """
+        cache.keep_warm(app, _KEEP_WARM_URLS)
+
 
 # Utilities for Flask/Jinja2 formatting of numbers using the Icelandic locale
 def make_pattern(rep_dict):
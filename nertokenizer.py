@@ -27,10 +27,15 @@
     and is thus not appropriate for inclusion in reynir.bintokenizer,
     as ReynirPackage does not (and should not) require a database to be present.
 
+    Entity names are looked up in a process-wide in-memory index, which is
+    loaded from the database on first use and refreshed incrementally.
+
 """
 
 from collections import defaultdict
 import logging
+import threading
+import time
 
 from reynir import Abbreviations, TOK
 from reynir.bindb import BIN_Db
@@ -39,6 +44,92 @@ from db import SessionContext, OperationalError
 from db.models import Entity
 
 
+# Interval between incremental refreshes of the entity name index, in seconds
+_INDEX_REFRESH_INTERVAL = 5 * 60
+# Interval between complete rebuilds of the index, in seconds
+# (this also removes names of entities that have been deleted)
+_INDEX_REBUILD_INTERVAL = 6 * 60 * 60
+
+
+class EntityNameIndex:
+
+    """ A process-wide index of entity names, mapping the first word of
+        each name to the set of full names starting with that word. This
+        replaces a database query for each distinct capitalized word
+        in a document. """
+
+    _lock = threading.Lock()
+    # First word -> set of entity names
+    _index = None
+    # Highest entity id seen in the database
+    _max_id = 0
+    _refreshed = 0.0
+    _rebuilt = 0.0
+
+    @classmethod
+    def _load(cls, session, rebuild):
+        """ Load entity names from the database: all of them if rebuilding,
+            otherwise only the ones added since the last load """
+        index = defaultdict(set) if rebuild else cls._index
+        min_id = 0 if rebuild else cls._max_id
+        max_id = min_id
+        q = session.query(Entity.id, Entity.name).filter(Entity.id > min_id)
+        for eid, name in q.yield_per(10000):
+            if name:
+                index[name.split(maxsplit=1)[0]].add(name)
+            max_id = max(max_id, eid)
+        cls._index = index
+        cls._max_id = max_id
+
+    @classmethod
+    def _refresh(cls, session):
+        """ Ensure that the index is loaded and reasonably up to date """
+        now = time.monotonic()
+        if cls._index is not None and now - cls._refreshed < _INDEX_REFRESH_INTERVAL:
+            return
+        with cls._lock:
+            if cls._index is not None and now - cls._refreshed < _INDEX_REFRESH_INTERVAL:
+                # Another thread got here first
+                return
+            rebuild = (
+                cls._index is None or now - cls._rebuilt >= _INDEX_REBUILD_INTERVAL
+            )
+            try:
+                cls._load(session, rebuild)
+            except OperationalError as e:
+                logging.warning("SQL error in EntityNameIndex._refresh(): {0}".format(e))
+                if cls._index is None:
+                    return
+            cls._refreshed = now
+            if rebuild:
+                cls._rebuilt = now
+
+    @classmethod
+    def lookup(cls, w, session):
+        """ Return a list of entity names that are equal to the word(s)
+            given, or start with them, followed by more words """
+        cls._refresh(session)
+        index = cls._index
+        if not index:
+            return []
+        names = index.get(w.split(maxsplit=1)[0])
+        if not names:
+            return []
+        prefix = w + " "
+        # Take a snapshot of the set, which may be concurrently updated
+        return [n for n in tuple(names) if n == w or n.startswith(prefix)]
+
+    @classmethod
+    def add(cls, name):
+        """ Add an entity name to the index, for instance
+            when a processor has just stored a new entity """
+        if not name:
+            return
+        with cls._lock:
+            if cls._index is not None:
+                cls._index[name.split(maxsplit=1)[0]].add(name)
+
+
 def recognize_entities(token_stream, enclosing_session=None, token_ctor=TOK):
 
     """ Parse a stream of tokens looking for (capitalized) entity names
@@ -64,25 +155,11 @@ def recognize_entities(token_stream, enclosing_session=None, token_ctor=TOK):
         session=enclosing_session, commit=True, read_only=True
     ) as session:
 
-        def fetch_entities(w, fuzzy=True):
-            """ Return a list of entities matching the word(s) given,
-                exactly if fuzzy = False, otherwise also as a starting word(s) """
-            try:
-                q = session.query(Entity.name, Entity.verb, Entity.definition)
-                if fuzzy:
-                    q = q.filter(Entity.name.like(w + " %") | (Entity.name == w))
-                else:
-                    q = q.filter(Entity.name == w)
-                return q.all()
-            except OperationalError as e:
-                logging.warning("SQL error in fetch_entities(): {0}".format(e))
-                return []
-
         def query_entities(w):
-            """ Return a list of entities matching the initial word given """
+            """ Return a list of entity names matching the initial word given """
             e = ecache.get(w)
             if e is None:
-                ecache[w] = e = fetch_entities(w)
+                ecache[w] = e = EntityNameIndex.lookup(w, session)
             return e
 
         def lookup_lastname(lastname):
@@ -226,7 +303,7 @@ def recognize_entities(token_stream, enclosing_session=None, token_ctor=TOK):
                             # were constructed by concatenation (indicated by a hyphen
                             # in the stem)
                             weak = False  # Accept single-word entity references
-                        # elist is a list of Entity instances
+                        # elist is a list of entity names
                         elist = query_entities(w)
                     else:
                         elist = []
@@ -236,7 +313,7 @@ def recognize_entities(token_stream, enclosing_session=None, token_ctor=TOK):
                         candidate = False
                         for e in elist:
                             # List of subsequent words in entity name
-                            sl = e.name.split()[cnt:]
+                            sl = e.split()[cnt:]
                             if sl:
                                 # Here's a candidate for a longer entity reference
                                 # than we already have
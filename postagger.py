@@ -43,18 +43,28 @@
 
 import math
 import os
+import threading
 from collections import defaultdict
-from itertools import islice, tee
+from functools import lru_cache
+from itertools import count, islice, tee
 import xml.etree.ElementTree as ET
 
 from reynir import TOK, tokenize
 from reynir.binparser import canonicalize_token
 from reynir.ifdtagger import IFD_Tagset
 
+import cachetools
+
 from settings import Prepositions
 from treeutil import TreeUtility
 
 
+# Maximum number of entries in the process-wide tag set cache
+_TAGSET_CACHE_SIZE = 50000
+# Maximum number of cached transition log probabilities of an n-gram tagger
+_TRANSITION_CACHE_SIZE = 65536
+
+
 class IFD_Corpus:
 
     """ A utility class to access the IFD corpus of XML files, by default
@@ -132,6 +142,58 @@ class IFD_Corpus:
             yield [ (w, t) for (w, t, _) in sent ]
 
 
+class TagsetCache:
+
+    """ A bounded, thread-safe LRU cache of the tag sets of tokens,
+        shared by the taggers of a process, since the same words
+        recur constantly in text. Counts cache hits and misses. """
+
+    def __init__(self, maxsize = _TAGSET_CACHE_SIZE):
+        self._cache = cachetools.LRUCache(maxsize)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, key, func):
+        """ Return a copy of the tag set cached under the given key,
+            calling func() to obtain it if not found """
+        with self._lock:
+            taglist = self._cache.get(key)
+            if taglist is not None:
+                self.hits += 1
+                return list(taglist)
+            self.misses += 1
+        taglist = func()
+        if taglist is not None:
+            with self._lock:
+                self._cache[key] = tuple(taglist)
+        return taglist
+
+    def clear(self):
+        """ Empty the cache and reset the counters """
+        with self._lock:
+            self._cache.clear()
+            self.hits = self.misses = 0
+
+    def stats(self):
+        """ Return a dict with the size and hit statistics of the cache """
+        with self._lock:
+            total = self.hits + self.misses
+            return dict(
+                size = len(self._cache),
+                hits = self.hits,
+                misses = self.misses,
+                hit_rate = self.hits / total if total else 0.0
+            )
+
+
+TAGSET_CACHE = TagsetCache()
+
+# Generator of ids for n-gram models, which are a part of
+# the keys of their tag sets in the tag set cache
+_model_ids = count()
+
+
 class NgramCounter:
 
     """ A container for the dictionary of known n-grams along with their
@@ -199,16 +261,31 @@ class NgramTagger:
         "ef" : "ae"
     }
 
-    def __init__(self, n = 3, verbose = False):
-        """ n indicates the n-gram size, i.e. 3 for trigrams, etc. """
+    # Algorithms for finding the most likely tag sequence
+    ALGORITHMS = frozenset(("viterbi", "lookahead"))
+
+    def __init__(self, n = 3, verbose = False, algorithm = "viterbi"):
+        """ n indicates the n-gram size, i.e. 3 for trigrams, etc.
+            algorithm is either "viterbi", for an exact dynamic programming
+            search, or "lookahead", for the original greedy search that
+            looks up to n - 1 tokens ahead. """
+        if algorithm not in self.ALGORITHMS:
+            raise ValueError("Unknown tagging algorithm: {0}".format(algorithm))
         self.n = n
         self._verbose = verbose
+        self.algorithm = algorithm
         self.EMPTY = tuple([""] * n)
         # ngram count
         #self.cnt = defaultdict(int)
         self.cnt = NgramCounter()
         # { lemma: { tag : count} }
         self.lemma_cnt = defaultdict(lambda: defaultdict(int))
+        self._model_changed()
+
+    def _model_changed(self):
+        """ Invalidate cached results computed from the previous model """
+        self._model_id = next(_model_ids)
+        self._transition = lru_cache(maxsize = _TRANSITION_CACHE_SIZE)(self._transition_log_probs)
 
     def lemma_tags(self, lemma):
         """ Return a dict of tags and counts for this lemma """
@@ -275,6 +352,8 @@ class NgramTagger:
         for lemma in lemmas_to_delete:
             del self.lemma_cnt[lemma]
 
+        # Tag sets computed with the previous model are no longer valid
+        self._model_changed()
         return self
 
     def store_model(self):
@@ -308,6 +387,7 @@ class NgramTagger:
                 d = dict(zip(v[1::2], (int(n) for n in v[2::2])))
                 self.lemma_cnt[v[0]] = d
             self.cnt.load(f)
+        self._model_changed()
 
     def show_model(self):
         """ Dump the tag count statistics """
@@ -319,7 +399,62 @@ class NgramTagger:
     def _most_likely(self, tokens):
         """ Find the most likely tag sequence through the possible tags of each token.
             The tokens are represented by a list of tagset lists, where each tagset list
-            entry is a (tag, lexical probability) tuple. """
+            entry is a (tag, lexical probability) tuple. Returns a tuple of the
+            probability and the list of tags. """
+        if self.algorithm == "lookahead":
+            return self._most_likely_lookahead(tokens)
+        return self._most_likely_viterbi(tokens)
+
+    def _transition_log_probs(self, prev, tags):
+        """ Return a list of the log probabilities of each of the given tags,
+            following the n - 1 previous tags in prev, normalized over the tags.
+            As in the lookahead search, a count of 1 is added to each n-gram. """
+        cnt = self.cnt
+        counts = [ cnt.count(prev + (tag,)) + 1 for tag in tags ]
+        log_total = math.log(sum(counts))
+        return [ math.log(c) - log_total for c in counts ]
+
+    def _most_likely_viterbi(self, tokens):
+        """ Find the most likely tag sequence by dynamic programming over
+            states consisting of the last n - 1 tags. The probability of a
+            sequence is the product of the probabilities of its tags, each of
+            which is the same as the 'backward' probability of the lookahead
+            search, so the sequence found is at least as probable as the
+            lookahead result, and the search is linear in the number of tokens. """
+        # State (last n - 1 tags) -> log probability of the best path to it
+        states = { self.EMPTY[1:]: 0.0 }
+        # Backpointers for each token: state -> (previous state, tag)
+        backpointers = []
+        for tagset in tokens:
+            tags = tuple(tag for tag, _ in tagset)
+            log_lex = [ math.log(lex_p) for _, lex_p in tagset ]
+            log_lex_total = math.log(sum(lex_p for _, lex_p in tagset))
+            new_states = dict()
+            bp = dict()
+            for prev, log_p in states.items():
+                for tag, log_lex_p, log_t in zip(tags, log_lex, self._transition(prev, tags)):
+                    p = log_p + log_lex_p + log_t - log_lex_total
+                    state = (prev + (tag,))[1:]
+                    if state not in new_states or p > new_states[state]:
+                        new_states[state] = p
+                        bp[state] = (prev, tag)
+            states = new_states
+            backpointers.append(bp)
+        # Trace the best path backwards from the most probable final state
+        state, log_p = max(states.items(), key = lambda item: item[1])
+        best_path = []
+        for bp in reversed(backpointers):
+            state, tag = bp[state]
+            best_path.append(tag)
+        best_path.reverse()
+        if self._verbose:
+            print("Most likely tags: {0}, prob is {1:.4f}".format(best_path, math.exp(log_p)))
+        return math.exp(log_p), best_path
+
+    def _most_likely_lookahead(self, tokens):
+        """ Find a likely tag sequence by picking the most probable tag for
+            each token in turn, given the tags already picked and looking
+            ahead up to n - 1 tokens """
         cnt = self.cnt
         n = self.n
         history = self.EMPTY
@@ -412,6 +547,15 @@ class NgramTagger:
     _CONJ_REF = frozenset(["sem", "er"])
 
     def tag_single_token(self, token):
+        """ Return a tagset, with probabilities, for a single token.
+            Tag sets of words and person names are cached in the
+            process-wide tag set cache. """
+        if token.kind in (TOK.WORD, TOK.PERSON):
+            key = (self._model_id, token.kind, token.txt, tuple(token.val or ()))
+            return TAGSET_CACHE.lookup(key, lambda: self._tag_single_token(token))
+        return self._tag_single_token(token)
+
+    def _tag_single_token(self, token):
         """ Return a tagset, with probabilities, for a single token """
 
         def ifd_tag(kind, txt, m):
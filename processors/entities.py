@@ -36,6 +36,7 @@ import re
 from datetime import datetime
 
 from db.models import Entity
+from nertokenizer import EntityNameIndex
 from reynir import Abbreviations
 
 
@@ -217,6 +218,9 @@ def sentence(state, result):
                 timestamp=datetime.utcnow(),
             )
             session.add(e)
+            # Make the new entity name known to the named entity
+            # recognizer in this process without waiting for a refresh
+            EntityNameIndex.add(entity)
 
 
 def visit(state, node):
@@ -31,15 +31,26 @@ import os
 import re
 import locale
 import math
-from urllib.parse import urlencode
+import time
+import threading
+import hashlib
+from datetime import datetime, timedelta
+from urllib.parse import urlencode, urlsplit
 from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
+
+import cachetools
+from requests.adapters import HTTPAdapter
 
 from tzwhere import tzwhere
 from pytz import country_timezones
 
 from geo import country_name_for_isocode, iceprep_for_cc
+from tzindex import timezone_index
 from reynir.bindb import BIN_Db
 from settings import changedlocale
+from db import SessionContext, DatabaseError
+from db.models import Link
 
 
 def natlang_seq(words, oxford_comma=False):
@@ -365,22 +376,104 @@ def gen_answer(a):
     return dict(answer=a), a, a
 
 
-def query_json_api(url):
+# Timeouts for external API requests, in seconds: (connect, read)
+_API_TIMEOUT = (3.05, 8.0)
+# Maximum number of pooled keep-alive connections per remote host
+_API_POOL_MAXSIZE = 10
+# Number of consecutive failures after which requests to
+# a remote host are short-circuited, and for how many seconds
+_API_BREAKER_THRESHOLD = 5
+_API_BREAKER_COOLDOWN = 30.0
+# Maximum number of concurrent requests in query_json_api_async()
+_API_MAX_CONCURRENT = 8
+
+
+class _CircuitBreaker:
+
+    """ Keeps track of consecutive failures per remote host. When a host
+        has failed too often, requests to it are refused for a cooldown
+        period instead of tying up the calling worker. """
+
+    def __init__(self, threshold, cooldown):
+        self._threshold = threshold
+        self._cooldown = cooldown
+        self._lock = threading.Lock()
+        # Host -> (number of consecutive failures, time of last failure)
+        self._failures = dict()
+
+    def allow(self, host):
+        """ Return True if a request to the given host should be attempted """
+        with self._lock:
+            count, ts = self._failures.get(host, (0, 0.0))
+            if count < self._threshold:
+                return True
+            now = time.monotonic()
+            if now - ts < self._cooldown:
+                return False
+            # The breaker is open but the cooldown period is over: allow
+            # a single trial request, refusing others for another period
+            self._failures[host] = (count, now)
+            return True
+
+    def success(self, host):
+        with self._lock:
+            self._failures.pop(host, None)
+
+    def failure(self, host):
+        with self._lock:
+            count, _ = self._failures.get(host, (0, 0.0))
+            self._failures[host] = (count + 1, time.monotonic())
+
+
+_API_SESSION = None
+_API_SESSION_LOCK = threading.Lock()
+_API_BREAKER = _CircuitBreaker(_API_BREAKER_THRESHOLD, _API_BREAKER_COOLDOWN)
+_API_EXECUTOR = ThreadPoolExecutor(max_workers=_API_MAX_CONCURRENT)
+
+
+def _api_session():
+    """ Return a shared requests Session, which pools and
+        reuses keep-alive connections to remote hosts """
+    global _API_SESSION
+    with _API_SESSION_LOCK:
+        if _API_SESSION is None:
+            adapter = HTTPAdapter(pool_maxsize=_API_POOL_MAXSIZE)
+            session = requests.Session()
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _API_SESSION = session
+        return _API_SESSION
+
+
+def query_json_api(url, timeout=_API_TIMEOUT):
     """ Request the URL, expecting a json response which is 
         parsed and returned as a Python data structure. """
 
+    host = urlsplit(url).netloc
+    if not _API_BREAKER.allow(host):
+        logging.warning("Skipping request to failing API server {0}".format(host))
+        return None
+
     # Send request
     try:
-        r = requests.get(url)
+        r = _api_session().get(url, timeout=timeout)
     except Exception as e:
+        _API_BREAKER.failure(host)
         logging.warning(str(e))
         return None
 
     # Verify that status is OK
     if r.status_code != 200:
+        if r.status_code >= 500:
+            # Server error: count it as a failure of the remote host
+            _API_BREAKER.failure(host)
+        else:
+            _API_BREAKER.success(host)
         logging.warning("Received status {0} from API server".format(r.status_code))
         return None
 
+    _API_BREAKER.success(host)
+
     # Parse json API response
     try:
         res = json.loads(r.text)
@@ -391,6 +484,20 @@ def query_json_api(url):
     return None
 
 
+def query_json_api_async(url, timeout=_API_TIMEOUT):
+    """ Start a query_json_api() request in the background, returning a
+        Future whose result() is the parsed response (or None). This allows
+        a single query to fan out to several APIs concurrently. """
+    return _API_EXECUTOR.submit(query_json_api, url, timeout)
+
+
+def query_json_apis(urls, timeout=_API_TIMEOUT):
+    """ Request several URLs concurrently, returning a list of
+        parsed json responses (or None) in the same order """
+    futures = [query_json_api_async(url, timeout) for url in urls]
+    return [f.result() for f in futures]
+
+
 # The Google API identifier (you must obtain your
 # own key if you want to use this code)
 _GOOGLE_API_KEY = ""
@@ -416,6 +523,103 @@ def _get_google_api_key():
     return _GOOGLE_API_KEY
 
 
+# Time-to-live of cached Google API responses, per kind of lookup.
+# The responses are stored in the links table, with the kind as content type.
+_GOOGLE_API_CACHE_TTL = {
+    "geocode-coords": timedelta(days=30),
+    "geocode-addr": timedelta(days=30),
+    "traveltime": timedelta(days=7),
+    # Place lookups include opening hours, which change during the day
+    "places": timedelta(hours=1),
+}
+# Number of decimal places in rounded coordinates in cache keys (~11 m)
+_CACHE_COORD_DECIMALS = 4
+# Size of the in-memory cache in front of the database, per kind of lookup
+_GOOGLE_API_MEMCACHE_SIZE = 512
+
+_GOOGLE_API_MEMCACHE = {
+    kind: cachetools.TTLCache(_GOOGLE_API_MEMCACHE_SIZE, ttl.total_seconds())
+    for kind, ttl in _GOOGLE_API_CACHE_TTL.items()
+}
+_GOOGLE_API_MEMCACHE_LOCK = threading.Lock()
+
+
+def _cache_key(*parts):
+    """ Create a cache key for a Google API lookup, normalizing strings
+        and rounding coordinates (given as tuples) """
+    a = []
+    for p in parts:
+        if isinstance(p, (tuple, list)):
+            p = ",".join(
+                "{0:.{1}f}".format(float(c), _CACHE_COORD_DECIMALS) for c in p
+            )
+        elif isinstance(p, str):
+            p = " ".join(p.lower().split())
+        a.append(str(p))
+    key = "|".join(a)
+    if len(key) > 256:
+        # Too long for the key column of the links table
+        key = hashlib.md5(key.encode("utf-8")).hexdigest()
+    return key
+
+
+def _cached_google_api_query(kind, key, url):
+    """ Look up a Google API response in the in-memory cache, then in the
+        links table, and if not found (or expired), send the request and
+        cache a successful response """
+    with _GOOGLE_API_MEMCACHE_LOCK:
+        res = _GOOGLE_API_MEMCACHE[kind].get(key)
+    if res is not None:
+        return res
+
+    # Note that no database session is held during the request itself,
+    # which may take a while
+    ttl = _GOOGLE_API_CACHE_TTL[kind]
+    try:
+        with SessionContext(read_only=True) as session:
+            lnk = (
+                session.query(Link.content, Link.timestamp)
+                .filter(Link.ctype == kind)
+                .filter(Link.key == key)
+                .one_or_none()
+            )
+        if lnk is not None and datetime.utcnow() - lnk.timestamp <= ttl:
+            res = json.loads(lnk.content)
+    except DatabaseError as e:
+        logging.warning("Error looking up cached Google API response: {0}".format(e))
+
+    if res is None:
+        res = query_json_api(url)
+        if res is None or res.get("status") not in ("OK", "ZERO_RESULTS"):
+            # Don't cache errors, such as exceeded quotas
+            return res
+        content = json.dumps(res, ensure_ascii=False)
+        try:
+            with SessionContext(commit=True) as session:
+                lnk = (
+                    session.query(Link)
+                    .filter(Link.ctype == kind)
+                    .filter(Link.key == key)
+                    .one_or_none()
+                )
+                if lnk is None:
+                    lnk = Link(
+                        ctype=kind, key=key, content=content, timestamp=datetime.utcnow()
+                    )
+                    session.add(lnk)
+                else:
+                    lnk.content = content
+                    lnk.timestamp = datetime.utcnow()
+        except DatabaseError as e:
+            # The response is still usable even if caching it failed, for
+            # instance if another worker stored the same key concurrently
+            logging.warning("Error caching Google API response: {0}".format(e))
+
+    with _GOOGLE_API_MEMCACHE_LOCK:
+        _GOOGLE_API_MEMCACHE[kind][key] = res
+    return res
+
+
 _MAPS_API_COORDS_URL = (
     "https://maps.googleapis.com/maps/api/geocode/json"
     "?latlng={0},{1}&key={2}&language=is&region=is"
@@ -431,8 +635,12 @@ def query_geocode_api_coords(lat, lon):
         logging.warning("No API key for coordinates lookup")
         return None
 
-    # Send API request
-    res = query_json_api(_MAPS_API_COORDS_URL.format(lat, lon, key))
+    # Send API request, or fetch a cached response
+    res = _cached_google_api_query(
+        "geocode-coords",
+        _cache_key((lat, lon)),
+        _MAPS_API_COORDS_URL.format(lat, lon, key),
+    )
 
     return res
 
@@ -452,8 +660,10 @@ def query_geocode_api_addr(addr):
         logging.warning("No API key for address lookup")
         return None
 
-    # Send API request
-    res = query_json_api(_MAPS_API_ADDR_URL.format(addr, key))
+    # Send API request, or fetch a cached response
+    res = _cached_google_api_query(
+        "geocode-addr", _cache_key(addr), _MAPS_API_ADDR_URL.format(addr, key)
+    )
 
     return res
 
@@ -487,8 +697,12 @@ def query_traveltime_api(startloc, endloc, mode="walking"):
     p1 = "{0},{1}".format(*startloc) if type(startloc) is tuple else startloc
     p2 = "{0},{1}".format(*endloc) if type(endloc) is tuple else endloc
 
-    # Send API request
-    res = query_json_api(_MAPS_API_TRAVELTIME_URL.format(p1, p2, mode, key))
+    # Send API request, or fetch a cached response
+    res = _cached_google_api_query(
+        "traveltime",
+        _cache_key(startloc, endloc, mode),
+        _MAPS_API_TRAVELTIME_URL.format(p1, p2, mode, key),
+    )
 
     return res
 
@@ -531,9 +745,13 @@ def query_places_api(
         )
     qstr = urlencode(qdict)
 
-    # Send API request
+    # Send API request, or fetch a cached response. The location
+    # bias is rounded, since it is only approximate anyway.
     url = _PLACES_API_URL.format(qstr)
-    res = query_json_api(url)
+    bias = tuple(round(c, 2) for c in userloc) if userloc else ""
+    res = _cached_google_api_query(
+        "places", _cache_key(placename, bias, radius, fields), url
+    )
 
     return res
 
@@ -571,7 +789,9 @@ _TZW = None
 
 
 def tzwhere_singleton():
-    """ Lazy-load location/timezone database. """
+    """ Lazy-load location/timezone database. This takes several seconds
+        and a lot of memory, and is only used if the precomputed
+        timezone index (see tzindex.py) is not available. """
     global _TZW
     if not _TZW:
         _TZW = tzwhere.tzwhere(forceTZ=True)
@@ -582,6 +802,9 @@ def timezone4loc(loc, fallback=None):
     """ Returns timezone string given a tuple of coordinates. 
         Fallback argument should be an ISO country code."""
     if loc:
+        index = timezone_index()
+        if index is not None:
+            return index.lookup(loc[0], loc[1])
         return tzwhere_singleton().tzNameAt(loc[0], loc[1], forceTZ=True)
     if fallback and fallback in country_timezones:
         return country_timezones[fallback][0]
@@ -30,6 +30,9 @@ import math
 from datetime import datetime
 from collections import defaultdict
 import logging
+import threading
+
+import cachetools
 
 from settings import Settings
 
@@ -59,6 +62,16 @@ _MAX_URLS = 5
 # Maximum number of identical mentions of a title or entity description
 # that we consider when scoring the mentions
 _MAX_MENTIONS = 5
+# Maximum number of names in each IN clause when building name registers
+_REGISTER_BATCH_SIZE = 500
+# Size and time-to-live (in seconds) of the cache of best titles
+# and definitions used when building name registers
+_REGISTER_CACHE_SIZE = 8192
+_REGISTER_CACHE_TTL = 300
+
+# Cache of ("name" | "entity", name) -> best title or definition
+_register_cache = cachetools.TTLCache(_REGISTER_CACHE_SIZE, _REGISTER_CACHE_TTL)
+_register_cache_lock = threading.Lock()
 
 
 def append_answers(rd, q, prop_func):
@@ -326,7 +339,7 @@ def add_entity_to_register(name, register, session, all_names=False):
                     register[name] = dict(kind="ref", fullname=k)
                     return
     # Use the query module to return definitions for an entity
-    definition = query_entity_def(session, name)
+    definition = _cached_entity_def(session, name)
     if definition:
         register[name] = dict(kind="entity", title=definition)
     elif all_names:
@@ -339,7 +352,7 @@ def add_name_to_register(name, register, session, all_names=False):
         # Already have a title for this exact name; don't bother
         return
     # Use the query module to return titles for a person
-    title, _ = query_person_title(session, name)
+    title = _cached_person_title(session, name)
     name_key = name_key_to_update(register, name)
     if name_key is not None:
         if title:
@@ -352,6 +365,16 @@ def create_name_register(tokens, session, all_names=False):
     """ Assemble a dictionary of person and entity names
         occurring in the token list """
     register = {}
+    # Fetch the titles and definitions of all names in the token list
+    # with a few batched queries, before assembling the register
+    person_names = set()
+    entity_names = set()
+    for t in tokens:
+        if t.kind == TOK.PERSON:
+            person_names.update(pn.name for pn in t.val)
+        elif t.kind == TOK.ENTITY:
+            entity_names.add(t.txt)
+    _prefetch_register_data(session, person_names, entity_names)
     for t in tokens:
         if t.kind == TOK.PERSON:
             gn = t.val
@@ -362,6 +385,133 @@ def create_name_register(tokens, session, all_names=False):
     return register
 
 
+def _cached_person_title(session, name):
+    """ Return the best title for a person, using the register cache """
+    key = ("name", name)
+    with _register_cache_lock:
+        title = _register_cache.get(key)
+    if title is None:
+        title, _ = query_person_title(session, name)
+        with _register_cache_lock:
+            _register_cache[key] = title
+    return title
+
+
+def _cached_entity_def(session, name):
+    """ Return the best definition of an entity, using the register cache """
+    key = ("entity", name)
+    with _register_cache_lock:
+        definition = _register_cache.get(key)
+    if definition is None:
+        definition = query_entity_def(session, name)
+        with _register_cache_lock:
+            _register_cache[key] = definition
+    return definition
+
+
+def _prefetch_register_data(session, person_names, entity_names):
+    """ Look up the best titles and definitions of the given person and
+        entity names that are not already in the register cache, using
+        set-based queries instead of one or two queries per name """
+    with _register_cache_lock:
+        person_names = [n for n in person_names if ("name", n) not in _register_cache]
+        entity_names = [
+            n for n in entity_names if ("entity", n) not in _register_cache
+        ]
+    if not person_names and not entity_names:
+        return
+    found = dict()
+    try:
+        for i in range(0, len(person_names), _REGISTER_BATCH_SIZE):
+            batch = person_names[i : i + _REGISTER_BATCH_SIZE]
+            for name, rl in _query_person_titles_batch(session, batch).items():
+                found[("name", name)] = _best_title(rl)[0]
+        for i in range(0, len(entity_names), _REGISTER_BATCH_SIZE):
+            batch = entity_names[i : i + _REGISTER_BATCH_SIZE]
+            for name, rl in _query_entity_definitions_batch(session, batch).items():
+                found[("entity", name)] = correct_spaces(rl[0]["answer"]) if rl else ""
+    except OperationalError as e:
+        # Leave the remaining names to the per-name queries
+        logging.warning("SQL error in _prefetch_register_data(): {0}".format(e))
+    with _register_cache_lock:
+        _register_cache.update(found)
+
+
+def _query_person_titles_batch(session, names):
+    """ Return a dict of name -> list of titles, as returned by
+        _query_person_titles(), for the given person names """
+    rds = defaultdict(lambda: defaultdict(dict))
+    q = (
+        session.query(
+            Person.name,
+            Person.title,
+            Article.id,
+            Article.timestamp,
+            Article.heading,
+            Root.domain,
+            Article.url,
+        )
+        .filter(Person.name.in_(names))
+        .filter(Root.visible == True)
+        .join(Article, Article.url == Person.article_url)
+        .join(Root)
+        .order_by(Article.timestamp)
+        .all()
+    )
+    for p in q:
+        append_answers(rds[p.name], (p,), prop_func=lambda x: x.title)
+    q = (
+        session.query(
+            Entity.name,
+            Entity.definition,
+            Article.id,
+            Article.timestamp,
+            Article.heading,
+            Root.domain,
+            Article.url,
+        )
+        .filter(Entity.name.in_(names))
+        .filter(Root.visible == True)
+        .join(Article, Article.url == Entity.article_url)
+        .join(Root)
+        .order_by(Article.timestamp)
+        .all()
+    )
+    for p in q:
+        append_answers(rds[p.name], (p,), prop_func=lambda x: x.definition)
+    return {name: make_response_list(rds[name]) for name in names}
+
+
+def _query_entity_definitions_batch(session, names):
+    """ Return a dict of name -> list of definitions, as returned by
+        _query_entity_definitions(), for the given entity names """
+    q = (
+        session.query(
+            Entity.name_lc,
+            Entity.verb,
+            Entity.definition,
+            Article.id,
+            Article.timestamp,
+            Article.heading,
+            Root.domain,
+            Article.url,
+        )
+        .filter(Entity.name_lc.in_(names))
+        .filter(Root.visible == True)
+        .join(Article, Article.url == Entity.article_url)
+        .join(Root)
+        .order_by(Article.timestamp)
+        .all()
+    )
+    by_name = defaultdict(list)
+    for p in q:
+        by_name[p.name_lc].append(p)
+    return {
+        name: prepare_response(by_name[name], prop_func=lambda x: x.definition)
+        for name in names
+    }
+
+
 def _query_person_titles(session, name):
     """ Return a list of all titles for a person """
     # This list should never become very long, so we don't
@@ -511,8 +661,9 @@ _DONT_LIKE_TITLE = (
 )
 
 
-def query_person_title(session, name):
-    """ Return the most likely title for a person """
+def _best_title(rl):
+    """ Return the most likely title and its source domain
+        from a list of titles """
 
     def we_dont_like(answer):
         """ Return False if we don't like this title and
@@ -521,7 +672,6 @@ def query_person_title(session, name):
         # wife of somebody else
         return answer.startswith(_DONT_LIKE_TITLE)
 
-    rl = _query_person_titles(session, name)
     len_rl = len(rl)
     index = 0
     while index < len_rl and we_dont_like(rl[index]["answer"]):
@@ -534,6 +684,11 @@ def query_person_title(session, name):
     return correct_spaces(rl[index]["answer"]), rl[index]["sources"][0]["domain"]
 
 
+def query_person_title(session, name):
+    """ Return the most likely title for a person """
+    return _best_title(_query_person_titles(session, name))
+
+
 def query_title(query, session, title):
     """ A query for a person by title """
     # !!! Consider doing a LIKE '%title%', not just LIKE 'title%'
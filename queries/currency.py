@@ -26,12 +26,12 @@
 # TODO: "hvað eru 10 evrur í íslenskum krónum"
 
 import re
-import cachetools
 import json
 import random
 import logging
 
 from queries import query_json_api, format_icelandic_float, is_plural
+from feedcache import cached_feed
 from settings import Settings
 
 
@@ -437,7 +437,7 @@ _CURR_API_URL = "https://apis.is/currency/lb"
 _CURR_CACHE_TTL = 3600  # seconds
 
 
-@cachetools.cached(cachetools.TTLCache(1, _CURR_CACHE_TTL))
+@cached_feed("exchange_rates", _CURR_CACHE_TTL)
 def _fetch_exchange_rates():
     """ Fetch exchange rate data from apis.is and cache it. """
     res = query_json_api(_CURR_API_URL)
@@ -27,10 +27,10 @@
 # TODO: Fyrirsagnir, og að styðja "Segðu mér meira um X"
 
 import logging
-import cachetools
 import random
 
 from queries import gen_answer, query_json_api
+from feedcache import cached_feed
 
 
 _NEWS_QTYPE = "News"
@@ -105,7 +105,7 @@ _NEWS_API = "https://ruv.is/json/frettir/hladbord"
 _NEWS_CACHE_TTL = 300  # seconds, ttl = 5 mins
 
 
-@cachetools.cached(cachetools.TTLCache(1, _NEWS_CACHE_TTL))
+@cached_feed("ruv_news", _NEWS_CACHE_TTL)
 def _get_news_data(max_items=8):
     """ Fetch news headline data from RÚV, preprocess it. """
     res = query_json_api(_NEWS_API)
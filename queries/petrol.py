@@ -27,7 +27,6 @@
 # TODO: Laga krónutölur og fjarlægðartölur f. talgervil
 
 import logging
-import cachetools
 import random
 
 from geo import distance
@@ -38,6 +37,7 @@ from queries import (
     distance_desc,
     krona_desc,
 )
+from feedcache import cached_feed
 
 
 _PETROL_QTYPE = "Petrol"
@@ -219,7 +219,7 @@ _PETROL_API = "https://apis.is/petrol"
 _PETROL_CACHE_TTL = 3600  # seconds, ttl 1 hour
 
 
-@cachetools.cached(cachetools.TTLCache(1, _PETROL_CACHE_TTL))
+@cached_feed("petrol_stations", _PETROL_CACHE_TTL)
 def _get_petrol_station_data():
     """ Fetch list of petrol stations w. prices from apis.is (Gasvaktin) """
     pd = query_json_api(_PETROL_API)
@@ -35,6 +35,7 @@ import random
 from datetime import datetime, timedelta
 
 from queries import query_json_api, gen_answer
+from feedcache import cached_feed
 
 
 _SCHEDULES_QTYPE = "Schedule"
@@ -173,25 +174,26 @@ def _clean_desc(d):
 
 _RUV_SCHEDULE_API_ENDPOINT = "https://apis.is/tv/ruv/"
 _API_ERRMSG = "Ekki tókst að sækja sjónvarpsdagskrá."
-_CACHED_SCHEDULE = None
-_LAST_FETCHED = None
+_SCHEDULE_CACHE_TTL = 600  # seconds, ttl 10 minutes
+
+
+@cached_feed("ruv_tv_schedule", _SCHEDULE_CACHE_TTL)
+def _fetch_tv_schedule():
+    """ Fetch current television schedule from API """
+    sched = query_json_api(_RUV_SCHEDULE_API_ENDPOINT)
+    if sched and "results" in sched and len(sched["results"]):
+        return dict(date=datetime.today().date().isoformat(), results=sched["results"])
+    return None
 
 
 def _query_tv_schedule_api():
-    """ Fetch current television schedule from API, or return cached copy. """
-    global _CACHED_SCHEDULE
-    global _LAST_FETCHED
-    if (
-        not _CACHED_SCHEDULE
-        or not _LAST_FETCHED
-        or _LAST_FETCHED.date() != datetime.today().date()
-    ):
-        _CACHED_SCHEDULE = None
-        sched = query_json_api(_RUV_SCHEDULE_API_ENDPOINT)
-        if sched and "results" in sched and len(sched["results"]):
-            _LAST_FETCHED = datetime.utcnow()
-            _CACHED_SCHEDULE = sched["results"]
-    return _CACHED_SCHEDULE
+    """ Return the cached television schedule for today, if available """
+    sched = _fetch_tv_schedule()
+    if not sched or sched["date"] != datetime.today().date().isoformat():
+        # The schedule is from a previous day; a fresh one will be
+        # fetched in the background within a few minutes
+        return None
+    return sched["results"]
 
 
 def _span(p):
@@ -28,16 +28,24 @@
 
 import importlib
 import logging
+import os
+import hashlib
 from datetime import datetime, timedelta
 import json
 import re
 import random
+import threading
+import time
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import cachetools
 
 from settings import Settings
 
 from db import SessionContext, desc
 from db.models import Query as QueryRow
+from db.queries import QueriesQuery
 
 from tree import Tree
 from reynir import TOK, tokenize, correct_spaces
@@ -54,6 +62,9 @@ from processor import modules_in_dir
 _QUERY_ROOT = "QueryRoot"
 
 
+# Maximum number of recently failed (unparseable) query strings to remember
+_FAILED_QUERY_CACHE_SIZE = 2048
+
 # A fixed preamble that is inserted before the concatenated query grammar fragments
 _GRAMMAR_PREAMBLE = """
 
@@ -165,6 +176,46 @@ class QueryParser(Fast_Parser):
         return cls._grammar_additions
 
 
+# Thread pool and thread-local parser instances for
+# concurrent parsing of alternative query strings
+_parse_executor = None
+_parse_executor_workers = 0
+_parse_executor_lock = threading.Lock()
+_parse_tls = threading.local()
+
+# Maximum number of alternative query strings parsed concurrently
+# when requested by a caller, beyond the number in the settings
+_MAX_PARALLEL_HYPOTHESES = 8
+
+
+def _parse_pool(workers=1):
+    """ Return the singleton thread pool used for concurrent parsing of
+        alternative query strings, having at least the given number of
+        worker threads. If the pool is too small, it is replaced by a
+        larger one, on which new work is then submitted. """
+    global _parse_executor, _parse_executor_workers
+    workers = max(workers, Settings.QUERY_PARALLEL_HYPOTHESES, 1)
+    with _parse_executor_lock:
+        if _parse_executor is None or _parse_executor_workers < workers:
+            if _parse_executor is not None:
+                # Work already submitted to the old pool still runs to completion
+                _parse_executor.shutdown(wait=False)
+            _parse_executor = ThreadPoolExecutor(max_workers=workers)
+            _parse_executor_workers = workers
+        return _parse_executor
+
+
+def _thread_parser():
+    """ Return a QueryParser instance for the current thread. The parsers share
+        the class-level query grammar, so creating them is cheap, and the
+        C parser core releases the GIL while parsing. """
+    parser = getattr(_parse_tls, "parser", None)
+    if parser is None:
+        parser = QueryParser(QueryParser.grammar_additions())
+        _parse_tls.parser = parser
+    return parser
+
+
 _IGNORED_QUERY_PREFIXES = ("embla", "hæ embla", "hey embla", "sæl embla")
 _IGNORED_PREFIX_RE = r"^({0})\s*".format("|".join(_IGNORED_QUERY_PREFIXES))
 
@@ -179,6 +230,13 @@ class Query:
     _parser = None
     _processors = []
     _help_texts = dict()
+    # Hash of the query grammar, i.e. the main grammar file
+    # and the fragments from the query processor modules
+    _grammar_hash = None
+    # Negative cache of query strings that recently failed to parse
+    # with the current query grammar, mapped to their error codes
+    _failed_queries = cachetools.LRUCache(_FAILED_QUERY_CACHE_SIZE)
+    _failed_queries_lock = threading.Lock()
 
     def __init__(self, session, query, voice, auto_uppercase, location, client_id):
         q = self._preprocess_query_string(query)
@@ -218,7 +276,8 @@ class Query:
         # This should be a dict that can be represented in JSON
         self._context = None
 
-    def _preprocess_query_string(self, q):
+    @staticmethod
+    def _preprocess_query_string(q):
         """ Preprocess the query string prior to further analysis """
         if not q:
             return q
@@ -274,14 +333,26 @@ class Query:
 
         # Coalesce the grammar additions from the fragments
         grammar_additions = "\n".join(grammar_fragments)
+        # Calculate a hash of the query grammar. If it has changed,
+        # previously failed query strings may now be parseable.
+        h = hashlib.md5(grammar_additions.encode("utf-8"))
+        try:
+            h.update(str(os.path.getmtime(Fast_Parser._GRAMMAR_FILE)).encode("ascii"))
+        except OSError:
+            pass
+        grammar_hash = h.hexdigest()
+        with cls._failed_queries_lock:
+            if grammar_hash != cls._grammar_hash:
+                cls._failed_queries.clear()
+            cls._grammar_hash = grammar_hash
         # Initialize a singleton parser instance for queries,
         # with the nonterminal 'QueryRoot' as the grammar root
         cls._parser = QueryParser(grammar_additions)
 
     @staticmethod
-    def _parse(toklist):
+    def _parse(toklist, parser=None):
         """ Parse a token list as a query """
-        bp = Query._parser
+        bp = parser or Query._parser
         num_sent = 0
         num_parsed_sent = 0
         rdc = Reducer(bp.grammar)
@@ -323,8 +394,41 @@ class Query:
         result = dict(num_sent=num_sent, num_parsed_sent=num_parsed_sent)
         return result, trees
 
-    def parse(self, result):
-        """ Parse the query from its string, returning True if valid """
+    @staticmethod
+    def _tokenize_and_parse(q, auto_uppercase, parser=None):
+        """ Tokenize and parse a query string, returning a tuple of
+            (toklist, actual_q, parse_result, trees). This does not
+            modify any Query instance, so it can be called concurrently
+            for several query strings, with one parser per thread. """
+        toklist = tokenize(q, auto_uppercase=auto_uppercase and q.islower())
+        toklist = list(toklist)
+        # The following seems not to be needed and may complicate things
+        # toklist = list(recognize_entities(toklist, enclosing_session=self._session))
+
+        actual_q = correct_spaces(" ".join(t.txt for t in toklist if t.txt))
+        if actual_q:
+            actual_q = actual_q[0].upper() + actual_q[1:]
+            if not any(actual_q.endswith(s) for s in ("?", ".", "!")):
+                actual_q += "?"
+
+        parse_result, trees = Query._parse(toklist, parser)
+        return toklist, actual_q, parse_result, trees
+
+    @classmethod
+    def parse_in_background(cls, query, auto_uppercase):
+        """ Start tokenizing and parsing a query string on a worker thread,
+            returning a Future that can subsequently be passed to execute() """
+        q = (cls._preprocess_query_string(query.strip()) or "").strip()
+        if not q:
+            return None
+        return _parse_pool().submit(
+            lambda: cls._tokenize_and_parse(q, auto_uppercase, _thread_parser())
+        )
+
+    def parse(self, result, preparsed=None):
+        """ Parse the query from its string, returning True if valid.
+            If preparsed is given, it is a Future from parse_in_background()
+            that yields the result of tokenizing and parsing the string. """
         self._tree = None  # Erase previous tree, if any
         self._error = None  # Erase previous error, if any
         self._qtype = None  # Erase previous query type, if any
@@ -336,16 +440,24 @@ class Query:
             self.set_error("E_EMPTY_QUERY")
             return False
 
-        toklist = tokenize(q, auto_uppercase=self._auto_uppercase and q.islower())
-        toklist = list(toklist)
-        # The following seems not to be needed and may complicate things
-        # toklist = list(recognize_entities(toklist, enclosing_session=self._session))
+        # Check whether this query string recently failed to parse
+        # with the same grammar, in which case we don't try again
+        failure_key = self._failure_key(q)
+        with Query._failed_queries_lock:
+            error = Query._failed_queries.get(failure_key)
+        if error is not None:
+            self.set_error(error)
+            return False
 
-        actual_q = correct_spaces(" ".join(t.txt for t in toklist if t.txt))
-        if actual_q:
-            actual_q = actual_q[0].upper() + actual_q[1:]
-            if not any(actual_q.endswith(s) for s in ("?", ".", "!")):
-                actual_q += "?"
+        parsed = None
+        if preparsed is not None:
+            try:
+                parsed = preparsed.result()
+            except Exception as e:
+                logging.warning("Exception in background query parse: {0}".format(e))
+        if parsed is None:
+            parsed = Query._tokenize_and_parse(q, self._auto_uppercase)
+        toklist, actual_q, parse_result, trees = parsed
 
         # Update the beautified query string, as the actual_q string
         # probably has more correct capitalization
@@ -355,11 +467,9 @@ class Query:
             # Log the query string as seen by the parser
             print("Query is: '{0}'".format(actual_q))
 
-        parse_result, trees = Query._parse(toklist)
-
         if not trees:
             # No parse at all
-            self.set_error("E_NO_PARSE_TREES")
+            self._set_parse_failure(failure_key, "E_NO_PARSE_TREES")
             return False
 
         result.update(parse_result)
@@ -370,7 +480,7 @@ class Query:
             return False
         if result["num_parsed_sent"] != 1:
             # Unable to parse the single sentence
-            self.set_error("E_NO_PARSE")
+            self._set_parse_failure(failure_key, "E_NO_PARSE")
             return False
         if 1 not in trees:
             # No sentence number 1
@@ -387,6 +497,18 @@ class Query:
         self._toklist = toklist
         return True
 
+    def _failure_key(self, q):
+        """ Return the key of a query string in the failed query cache """
+        # Normalize whitespace, but not case, since capitalization
+        # can affect tokenization and parsing
+        return (self._auto_uppercase, " ".join(q.split()))
+
+    def _set_parse_failure(self, failure_key, error):
+        """ Set a parse error and remember the failed query string """
+        self.set_error(error)
+        with Query._failed_queries_lock:
+            Query._failed_queries[failure_key] = error
+
     def execute_from_plain_text(self):
         """ Attempt to execute a plain text query, without having to parse it """
         if not self._query:
@@ -626,7 +748,7 @@ class Query:
             result["answer"] = result["voice"] = help_text_func(lemma)
             result["valid"] = True
 
-    def execute(self):
+    def execute(self, preparsed=None):
         """ Check whether the parse tree is describes a query, and if so,
             execute the query, store the query answer in the result dictionary
             and return True """
@@ -641,7 +763,7 @@ class Query:
         # First, try to handle this from plain text, without parsing:
         # shortcut to a successful, plain response
         if not self.execute_from_plain_text():
-            if not self.parse(result):
+            if not self.parse(result, preparsed):
                 # Unable to parse the query
                 if Settings.DEBUG:
                     print("Unable to parse query, error {0}".format(self.error()))
@@ -779,7 +901,9 @@ def process_query(
     client_type=None,
     client_version=None,
     bypass_cache=False,
-    private=False
+    private=False,
+    parallel_hypotheses=None,
+    latency_budget=None
 ):
     """ Process an incoming natural language query.
         If voice is True, return a voice-friendly string to
@@ -789,9 +913,24 @@ def process_query(
         should be upper case (to the extent that it matters).
         The q parameter can either be a single query string
         or an iterable of strings that will be processed in
-        order until a successful one is found. """
+        order until a successful one is found.
+        If parallel_hypotheses is greater than 1, up to that many
+        of the query strings are tokenized and parsed concurrently.
+        If latency_budget is given, less likely query strings are
+        abandoned once that many seconds have elapsed. Both default
+        to the corresponding values in Settings. """
 
     now = datetime.utcnow()
+    t0 = time.monotonic()
+    if parallel_hypotheses is None:
+        parallel_hypotheses = Settings.QUERY_PARALLEL_HYPOTHESES
+    else:
+        parallel_hypotheses = min(
+            parallel_hypotheses,
+            max(_MAX_PARALLEL_HYPOTHESES, Settings.QUERY_PARALLEL_HYPOTHESES),
+        )
+    if latency_budget is None:
+        latency_budget = Settings.QUERY_LATENCY_BUDGET
     result = None
     client_id = client_id[:256] if client_id else None
     first_clean_q = None
@@ -805,14 +944,44 @@ def process_query(
         else:
             # This should be an array of strings,
             # in decreasing priority order
-            it = q
+            it = list(q)
+
+        preparsed = dict()
+        if parallel_hypotheses > 1 and len(it) > 1:
+            # Start tokenizing and parsing the most likely query strings
+            # concurrently; their results are collected in priority order below
+            if Query._parser is None:
+                Query.init_class()
+            # Make sure that the pool has a worker thread for each query string
+            _parse_pool(parallel_hypotheses)
+            for ix, qtext in enumerate(it[0:parallel_hypotheses]):
+                preparsed[ix] = Query.parse_in_background(qtext, auto_uppercase)
+
+        def cancel_pending():
+            """ Don't start parsing query strings that are no longer needed """
+            for future in preparsed.values():
+                if future is not None:
+                    future.cancel()
 
         # Iterate through the submitted query strings,
         # assuming that they are in decreasing order of probability,
         # attempting to execute them in turn until we find
         # one that works (or we're stumped)
 
-        for qtext in it:
+        for ix, qtext in enumerate(it):
+
+            future = preparsed.get(ix)
+            if ix > 0 and latency_budget is not None:
+                # Check whether we have time to try a less likely query string
+                remaining = latency_budget - (time.monotonic() - t0)
+                if future is not None and remaining > 0.0:
+                    wait([future], timeout=remaining)
+                    if not future.done():
+                        remaining = 0.0
+                if remaining <= 0.0:
+                    # Out of time: give up on the remaining query strings
+                    cancel_pending()
+                    break
 
             qtext = qtext.strip()
             clean_q = qtext.rstrip("?")
@@ -855,11 +1024,13 @@ def process_query(
                     key=a.key,
                 )
                 # !!! TBD: Log the cached answer as well?
+                cancel_pending()
                 return result
             query = Query(session, qtext, voice, auto_uppercase, location, client_id)
-            result = query.execute()
+            result = query.execute(preparsed=future)
             if result["valid"] and "error" not in result:
                 # Successful: our job is done
+                cancel_pending()
                 if not private:
                     # If not in private mode, log the result
                     try:
@@ -889,6 +1060,7 @@ def process_query(
                             # All other fields are set to NULL
                         )
                         session.add(qrow)
+                        QueriesQuery.count_query(session, now)
                     except Exception as e:
                         logging.error("Error logging query: {0}".format(e))
                 return result
@@ -926,5 +1098,6 @@ def process_query(
                 # All other fields are set to NULL
             )
             session.add(qrow)
+            QueriesQuery.count_query(session, now)
 
         return result
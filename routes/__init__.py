@@ -24,14 +24,18 @@
 
 """
 
-from typing import Dict
+from typing import Dict, Optional
 import threading
-import time
 import uuid
 import io
 import json
+import shutil
+import tempfile
 from functools import wraps
-from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import cachetools
 
 from flask import (
     Blueprint, jsonify, make_response, current_app, Response,
@@ -40,6 +44,8 @@ from flask import (
 from flask.ctx import RequestContext
 from werkzeug.exceptions import HTTPException, InternalServerError
 
+from settings import Settings
+
 
 # Maximum length of incoming GET/POST parameters
 _MAX_TEXT_LENGTH = 16384
@@ -50,6 +56,14 @@ _MAX_UUID_LENGTH = 36
 
 _TRUTHY = frozenset(("true", "1", "yes"))
 
+# Results of finished asynchronous tasks are kept for this many seconds
+_TASK_RESULT_TTL = 5 * 60
+_MAX_FINISHED_TASKS = 1000
+# Clients are asked to retry after this many seconds when the task queue is full
+_TASK_RETRY_AFTER = 10
+# Uploaded files larger than this are spooled to disk while waiting to be processed
+_MAX_UPLOAD_IN_MEMORY = 1024 * 1024
+
 cache = current_app.config["CACHE"]
 routes = Blueprint("routes", __name__)
 
@@ -135,10 +149,19 @@ def text_from_request(rq, *, post_field=None, get_field=None):
 # The following asynchronous support code is adapted from Miguel Grinberg's
 # PyCon 2016 "Flask at Scale" tutorial: https://github.com/miguelgrinberg/flack
 
-# A dictionary of currently living tasks
+# Running and queued tasks, by task id
 _tasks = dict()  # type: Dict[str, Dict]
+# Finished tasks, kept for a while so that clients can collect their results
+_finished = cachetools.TTLCache(
+    maxsize=_MAX_FINISHED_TASKS, ttl=_TASK_RESULT_TTL
+)  # type: Dict[str, Dict]
 _tasks_lock = threading.Lock()
 
+# Executors for asynchronous tasks and for CPU-bound work within them,
+# created on first use (after the settings have been read)
+_executor = None  # type: Optional[ThreadPoolExecutor]
+_process_executor = None  # type: Optional[ProcessPoolExecutor]
+
 
 def fancy_url_for(*args, **kwargs):
     """ url_for() replacement that works even when there is no request context """
@@ -155,34 +178,65 @@ def fancy_url_for(*args, **kwargs):
     return url_for(*args, **kwargs)
 
 
-@routes.before_app_first_request
-def before_first_request():
-    """ Start a background thread that cleans up old tasks """
+def _task_executor():
+    """ Return the thread pool that runs asynchronous tasks """
+    global _executor
+    with _tasks_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=max(Settings.TASK_WORKERS, 1),
+                thread_name_prefix="async-task",
+            )
+        return _executor
 
-    def clean_old_tasks():
-        """ This function cleans up old tasks from an in-memory data structure """
-        global _tasks
-        while True:
-            # Only keep tasks that are running or
-            # that finished less than 5 minutes ago
-            five_min_ago = datetime.utcnow() - timedelta(minutes=5)
-            with _tasks_lock:
-                _tasks = {
-                    task_id: task
-                    for task_id, task in _tasks.items()
-                    if 't' not in task or task['t'] > five_min_ago
-                }
-            time.sleep(60)
 
-    # Don't start the cleanup thread if we're only running tests
-    if not current_app.config["TESTING"]:
-        thread = threading.Thread(target=clean_old_tasks)
-        thread.start()
+def _process_pool():
+    """ Return the process pool for CPU-bound work within tasks,
+        or None if task processes are not enabled in the settings """
+    global _process_executor
+    if Settings.TASK_PROCESSES <= 0:
+        return None
+    with _tasks_lock:
+        if _process_executor is None:
+            _process_executor = ProcessPoolExecutor(
+                max_workers=Settings.TASK_PROCESSES
+            )
+        return _process_executor
+
+
+def map_in_processes(func, items):
+    """ Apply a CPU-bound function to each of the given items, typically
+        from within an asynchronous task, yielding the results in order as
+        they become available. If task processes are enabled in the
+        settings, the items are processed in parallel in worker processes,
+        so that the work doesn't contend for the GIL with request handling;
+        the function, the items and the results must then be picklable.
+        Otherwise, the items are simply processed in the current thread. """
+    global _process_executor
+    executor = _process_pool()
+    if executor is None:
+        for item in items:
+            yield func(item)
+        return
+    futures = [executor.submit(func, item) for item in items]
+    try:
+        for future in futures:
+            yield future.result()
+    except BrokenProcessPool:
+        # A worker process died: replace the pool for subsequent calls
+        with _tasks_lock:
+            if _process_executor is executor:
+                _process_executor = None
+        raise
+    finally:
+        # If the caller stops early, don't leave work in the queue
+        for future in futures:
+            future.cancel()
 
 
 class _FileProxy:
 
-    """ A hack that implements an in-memory proxy object for a Werkzeug FileStorage
+    """ A hack that implements a proxy object for a Werkzeug FileStorage
         instance, enabling it to be passed between threads """
 
     def __init__(self, fs):
@@ -191,10 +245,10 @@ class _FileProxy:
         self._mimetype = fs.mimetype
         self._mimetype_params = fs.mimetype_params
         self._content_type = fs.content_type
-        # !!! Note: this reads the entire file stream into memory.
-        # !!! A fancier method using temporary files could be applied here
-        # !!! when and if needed.
-        self._bytes = fs.read()
+        # Copy the file, keeping it in memory only if it is small, so that
+        # large uploads waiting in the task queue don't take up memory
+        self._file = tempfile.SpooledTemporaryFile(max_size=_MAX_UPLOAD_IN_MEMORY)
+        shutil.copyfileobj(fs.stream, self._file)
 
     @property
     def mimetype(self):
@@ -209,7 +263,8 @@ class _FileProxy:
         return self._content_type
 
     def read(self):
-        return self._bytes
+        self._file.seek(0)
+        return self._file.read()
 
 
 class _RequestProxy:
@@ -254,7 +309,8 @@ class _RequestProxy:
 
 def async_task(f):
     """ This decorator transforms a sync route into an asynchronous one
-        by running it in a background thread """
+        by running it on a bounded pool of background threads. If too many
+        tasks are already running or queued, a 429 response is returned. """
 
     @wraps(f)
     def wrapped(*args, **kwargs):
@@ -262,14 +318,18 @@ def async_task(f):
         # Assign a unique id to each asynchronous task
         task_id = uuid.uuid4().hex
 
-        def progress(ratio):
-            """ Function to call from the worker task to indicate progress. """
+        def progress(ratio, partial=None):
+            """ Function to call from the worker task to indicate progress,
+                optionally with a partial result that can be collected
+                by the client before the task finishes """
             # ratio is a float from 0.0 (just started) to 1.0 (finished)
-            _tasks[task_id]["progress"] = ratio
+            with _tasks_lock:
+                this_task["progress"] = ratio
+                if partial is not None:
+                    this_task.setdefault("partial", []).append(partial)
 
         def task(app, rq):
-            """ Run the decorated route function in a new thread """
-            this_task = _tasks[task_id]
+            """ Run the decorated route function in a worker thread """
             # Pretty ugly hack, but no better solution is apparent:
             # Create a fresh Flask RequestContext object, wrapping our
             # custom _RequestProxy object that can be safely passed between threads
@@ -288,25 +348,35 @@ def async_task(f):
                         # We want to find out if something happened, so reraise
                         raise
                 finally:
-                    # We record the time of the response, to help in garbage
-                    # collecting old tasks
-                    this_task["t"] = datetime.utcnow()
-
-        # Record the task, and then launch it
+                    # Move the task to the finished tasks, from which
+                    # it is evicted when its result has been kept long enough
+                    with _tasks_lock:
+                        # The partial results are no longer needed
+                        this_task.pop("partial", None)
+                        _tasks.pop(task_id, None)
+                        _finished[task_id] = this_task
+
+        # Create our own request proxy object that can be safely
+        # passed between threads, keeping the form data and uploaded files
+        # intact and available even after the original request has been closed
+        rq = _RequestProxy(request)
+        executor = _task_executor()
         with _tasks_lock:
-            _tasks[task_id] = dict(progress=0.0)
-            # Create our own request proxy object that can be safely
-            # passed between threads, keeping the form data and uploaded files
-            # intact and available even after the original request has been closed
-            rq = _RequestProxy(request)
-            new_task = threading.Thread(
-                target=task,
-                args=(current_app._get_current_object(), rq)
-            )
-
-        new_task.start()
-
-        # After starting the task on a new thread, we return a 202 response,
+            if len(_tasks) >= Settings.TASK_WORKERS + Settings.TASK_QUEUE_LIMIT:
+                # Saturated: ask the client to try again later
+                return (
+                    json.dumps(dict(valid=False, reason="Server busy")),
+                    429,  # TOO MANY REQUESTS
+                    {
+                        "Retry-After": str(_TASK_RETRY_AFTER),
+                        "Content-Type": "application/json; charset=utf-8",
+                    }
+                )
+            # Record the task, and then submit it
+            this_task = _tasks[task_id] = dict(progress=0.0)
+        executor.submit(task, current_app._get_current_object(), rq)
+
+        # After submitting the task, we return a 202 response,
         # with a link in the 'Location' header that the client can use
         # to obtain task status
         return (
@@ -325,19 +395,30 @@ def async_task(f):
 def get_status(task):
     """ Return the status of an asynchronous task. If this request returns a
         202 ACCEPTED status code, it means that task hasn't finished yet.
-        Else, the response from the task is returned (normally with a
-        200 OK status). """
+        The response then contains the progress of the task and any partial
+        results that it has published, starting with the one at the index
+        given in the 'since' URL parameter. The index to use in the next
+        status request is returned as 'next'. Else, the response from the
+        task is returned (normally with a 200 OK status). """
     task_id = task
+    try:
+        since = max(int(request.args.get("since", 0)), 0)
+    except ValueError:
+        since = 0
     with _tasks_lock:
-        task = _tasks.get(task_id)
+        task = _tasks.get(task_id) or _finished.get(task_id)
         if task is None:
             abort(404)
         if "rv" in task:
             # Task completed
             return task["rv"]
-        # Not completed: report progress
+        # Not completed: report progress and new partial results
+        status = dict(progress=task["progress"])
+        if "partial" in task:
+            status["partial"] = task["partial"][since:]
+            status["next"] = len(task["partial"])
         return (
-            json.dumps(dict(progress=task["progress"])),
+            json.dumps(status),
             202,  # ACCEPTED
             {
                 "Location": fancy_url_for("routes.get_status", task=task_id),
@@ -25,8 +25,10 @@
 
 from datetime import datetime
 import logging
+import json
 
-from flask import request, abort
+from flask import request, abort, Response, stream_with_context
+from flask import json as flask_json
 
 from settings import Settings
 
@@ -34,8 +36,9 @@ from tnttagger import ifd_tag
 from db import SessionContext
 from db.models import ArticleTopic, Query, Feedback
 from treeutil import TreeUtility
-from correct import check_grammar
+from correct import check_grammar, split_text, merge_stats
 from reynir.binparser import canonicalize_token
+from reynir.fastparser import Fast_Parser
 from article import Article as ArticleProxy
 from query import process_query
 from doc import SUPPORTED_DOC_MIMETYPES, MIMETYPE_TO_DOC_CLASS
@@ -43,13 +46,17 @@ from speech import get_synthesized_text_url
 
 
 from . import routes, better_jsonify, text_from_request, bool_from_request, restricted
-from . import _MAX_URL_LENGTH, _MAX_UUID_LENGTH
-from . import async_task
+from . import _MAX_URL_LENGTH, _MAX_UUID_LENGTH, _MAX_TEXT_LENGTH
+from . import async_task, map_in_processes
 
 # Maximum number of query string variants
 _MAX_QUERY_VARIANTS = 10
 # Maximum length of each query string
 _MAX_QUERY_LENGTH = 512
+# Maximum number of documents in a batch analysis request
+_MAX_BATCH_DOCUMENTS = 1000
+# Types of analysis available in batch requests
+_BATCH_TYPES = frozenset(("postag", "parse", "ifdtag"))
 # Synthetic location for use in testing
 _MIDEIND_LOCATION = (64.156896, -21.951200)  # Fiskislóð 31, 101 Reykjavík
 
@@ -136,7 +143,7 @@ def correct_api(version=1):
 @routes.route("/correct.task", methods=["POST"])
 @routes.route("/correct.task/v<int:version>", methods=["POST"])
 @restricted  # This means that the route is only visible on a development server
-@async_task  # This means that the function is automatically run on a separate thread
+@async_task  # This means that the function is automatically run on a worker thread
 def correct_task(version=1):
     """ Correct text provided by the user, i.e. not coming from an article.
         This can be either an uploaded file or a string.
@@ -172,13 +179,63 @@ def correct_task(version=1):
             logging.warning("Exception in correct_task(): {0}".format(e))
             return better_jsonify(valid=False, reason="Invalid request")
 
-    pgs, stats = check_grammar(text, progress_func=request.progress_func)
+    # Check the text in chunks of paragraphs, in parallel if task processes
+    # are enabled, and publish the result for each chunk as it becomes
+    # available so that the client can display it before the whole
+    # text has been checked
+    chunks = split_text(text)
+    num_chunks = len(chunks)
+    if num_chunks > 1 and Settings.TASK_PROCESSES > 0:
+        results = map_in_processes(check_grammar, chunks)
+    else:
+        # Checking in this thread: report progress within each chunk
+        # as well, scaled to the chunk's share of the text
+        results = (
+            check_grammar(
+                chunk,
+                progress_func=lambda ratio, i=i: request.progress_func(
+                    (i + ratio) / num_chunks
+                ),
+            )
+            for i, chunk in enumerate(chunks)
+        )
+    pgs = []
+    stats = []
+    for i, (chunk_pgs, chunk_stats) in enumerate(results):
+        pgs.extend(chunk_pgs)
+        stats.append(chunk_stats)
+        request.progress_func((i + 1) / num_chunks, partial=chunk_pgs)
+    stats = merge_stats(stats)
 
     # Return the annotated paragraphs/sentences and stats
     # in a JSON structure to the client
     return better_jsonify(valid=True, result=pgs, stats=stats, text=text)
 
 
+def _concatenate_paragraphs(pgs):
+    """ Amalgamate a list of paragraphs into a single list of sentences """
+    if pgs:
+        # Only process the first paragraph, if there are many of them
+        if len(pgs) == 1:
+            pgs = pgs[0]
+        else:
+            # More than one paragraph: gotta concatenate 'em all
+            pa = []
+            for pg in pgs:
+                pa.extend(pg)
+            pgs = pa
+    return pgs
+
+
+def _canonicalize_tokens(sents):
+    """ Transform the token representation into a
+        nice canonical form for outside consumption """
+    for sent in sents:
+        # err = any("err" in t for t in sent)
+        for t in sent:
+            canonicalize_token(t)
+
+
 @routes.route("/postag.api", methods=["GET", "POST"])
 @routes.route("/postag.api/v<int:version>", methods=["GET", "POST"])
 def postag_api(version=1):
@@ -195,22 +252,8 @@ def postag_api(version=1):
     with SessionContext(commit=True) as session:
         pgs, stats, register = TreeUtility.tag_text(session, text, all_names=True)
         # Amalgamate the result into a single list of sentences
-        if pgs:
-            # Only process the first paragraph, if there are many of them
-            if len(pgs) == 1:
-                pgs = pgs[0]
-            else:
-                # More than one paragraph: gotta concatenate 'em all
-                pa = []
-                for pg in pgs:
-                    pa.extend(pg)
-                pgs = pa
-        for sent in pgs:
-            # Transform the token representation into a
-            # nice canonical form for outside consumption
-            # err = any("err" in t for t in sent)
-            for t in sent:
-                canonicalize_token(t)
+        pgs = _concatenate_paragraphs(pgs)
+        _canonicalize_tokens(pgs)
 
     # Return the tokens as a JSON structure to the client
     return better_jsonify(valid=True, result=pgs, stats=stats, register=register)
@@ -232,21 +275,99 @@ def parse_api(version=1):
     with SessionContext(commit=True) as session:
         pgs, stats, register = TreeUtility.parse_text(session, text, all_names=True)
         # In this case, we should always get a single paragraph back
-        if pgs:
-            # Only process the first paragraph, if there are many of them
-            if len(pgs) == 1:
-                pgs = pgs[0]
-            else:
-                # More than one paragraph: gotta concatenate 'em all
-                pa = []
-                for pg in pgs:
-                    pa.extend(pg)
-                pgs = pa
+        pgs = _concatenate_paragraphs(pgs)
 
     # Return the tokens as a JSON structure to the client
     return better_jsonify(valid=True, result=pgs, stats=stats, register=register)
 
 
+@routes.route("/batch.api", methods=["POST"])
+@routes.route("/batch.api/v<int:version>", methods=["POST"])
+def batch_api(version=1):
+    """ API to analyze a batch of texts in a single request. The request body
+        is a JSON array of documents, each of which is either a string or an
+        object with a 'text' field and an optional 'id' field. The 'type' URL
+        parameter selects the analysis: 'postag' (the default), 'parse' or
+        'ifdtag', with results as from the corresponding single-text APIs.
+        All documents are processed with the same parser and database
+        session, and the results are streamed back as newline-delimited
+        JSON (NDJSON), one line per document, in order. """
+    if not (1 <= version <= 1):
+        # Unsupported version
+        return better_jsonify(valid=False, reason="Unsupported version")
+
+    kind = request.args.get("type", "postag")
+    if kind not in _BATCH_TYPES:
+        return better_jsonify(valid=False, reason="Unsupported type")
+    docs = request.get_json(force=True, silent=True)
+    if not isinstance(docs, list):
+        return better_jsonify(valid=False, reason="Invalid request")
+    if len(docs) > _MAX_BATCH_DOCUMENTS:
+        return better_jsonify(valid=False, reason="Too many documents")
+
+    def documents():
+        """ Yield an (id, text) tuple for each document, where
+            the text is None if the document is invalid """
+        for ix, doc in enumerate(docs):
+            if isinstance(doc, str):
+                yield ix, doc[0:_MAX_TEXT_LENGTH]
+            elif isinstance(doc, dict) and isinstance(doc.get("text"), str):
+                yield doc.get("id", ix), doc["text"][0:_MAX_TEXT_LENGTH]
+            else:
+                yield ix, None
+
+    # Tag sets of unknown words, shared between the documents
+    unknown_cache = dict()
+
+    def analyze(doc_id, text, parser, session):
+        """ Analyze a single document and return a result dict """
+        if text is None:
+            return dict(id=doc_id, valid=False, reason="Invalid document")
+        if kind == "ifdtag":
+            pgs = ifd_tag(text, unknown_cache)
+            return dict(id=doc_id, valid=bool(pgs), result=pgs)
+        if kind == "postag":
+            pgs, stats, register = TreeUtility.raw_tag_text(
+                parser, session, text, all_names=True
+            )
+            pgs = _concatenate_paragraphs(pgs)
+            _canonicalize_tokens(pgs)
+        else:
+            pgs, stats, register = TreeUtility.raw_parse_text(
+                parser, session, text, all_names=True
+            )
+            pgs = _concatenate_paragraphs(pgs)
+        return dict(id=doc_id, valid=True, result=pgs, stats=stats, register=register)
+
+    def generate():
+        """ Generate the NDJSON response, one line per document """
+        with SessionContext(commit=True) as session:
+            with Fast_Parser(verbose=False) as parser:
+                for doc_id, text in documents():
+                    try:
+                        # Serialize with the app's JSON encoder, as jsonify() does,
+                        # so that a document that can't be serialized is
+                        # reported as invalid instead of breaking the stream
+                        line = flask_json.dumps(
+                            analyze(doc_id, text, parser, session), ensure_ascii=False
+                        )
+                    except Exception as e:
+                        logging.warning("Exception in batch_api(): {0}".format(e))
+                        # Roll back any failed transaction, so that the
+                        # session remains usable for the following documents
+                        session.rollback()
+                        line = flask_json.dumps(
+                            dict(id=doc_id, valid=False, reason="Error in analysis"),
+                            ensure_ascii=False,
+                        )
+                    yield line + "\n"
+
+    return Response(
+        stream_with_context(generate()),
+        content_type="application/x-ndjson; charset=utf-8",
+    )
+
+
 @routes.route("/article.api", methods=["GET", "POST"])
 @routes.route("/article.api/v<int:version>", methods=["GET", "POST"])
 def article_api(version=1):
@@ -511,6 +632,16 @@ def feedback_api(version=1):
     return better_jsonify(valid=False)
 
 
+@routes.route("/dbpool.api", methods=["GET"])
+def dbpool_api():
+    """ Return database connection pool metrics for this worker process,
+        for monitoring. Only available locally or in debug mode. """
+    if not Settings.DEBUG and request.remote_addr not in ("127.0.0.1", "::1"):
+        abort(404)
+    # pylint: disable=no-member
+    return better_jsonify(valid=True, pool=SessionContext.db.pool_status())
+
+
 @routes.route("/exit.api", methods=["GET"])
 def exit_api():
     """ Allow a server to be remotely terminated if running in debug mode """
@@ -32,12 +32,13 @@ from flask import render_template, request, redirect, url_for
 import reynir
 from reynir.fastparser import ParseForestFlattener
 
-from db import SessionContext, desc, dbfunc
-from db.models import Person, Article, ArticleTopic, Entity
+from db import SessionContext, desc
+from db.models import Article, ArticleTopic
 
 from settings import Settings
 from article import Article as ArticleProxy
 from search import Search
+from suggest import SuggestionIndex, MAX_SUGGESTIONS
 from treeutil import TreeUtility
 from images import get_image_url, update_broken_image_url, blacklist_image_url
 from doc import SUPPORTED_DOC_MIMETYPES
@@ -441,32 +442,29 @@ def suggest(limit=10):
     if not prefix:
         return better_jsonify(suggestions=suggestions)
 
-    with SessionContext(read_only=True) as session:
-        name = txt[len(prefix) :].strip()
-        model_col = None
-
-        # Hver er Jón Jónsson ?
-        if prefix is whois_prefix and name[0].isupper():
-            model_col = Person.name
-        # Hver er seðlabankastjóri?
-        elif prefix is whois_prefix:
-            model_col = Person.title
-        # Hvað er UNESCO?
-        elif prefix is whatis_prefix:
-            model_col = Entity.name
+    name = txt[len(prefix) :].strip()
+    if not name:
+        return better_jsonify(suggestions=suggestions)
 
-        q = (
-            session.query(model_col, dbfunc.count(Article.id).label("total"))
-            .filter(model_col.ilike(name + "%"))
-            .join(Article)
-            .group_by(model_col)
-            .order_by(desc("total"))
-            .limit(limit)
-            .all()
-        )
+    try:
+        limit = min(int(limit), MAX_SUGGESTIONS)
+    except ValueError:
+        limit = MAX_SUGGESTIONS
+
+    # Hver er Jón Jónsson ?
+    if prefix is whois_prefix and name[0].isupper():
+        kind = "person_name"
+    # Hver er seðlabankastjóri?
+    elif prefix is whois_prefix:
+        kind = "person_title"
+    # Hvað er UNESCO?
+    else:
+        kind = "entity_name"
+
+    q = SuggestionIndex.lookup(kind, name, limit)
 
-        prefix = prefix[:1].upper() + prefix[1:].lower()
-        suggestions = [{"value": (prefix + p[0] + "?"), "data": ""} for p in q]
+    prefix = prefix[:1].upper() + prefix[1:].lower()
+    suggestions = [{"value": (prefix + p[0] + "?"), "data": ""} for p in q]
 
     return better_jsonify(suggestions=suggestions)
 
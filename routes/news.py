@@ -22,7 +22,7 @@
 """
 
 
-from . import routes, max_age, better_jsonify
+from . import routes, max_age, cache, better_jsonify
 
 from datetime import datetime, timedelta
 from flask import request, render_template
@@ -162,6 +162,7 @@ def fetch_articles(
 
 
 @routes.route("/news")
+@cache.cached(timeout=5 * 60, key_prefix="news", query_string=True)
 @max_age(seconds=60)
 def news():
     """ Handler for a page with a list of articles + pagination """
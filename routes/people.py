@@ -27,8 +27,7 @@ from . import routes, max_age, cache, restricted
 import json
 from pprint import pprint
 from datetime import datetime, timedelta
-from collections import defaultdict, Counter
-from itertools import permutations
+from collections import defaultdict
 
 from flask import request, render_template
 
@@ -36,6 +35,7 @@ from settings import changedlocale
 
 from db import SessionContext, desc
 from db.models import Person, Article, Root, Word
+from db.queries import PersonGraphQuery
 
 from reynir import correct_spaces
 from reynir.bindb import BIN_Db
@@ -155,57 +155,28 @@ _DEFAULT_NUM_PERSONS_GRAPH = 50
 def graph_data(num_persons=_DEFAULT_NUM_PERSONS_GRAPH):
     """ Get and prepare data for people graph """
     with SessionContext(read_only=True) as session:
-        # Find all persons mentioned in articles that
-        # have at least two names (i.e. match whitespace)
-        q = (
-            session.query(Word.stem, Word.article_id, Word.cat)
-            .filter(Word.cat.like("person_%"))
-            .filter(Word.stem.like("% %"))
+        # Find the most frequently mentioned persons that have at least
+        # two names, and the number of articles where any two of them
+        # are mentioned together
+        persons, links = PersonGraphQuery.top(num_persons, enclosing_session=session)
+
+    names = {name: idx for idx, (name, _) in enumerate(persons)}
+
+    # Create final link and node data structures. Each link is
+    # given double weight, as each pair of names was previously
+    # counted in both directions.
+    links = [
+        {"source": names[a], "target": names[b], "weight": 2 * cnt}
+        for a, b, cnt in links
+    ]
+    nodes = []
+    for name, cnt in persons:
+        # TODO: Normalize influence
+        nodes.append(
+            {"name": name, "id": names[name], "influence": cnt / 7, "zone": 0}
         )
-        res = q.all()
-
-        # Count number of occurrences of each name
-        cnt = Counter()
-        for name, _, _ in res:
-            cnt[name] += 1
-
-        # Get most common names
-        names = [name for name, freq in cnt.most_common(num_persons)]
-
-        # Generate dict mapping article ids to a set of top names mentioned
-        articles = defaultdict(set)
-        for name, art_id, _ in res:
-            if name in names:
-                articles[art_id].add(name)
-
-        # Find all links
-        nlinks = defaultdict(int)
-        for a_id, persons in articles.items():
-            if len(persons) < 2:
-                # We need at least two names to establish link
-                continue
-
-            # Find all permutations of people mentioned in article
-            perm = list(permutations(persons, 2))
-            for a, b in perm:
-                # We use a sorted tuple as hashable dict key when
-                # counting number of connections between any two names
-                k = tuple(sorted([names.index(a), names.index(b)]))
-                nlinks[k] += 1
-
-        # Create final link and node data structures
-        links = [
-            {"source": k[0], "target": k[1], "weight": v} for k, v in nlinks.items()
-        ]
-        nodes = []
-        for idx, n in enumerate(names):
-            # print(cnt[n])
-            # TODO: Normalize influence
-            nodes.append({"name": n, "id": idx, "influence": cnt[n] / 7, "zone": 0})
-
-        dataset = {"nodes": nodes, "links": links}
-
-        return dataset
+
+    return {"nodes": nodes, "links": links}
 
 
 @routes.route("/people_recent")
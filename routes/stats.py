@@ -68,40 +68,44 @@ def chart_stats(session=None, num_days=7):
     }
 
     today = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+    start = today - timedelta(days=num_days - 1)
+    end = today + timedelta(days=1)
+    days = [start + timedelta(days=n) for n in range(num_days)]
     labels = []
-    sources = {}
-    parsed_data = []
-    query_data = []
 
-    # Get article count for each source for each day, and query count for each day
+    # Generate labels
     # We change locale to get localized date weekday/month names
     with changedlocale(category="LC_TIME"):
-        for n in range(0, num_days):
-            days_back = num_days - n - 1
-            start = today - timedelta(days=days_back)
-            end = today - timedelta(days=days_back - 1)
-
-            # Generate label
-            dfmtstr = "%-d. %b" if start < today - timedelta(days=6) else "%a %-d. %b"
-            labels.append(start.strftime(dfmtstr))
-
-            sent = 0
-            parsed = 0
-
-            # Get article count per source for day
-            # Also collect parsing stats for parse % chart
-            q = ChartsQuery.period(start, end, enclosing_session=session)
-            for (name, cnt, s, p) in q:
-                sources.setdefault(name, []).append(cnt)
-                sent += s
-                parsed += p
-
-            percent = round((parsed / sent) * 100, 2) if sent else 0
-            parsed_data.append(percent)
-
-            # Get query count for day
-            q = QueriesQuery.period(start, end, enclosing_session=session)
-            query_data.append(q[0][0])
+        for day in days:
+            dfmtstr = "%-d. %b" if day < today - timedelta(days=6) else "%a %-d. %b"
+            labels.append(day.strftime(dfmtstr))
+
+    # Get article count for each source for each day, and query count
+    # for each day, from the daily rollup tables
+    day_index = {day: n for n, day in enumerate(days)}
+    sources = {}
+    sent = [0] * num_days
+    parsed = [0] * num_days
+    q = ChartsQuery.daily(start, end, enclosing_session=session)
+    for (name, day, cnt, s, p) in q:
+        counts = sources.setdefault(name, [0] * num_days)
+        n = day_index.get(day)
+        if n is not None:
+            counts[n] = cnt
+            sent[n] += s
+            parsed[n] += p
+
+    # Collect parsing stats for parse % chart
+    parsed_data = [
+        round((p / s) * 100, 2) if s else 0 for (s, p) in zip(sent, parsed)
+    ]
+
+    query_data = [0] * num_days
+    q = QueriesQuery.daily(start, end, enclosing_session=session)
+    for (day, cnt) in q:
+        n = day_index.get(day)
+        if n is not None:
+            query_data[n] = cnt
 
     # Create datasets for bar chart
     datasets = []
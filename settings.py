@@ -36,6 +36,7 @@
 import os
 import codecs
 import locale
+import tempfile
 import threading
 
 from contextlib import contextmanager, closing
@@ -615,6 +616,30 @@ class Settings:
             .format(DB_PORT)
         )
 
+    # Database connection pool settings (per engine and process):
+    # number of pooled connections, additional connections allowed when
+    # the pool is exhausted, seconds to wait for a connection from the pool,
+    # seconds after which connections are recycled (-1 = never), and whether
+    # connections are tested for liveness when checked out of the pool
+    DB_POOL_SIZE = 5
+    DB_MAX_OVERFLOW = 10
+    DB_POOL_TIMEOUT = 30
+    DB_POOL_RECYCLE = 1800
+    DB_POOL_PRE_PING = True
+
+    # Optional read-only database server (typically a replica), used
+    # for read-only sessions. None means that the primary server is used.
+    DB_READONLY_HOSTNAME = os.environ.get("GREYNIR_DB_READONLY_HOST")
+    DB_READONLY_PORT = os.environ.get("GREYNIR_DB_READONLY_PORT")
+
+    try:
+        DB_READONLY_PORT = None if DB_READONLY_PORT is None else int(DB_READONLY_PORT)
+    except ValueError:
+        raise ConfigError(
+            "Invalid environment variable value: DB_READONLY_PORT={0}"
+            .format(DB_READONLY_PORT)
+        )
+
     # Flask server host and port
     HOST = os.environ.get("GREYNIR_HOST", "localhost")
     PORT = os.environ.get("GREYNIR_PORT", "5000")
@@ -646,6 +671,14 @@ class Settings:
             "similarity server on port {0}".format(PORT)
         )
 
+    # Web response cache, shared between worker processes:
+    # 'filesystem' (the default), 'redis', 'simple' (per process) or 'null'
+    CACHE_TYPE = os.environ.get("GREYNIR_CACHE_TYPE", "filesystem")
+    CACHE_DIR = os.environ.get(
+        "GREYNIR_CACHE_DIR", os.path.join(tempfile.gettempdir(), "greynir_cache")
+    )
+    CACHE_REDIS_URL = os.environ.get("GREYNIR_CACHE_REDIS_URL", "redis://localhost:6379/0")
+
     NN_PARSING_ENABLED = os.environ.get('NN_PARSING_ENABLED', False)
     try:
         NN_PARSING_ENABLED = bool(int(NN_PARSING_ENABLED))
@@ -672,6 +705,26 @@ class Settings:
     except ValueError:
         raise ConfigError("Invalid environment variable value: NN_TRANSLATION_PORT = {0}".format(NN_TRANSLATION_PORT))
 
+    # Query processing: number of alternative query strings (e.g. speech
+    # recognition hypotheses) to parse concurrently (0 or 1 = sequentially),
+    # and the latency budget in seconds for trying less likely alternatives
+    # (None = no limit)
+    QUERY_PARALLEL_HYPOTHESES = 0
+    QUERY_LATENCY_BUDGET = None
+
+    # Number of threads for parsing the sentences of a text concurrently
+    # in the text analysis APIs (0 or 1 = sequentially)
+    PARSE_THREADS = 0
+
+    # Asynchronous tasks (such as correction of uploaded documents), per
+    # worker process: number of tasks run concurrently, number of additional
+    # tasks that may wait in the queue before requests are refused, and
+    # number of processes for CPU-bound work within tasks (0 = none, i.e.
+    # the work is done in the task threads)
+    TASK_WORKERS = 4
+    TASK_QUEUE_LIMIT = 16
+    TASK_PROCESSES = 0
+
     # Configuration settings from the Greynir.conf file
 
     @staticmethod
@@ -691,6 +744,20 @@ class Settings:
                 Settings.DB_HOSTNAME = val
             elif par == "db_port":
                 Settings.DB_PORT = int(val)
+            elif par == "db_pool_size":
+                Settings.DB_POOL_SIZE = int(val)
+            elif par == "db_max_overflow":
+                Settings.DB_MAX_OVERFLOW = int(val)
+            elif par == "db_pool_timeout":
+                Settings.DB_POOL_TIMEOUT = int(val)
+            elif par == "db_pool_recycle":
+                Settings.DB_POOL_RECYCLE = -1 if val is None else int(val)
+            elif par == "db_pool_pre_ping":
+                Settings.DB_POOL_PRE_PING = bool(val)
+            elif par == "db_readonly_hostname":
+                Settings.DB_READONLY_HOSTNAME = val
+            elif par == "db_readonly_port":
+                Settings.DB_READONLY_PORT = None if val is None else int(val)
             elif par == "bin_db_hostname":
                 # This is no longer required and has been deprecated
                 pass
@@ -707,6 +774,18 @@ class Settings:
                 Settings.SIMSERVER_PORT = int(val)
             elif par == "debug":
                 Settings.DEBUG = bool(val)
+            elif par == "parse_threads":
+                Settings.PARSE_THREADS = int(val or 0)
+            elif par == "task_workers":
+                Settings.TASK_WORKERS = int(val)
+            elif par == "task_queue_limit":
+                Settings.TASK_QUEUE_LIMIT = int(val)
+            elif par == "task_processes":
+                Settings.TASK_PROCESSES = int(val or 0)
+            elif par == "query_parallel_hypotheses":
+                Settings.QUERY_PARALLEL_HYPOTHESES = int(val or 0)
+            elif par == "query_latency_budget":
+                Settings.QUERY_LATENCY_BUDGET = None if val is None else float(val)
             else:
                 raise ConfigError("Unknown configuration parameter '{0}'".format(par))
         except ValueError:
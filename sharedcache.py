@@ -0,0 +1,213 @@
+"""
+
+    Greynir: Natural language processing for Icelandic
+
+    Shared response cache module
+
+    Copyright (C) 2020 Miðeind ehf.
+
+       This program is free software: you can redistribute it and/or modify
+       it under the terms of the GNU General Public License as published by
+       the Free Software Foundation, either version 3 of the License, or
+       (at your option) any later version.
+       This program is distributed in the hope that it will be useful,
+       but WITHOUT ANY WARRANTY; without even the implied warranty of
+       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+       GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see http://www.gnu.org/licenses/.
+
+
+    This module implements a Flask-Caching cache whose backend is shared
+    between the worker processes of the web server, i.e. a directory in
+    the file system or a Redis server (which requires the redis package).
+    The backend is selected via the GREYNIR_CACHE_TYPE environment
+    variable; see settings.py.
+
+    The cached() decorator of the cache coalesces requests: when a
+    response is not found in the cache, only one worker (or thread)
+    computes it, while others requesting the same key wait for it to
+    appear in the cache, instead of computing it again.
+
+    Expensive pages can also be kept warm: a background thread then
+    recomputes them shortly before their cached responses expire,
+    so that visitors are always served from the cache.
+
+"""
+
+import time
+import uuid
+import hashlib
+import logging
+import threading
+from functools import wraps
+
+from flask import request
+from flask_caching import Cache
+
+from settings import Settings
+
+
+# Maximum time that a response computation holds its lock, in seconds
+_LOCK_TIMEOUT = 60
+# Interval between checks for a response computed by another worker, in seconds
+_POLL_INTERVAL = 0.05
+# Kept-warm responses are recomputed when this fraction of their timeout has passed
+_REWARM_AT = 0.8
+# Interval between checks for kept-warm responses that need recomputing, in seconds
+_WARM_CHECK_INTERVAL = 30.0
+
+
+def cache_config(cache_type=None):
+    """ Return a Flask-Caching configuration dict for the given cache type,
+        by default the one configured in the settings """
+    cache_type = cache_type or Settings.CACHE_TYPE
+    config = {"CACHE_TYPE": cache_type}
+    if cache_type == "filesystem":
+        config["CACHE_DIR"] = Settings.CACHE_DIR
+        config["CACHE_THRESHOLD"] = 2000
+    elif cache_type == "redis":
+        config["CACHE_REDIS_URL"] = Settings.CACHE_REDIS_URL
+        config["CACHE_KEY_PREFIX"] = "greynir:"
+    return config
+
+
+class SharedCache(Cache):
+
+    """ A Flask-Caching cache with request coalescing """
+
+    def cached(self, timeout=None, key_prefix="view/%s", query_string=False, **kwargs):
+        """ Decorator for caching view function responses, taking the same
+            main arguments as Cache.cached(). Other arguments are passed
+            to Cache.cached(), without request coalescing. """
+        if kwargs:
+            return super().cached(
+                timeout=timeout,
+                key_prefix=key_prefix,
+                query_string=query_string,
+                **kwargs
+            )
+
+        def make_cache_key():
+            """ Create a key that is independent of query argument order """
+            if not query_string:
+                if "%s" in key_prefix:
+                    return key_prefix % request.path
+                return key_prefix
+            args = str(sorted(request.args.items(multi=True))).encode("utf-8")
+            return "{0}/{1}{2}".format(
+                key_prefix, request.path, hashlib.md5(args).hexdigest()
+            )
+
+        def decorator(f):
+            @wraps(f)
+            def decorated_function(*args, **kwargs):
+                try:
+                    cache_key = make_cache_key()
+                    rv = self.cache.get(cache_key)
+                except Exception:
+                    logging.exception("Exception possibly due to cache backend")
+                    return f(*args, **kwargs)
+                if rv is not None:
+                    return rv
+                return self._compute(
+                    cache_key, timeout, lambda: f(*args, **kwargs)
+                )
+
+            decorated_function.uncached = f
+            decorated_function.cache_timeout = timeout
+            decorated_function.make_cache_key = make_cache_key
+            return decorated_function
+
+        return decorator
+
+    def _compute(self, cache_key, timeout, func):
+        """ Compute a response and store it in the cache, unless another
+            worker is already computing it, in which case we wait for that
+            worker to finish and return its response """
+        lock_key = cache_key + "/lock"
+        token = uuid.uuid4().hex
+        deadline = time.monotonic() + _LOCK_TIMEOUT
+        locked = False
+        try:
+            while not self.cache.add(lock_key, token, timeout=_LOCK_TIMEOUT):
+                # Another worker is computing the response: wait for it
+                if time.monotonic() >= deadline:
+                    # Waited too long: compute the response ourselves
+                    break
+                time.sleep(_POLL_INTERVAL)
+                rv = self.cache.get(cache_key)
+                if rv is not None:
+                    return rv
+            else:
+                locked = True
+                # We hold the lock: check again, in case the response
+                # was stored just before we acquired the lock
+                rv = self.cache.get(cache_key)
+                if rv is not None:
+                    self._release(lock_key, token)
+                    return rv
+        except Exception:
+            logging.exception("Exception possibly due to cache backend")
+        try:
+            rv = func()
+            if rv is not None:
+                try:
+                    self.cache.set(cache_key, rv, timeout=timeout)
+                except Exception:
+                    logging.exception("Exception possibly due to cache backend")
+            return rv
+        finally:
+            if locked:
+                self._release(lock_key, token)
+
+    def _release(self, lock_key, token):
+        """ Release a lock acquired in _compute(), unless it
+            has timed out and been acquired by another worker """
+        try:
+            if self.cache.get(lock_key) == token:
+                self.cache.delete(lock_key)
+        except Exception:
+            logging.exception("Exception possibly due to cache backend")
+
+    def _timeout(self, view):
+        """ Return the cache timeout of a view, in seconds """
+        return view.cache_timeout or self.config.get("CACHE_DEFAULT_TIMEOUT", 300)
+
+    def warm(self, app, url):
+        """ Recompute the response for the given URL, whose view must be
+            decorated with cached(), and store it in the cache. This is
+            done by only one worker in each period of _REWARM_AT times the
+            cache timeout, and True is returned if it was this one. """
+        with app.test_request_context(url):
+            view = app.view_functions.get(request.url_rule.endpoint)
+            if view is None or not hasattr(view, "make_cache_key"):
+                raise ValueError("No cached view for URL {0}".format(url))
+            cache_key = view.make_cache_key()
+            timeout = self._timeout(view)
+            # Claim the recomputation for this period
+            period = int(time.time() // (timeout * _REWARM_AT))
+            if not self.cache.add(
+                "{0}/warm/{1}".format(cache_key, period), 1, timeout=timeout
+            ):
+                return False
+            rv = view.uncached(**request.view_args)
+            if rv is not None:
+                self.cache.set(cache_key, rv, timeout=timeout)
+            return True
+
+    def keep_warm(self, app, urls):
+        """ Start a background thread that recomputes the responses for
+            the given URLs shortly before they expire from the cache """
+
+        def warm_urls():
+            while True:
+                for url in urls:
+                    try:
+                        self.warm(app, url)
+                    except Exception:
+                        logging.exception("Exception when warming {0}".format(url))
+                time.sleep(_WARM_CHECK_INTERVAL)
+
+        threading.Thread(target=warm_urls, name="cache-warmer", daemon=True).start()
@@ -0,0 +1,184 @@
+"""
+
+    Greynir: Natural language processing for Icelandic
+
+    Suggestion index module
+
+    Copyright (C) 2020 Miðeind ehf.
+
+       This program is free software: you can redistribute it and/or modify
+       it under the terms of the GNU General Public License as published by
+       the Free Software Foundation, either version 3 of the License, or
+       (at your option) any later version.
+       This program is distributed in the hope that it will be useful,
+       but WITHOUT ANY WARRANTY; without even the implied warranty of
+       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+       GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see http://www.gnu.org/licenses/.
+
+
+    This module implements an in-memory index of person names, person
+    titles and entity names, used for autocompletion of queries.
+
+    Strings are matched by prefix, ignoring case and accents, and the
+    completions are ranked by the number of articles they occur in.
+    The top completions for short prefixes are precomputed, while longer
+    prefixes are looked up by binary search in a sorted list of
+    normalized strings.
+
+    The index is loaded from the database on first use and rebuilt
+    periodically in a background thread, while the previous version
+    of the index continues to serve lookups.
+
+"""
+
+from bisect import bisect_left
+from heapq import nlargest
+import logging
+import threading
+import time
+import unicodedata
+
+from db import SessionContext, OperationalError, dbfunc
+from db.models import Article, Person, Entity
+
+
+# Interval between rebuilds of the suggestion index, in seconds
+_INDEX_REBUILD_INTERVAL = 10 * 60
+# Maximum number of suggestions returned for a prefix
+MAX_SUGGESTIONS = 10
+# Top suggestions are precomputed for prefixes up to this length
+_SHORT_PREFIX_LEN = 3
+
+# Letters that don't decompose into a base letter and an accent
+_LETTER_MAP = str.maketrans({"ð": "d", "þ": "th", "æ": "ae", "ø": "o", "ß": "ss"})
+
+
+def normalize(s):
+    """ Return a lowercase version of the string with accents removed,
+        for case and accent insensitive matching """
+    s = s.lower().translate(_LETTER_MAP)
+    return "".join(
+        c for c in unicodedata.normalize("NFKD", s) if not unicodedata.combining(c)
+    )
+
+
+class SuggestionTable:
+
+    """ A table of strings with counts, supporting lookups of the
+        strings with the highest counts that start with a given prefix """
+
+    def __init__(self, rows):
+        """ Build the table from an iterable of (string, count) tuples """
+        entries = sorted((normalize(s), s, cnt) for s, cnt in rows if s)
+        self._keys = [e[0] for e in entries]
+        self._entries = [(e[1], e[2]) for e in entries]
+        # Precompute the top suggestions for short prefixes, by adding
+        # the entries in descending order of count
+        short = dict()
+        for key, s, cnt in sorted(entries, key=lambda e: -e[2]):
+            for n in range(1, min(len(key), _SHORT_PREFIX_LEN) + 1):
+                top = short.setdefault(key[0:n], [])
+                if len(top) < MAX_SUGGESTIONS:
+                    top.append((s, cnt))
+        self._short = short
+
+    def __len__(self):
+        return len(self._keys)
+
+    def lookup(self, prefix, limit=MAX_SUGGESTIONS):
+        """ Return a list of up to limit (string, count) tuples for strings
+            starting with the given prefix, in descending order of count """
+        key = normalize(prefix)
+        if len(key) <= _SHORT_PREFIX_LEN:
+            return self._short.get(key, [])[0:limit]
+        lo = bisect_left(self._keys, key)
+        hi = bisect_left(self._keys, key + "\uffff", lo)
+        return nlargest(limit, self._entries[lo:hi], key=lambda e: e[1])
+
+
+class SuggestionIndex:
+
+    """ A process-wide index of person names, person titles and
+        entity names for query autocompletion """
+
+    # Kinds of suggestions and the database columns they come from
+    _COLUMNS = {
+        "person_name": Person.name,
+        "person_title": Person.title,
+        "entity_name": Entity.name,
+    }
+
+    _lock = threading.Lock()
+    # Kind -> SuggestionTable
+    _tables = None
+    _built = 0.0
+    _building = False
+
+    @classmethod
+    def _build(cls):
+        """ Build a new set of suggestion tables from the database """
+        tables = dict()
+        with SessionContext(read_only=True) as session:
+            for kind, col in cls._COLUMNS.items():
+                q = (
+                    session.query(col, dbfunc.count(Article.id))
+                    .join(Article)
+                    .group_by(col)
+                )
+                tables[kind] = SuggestionTable(q.yield_per(10000))
+        return tables
+
+    @classmethod
+    def _rebuild(cls):
+        """ Rebuild the index, replacing the previous version when done """
+        try:
+            tables = cls._build()
+            with cls._lock:
+                cls._tables = tables
+        except OperationalError as e:
+            logging.warning("SQL error in SuggestionIndex._rebuild(): {0}".format(e))
+        finally:
+            with cls._lock:
+                cls._built = time.monotonic()
+                cls._building = False
+
+    @classmethod
+    def _refresh(cls):
+        """ Ensure that the index is loaded, and start a background
+            rebuild if it is getting old """
+        if cls._tables is None:
+            with cls._lock:
+                if cls._tables is None:
+                    # First use: we have to wait for the index.
+                    # Note that the lock is held while building.
+                    try:
+                        cls._tables = cls._build()
+                    except OperationalError as e:
+                        logging.warning(
+                            "SQL error in SuggestionIndex._refresh(): {0}".format(e)
+                        )
+                        return
+                    cls._built = time.monotonic()
+            return
+        if time.monotonic() - cls._built < _INDEX_REBUILD_INTERVAL:
+            return
+        with cls._lock:
+            if cls._building:
+                return
+            cls._building = True
+        threading.Thread(
+            target=cls._rebuild, name="suggestion-index", daemon=True
+        ).start()
+
+    @classmethod
+    def lookup(cls, kind, prefix, limit=MAX_SUGGESTIONS):
+        """ Return a list of up to limit (string, count) tuples for
+            strings of the given kind starting with the given prefix """
+        cls._refresh()
+        tables = cls._tables
+        if not tables or not prefix:
+            return []
+        return tables[kind].lookup(prefix, limit)
@@ -96,6 +96,96 @@ def test_api(client):
         assert resp.content_type.startswith(API_CONTENT_TYPE)
 
 
+def test_batch_api(client):
+    """ Test the batch analysis API, which returns NDJSON """
+    import json
+
+    docs = ["Hér er texti.", dict(id="b", text="Annar texti er hér."), 42]
+    resp = client.post("/batch.api?type=postag", json=docs)
+    assert resp.content_type.startswith("application/x-ndjson")
+    lines = [json.loads(line) for line in resp.get_data(as_text=True).splitlines()]
+    assert [line["id"] for line in lines] == [0, "b", 2]
+    assert lines[0]["valid"] and lines[1]["valid"] and not lines[2]["valid"]
+    assert lines[1]["result"][0][0]["x"] == "Annar"
+
+    resp = client.post("/batch.api?type=unknown", json=docs)
+    assert resp.content_type.startswith(API_CONTENT_TYPE)
+    assert not resp.get_json()["valid"]
+
+
+def _correct_task_stub(release=None):
+    """ Return a replacement for check_grammar() in correct_task(),
+        which waits for the release event, if given """
+
+    def check_grammar(text, progress_func=None):
+        if release is not None:
+            release.wait(10.0)
+        return [], dict(num_tokens=0, num_sentences=0, num_parsed=0, ambiguity=0.0)
+
+    return check_grammar
+
+
+def _wait_for_task(client, location):
+    """ Poll the status of an asynchronous task until it has finished """
+    import time
+
+    for _ in range(200):
+        resp = client.get(location)
+        if resp.status_code != 202:
+            break
+        time.sleep(0.05)
+    return resp
+
+
+def test_async_task_backpressure(client, monkeypatch):
+    """ Test that tasks are refused when the task pool is full """
+    import threading
+    import routes.api
+    from settings import Settings
+
+    release = threading.Event()
+    monkeypatch.setattr(routes.api, "check_grammar", _correct_task_stub(release))
+    monkeypatch.setattr(Settings, "TASK_WORKERS", 1)
+    monkeypatch.setattr(Settings, "TASK_QUEUE_LIMIT", 0)
+    monkeypatch.setattr(Settings, "TASK_PROCESSES", 0)
+    try:
+        resp = client.post("/correct.task", data=dict(text="Hér er texti."))
+        assert resp.status_code == 202
+        # The first task fills the pool, so the next one is refused
+        busy = client.post("/correct.task", data=dict(text="Hér er texti."))
+        assert busy.status_code == 429
+        assert busy.headers["Retry-After"]
+    finally:
+        release.set()
+    assert _wait_for_task(client, resp.headers["Location"]).status_code == 200
+    # Room again in the pool
+    resp = client.post("/correct.task", data=dict(text="Hér er texti."))
+    assert resp.status_code == 202
+    assert _wait_for_task(client, resp.headers["Location"]).status_code == 200
+
+
+def test_async_task_expiry(client, monkeypatch):
+    """ Test that the results of finished tasks expire """
+    import cachetools
+    import routes
+    import routes.api
+    from settings import Settings
+
+    now = [0.0]
+    finished = cachetools.TTLCache(maxsize=10, ttl=60, timer=lambda: now[0])
+    monkeypatch.setattr(routes, "_finished", finished)
+    monkeypatch.setattr(routes.api, "check_grammar", _correct_task_stub())
+    monkeypatch.setattr(Settings, "TASK_PROCESSES", 0)
+    resp = client.post("/correct.task", data=dict(text="Hér er texti."))
+    assert resp.status_code == 202
+    location = resp.headers["Location"]
+    assert _wait_for_task(client, location).status_code == 200
+    # The result can be collected again until it expires
+    assert client.get(location).status_code == 200
+    now[0] += 61
+    assert client.get(location).status_code == 404
+
+
 def test_del_query_history(client):
     """ Test query history deletion API. """
 
@@ -139,7 +229,35 @@ def test_nertokenizer():
 
 
 def test_postagger():
-    from postagger import NgramTagger
+    from postagger import NgramTagger, TagsetCache
+
+    cache = TagsetCache(maxsize=2)
+    assert cache.lookup("a", lambda: [("nken", 1.0)]) == [("nken", 1.0)]
+    taglist = cache.lookup("a", lambda: None)
+    assert taglist == [("nken", 1.0)]
+    # The caller gets a copy that it may modify
+    taglist.append(("e", 0.0))
+    cache.lookup("b", lambda: [("e", 1.0)])
+    cache.lookup("c", lambda: [("e", 1.0)])
+    # "a" has been evicted
+    assert cache.lookup("a", lambda: None) is None
+    stats = cache.stats()
+    assert (stats["size"], stats["hits"], stats["misses"]) == (2, 1, 4)
+
+    # The Viterbi search and the lookahead search agree on a simple case
+    tokens = [
+        [("fpven", 1.0)],
+        [("sfg3en", 0.5), ("aþ", 0.5)],
+        [("nkeo", 0.6), ("nkeþ", 0.4)],
+    ]
+    taggers = [NgramTagger(algorithm=a) for a in ("viterbi", "lookahead")]
+    for tagger in taggers:
+        for ngram in [("", "", "fpven"), ("", "fpven", "sfg3en"), ("fpven", "sfg3en", "nkeo")]:
+            tagger.cnt.add(ngram)
+    for tagger in taggers:
+        _, tags = tagger._most_likely(tokens)
+        assert tags == ["fpven", "sfg3en", "nkeo"]
+        assert tagger._most_likely([]) == (1.0, [])
 
 
 def test_query():
@@ -161,9 +279,37 @@ def test_search():
     from search import Search
 
 
-def test_tnttagger():
+def test_tnttagger(tmpdir):
     from tnttagger import TnT
 
+    tagger = TnT(C=True)
+    tagger.train(
+        [
+            [("Hún", "fpven"), ("á", "sfg3en"), ("hest", "nkeo")],
+            [("Hann", "fpken"), ("á", "sfg3en"), ("kött", "nkeo")],
+            [("Kötturinn", "nkeng"), ("er", "sfg3en"), ("á", "aþ"), ("borðinu", "nheþg")],
+            [("Hesturinn", "nkeng"), ("er", "sfg3en"), ("á", "aþ"), ("túni", "nheþ")],
+        ]
+    )
+    # Words in the model only, so that the unknown word tagger is not used
+    assert tagger.tag(["Hún", "á", "kött"]) == [
+        ("Hún", "fpven"), ("á", "sfg3en"), ("kött", "nkeo")
+    ]
+    assert tagger.tag(["Hesturinn", "er", "á", "borðinu"]) == [
+        ("Hesturinn", "nkeng"), ("er", "sfg3en"), ("á", "aþ"), ("borðinu", "nheþg")
+    ]
+    assert tagger.tag([]) == []
+    sents = [["Hún", "á", "kött"], [], ["Hesturinn", "er", "á", "borðinu"]]
+    assert tagger.tag_sents(sents) == [tagger.tag(sent) for sent in sents]
+
+    # Store the model in the compact format and load it again
+    fname = str(tmpdir.join("TnT-model.bin"))
+    tagger.store_compact(fname)
+    compact = TnT.load(fname)
+    assert compact.tag(["Hesturinn", "er", "á", "borðinu"]) == tagger.tag(
+        ["Hesturinn", "er", "á", "borðinu"]
+    )
+
 
 def test_geo():
     """ Test geography and location-related functions in geo.py """
@@ -283,6 +429,207 @@ def test_doc():
     os.chdir(prev_dir)
 
 
+def test_concurrent_parse(monkeypatch):
+    """ Test that parsing the sentences of a text concurrently
+        yields the same result as parsing them sequentially """
+    from settings import Settings
+    from treeutil import TreeUtility
+
+    txt = (
+        "Hundurinn gelti að kettinum í gær. Kötturinn hljóp upp í tré.\n\n"
+        "Jón Jónsson fór í búðina og keypti mjólk. "
+        "Hann var ánægður með verðið. Þetta er setning sem ekki þáttast vel vel vel."
+    )
+
+    def parse(threads):
+        monkeypatch.setattr(Settings, "PARSE_THREADS", threads)
+        with SessionContext(read_only=True) as session:
+            return TreeUtility.parse_text(session, txt, all_names=None)
+
+    pgs, stats, _ = parse(0)
+    c_pgs, c_stats, _ = parse(4)
+    assert c_pgs == pgs
+    for key in ("num_tokens", "num_sentences", "num_parsed", "num_combinations", "total_score"):
+        assert c_stats[key] == stats[key]
+    # The ambiguity is accumulated in the order in which the sentences finish
+    assert c_stats["ambiguity"] == pytest.approx(stats["ambiguity"])
+    assert stats["num_sentences"] == 5
+
+
+def test_person_graph():
+    """ Test that the incremental updates of the person graph order the
+        names of each pair in the same way as the rebuild query """
+    from collections import Counter
+    from db.queries import PersonGraphQuery
+
+    class Session:
+        def __init__(self):
+            self.params = []
+
+        def execute(self, q, params):
+            self.params.append(params)
+
+    session = Session()
+    names = ["Björn Jónsson", "Ásta Sif", "Anna Jóna"]
+    PersonGraphQuery.update(session, Counter(), Counter(names))
+    mentions, links = session.params
+    assert [m["name"] for m in mentions] == sorted(names)
+    pairs = [(d["name1"], d["name2"]) for d in links]
+    # Code point order, where Á comes after B
+    assert pairs == [
+        ("Anna Jóna", "Björn Jónsson"),
+        ("Anna Jóna", "Ásta Sif"),
+        ("Björn Jónsson", "Ásta Sif"),
+    ]
+    # The rebuild query compares the names in the "C" collation,
+    # which agrees with the code point order
+    with SessionContext(read_only=True) as session:
+        for name1, name2 in pairs:
+            assert session.execute(
+                'select cast(:a as text) collate "C" < cast(:b as text) collate "C"',
+                dict(a=name1, b=name2),
+            ).scalar()
+
+
+def test_correct_chunks():
+    """ Test the splitting of texts into chunks for correction in correct.py """
+    from correct import split_text, merge_stats
+
+    txt = "Fyrsta málsgrein.\n\nÖnnur málsgrein.\nÞriðja málsgrein er lengri."
+    assert split_text(txt) == [
+        "Fyrsta málsgrein.\nÖnnur málsgrein.\nÞriðja málsgrein er lengri."
+    ]
+    assert split_text(txt, chunk_size=20) == [
+        "Fyrsta málsgrein.",
+        "Önnur málsgrein.",
+        "Þriðja málsgrein er lengri.",
+    ]
+    assert split_text(txt, chunk_size=40) == [
+        "Fyrsta málsgrein.\nÖnnur málsgrein.",
+        "Þriðja málsgrein er lengri.",
+    ]
+    assert split_text("\n \n") == []
+
+    stats = merge_stats(
+        [
+            dict(num_tokens=2, num_sentences=1, num_parsed=1, ambiguity=1.0),
+            dict(num_tokens=6, num_sentences=2, num_parsed=2, ambiguity=2.0),
+        ]
+    )
+    assert stats == dict(num_tokens=8, num_sentences=3, num_parsed=3, ambiguity=1.75)
+
+
+def test_feedcache(tmpdir):
+    """ Test the stale-while-revalidate feed cache in feedcache.py """
+    import feedcache
+
+    feedcache._FEED_CACHE_DIR = str(tmpdir)
+    calls = []
+
+    @feedcache.cached_feed("test_feed", 3600)
+    def fetch():
+        calls.append(1)
+        return {"value": len(calls)}
+
+    assert fetch() == {"value": 1}
+    assert fetch() == {"value": 1}
+    assert len(calls) == 1
+
+    # Another process (here, another Feed instance) picks
+    # up the persisted value without fetching it again
+    other = feedcache.Feed("test_feed", fetch._fetch_func, 3600)
+    assert other.get() == {"value": 1}
+    assert len(calls) == 1
+
+
+def test_tzindex(tmpdir):
+    """ Test the precomputed timezone index in tzindex.py """
+    from tzindex import build_index, TimezoneIndex
+
+    class FakeTzWhere:
+        def tzNameAt(self, lat, lon, forceTZ=False):
+            if lat > 63.0:
+                return "Atlantic/Reykjavik"
+            return "Europe/London" if lon < 0.0 else "Europe/Paris"
+
+    fname = str(tmpdir.join("tz.idx"))
+    build_index(fname, cell=10.0, sub=4, tzw=FakeTzWhere())
+    index = TimezoneIndex(fname)
+    assert index.lookup(64.15, -21.95) == "Atlantic/Reykjavik"
+    assert index.lookup(51.5, -0.1) == "Europe/London"
+    assert index.lookup(48.9, 2.35) == "Europe/Paris"
+    assert index.lookup(-33.9, 151.2) == "Europe/Paris"
+
+    # An enclave within a cell, which contains neither the corners
+    # nor the center of the cell, is found by sampling subcell centers
+    class EnclaveTzWhere(FakeTzWhere):
+        def tzNameAt(self, lat, lon, forceTZ=False):
+            if 53.0 < lat < 54.5 and 3.0 < lon < 4.5:
+                return "Europe/Brussels"
+            return super().tzNameAt(lat, lon, forceTZ)
+
+    build_index(fname, cell=10.0, sub=4, tzw=EnclaveTzWhere())
+    index = TimezoneIndex(fname)
+    assert index.lookup(53.75, 3.75) == "Europe/Brussels"
+    assert index.lookup(56.0, 8.0) == "Europe/Paris"
+
+
+def test_sharedcache():
+    """ Test the response cache with request coalescing in sharedcache.py """
+    from flask import Flask
+    from sharedcache import SharedCache
+
+    test_app = Flask("test_sharedcache")
+    cache = SharedCache(test_app, config={"CACHE_TYPE": "simple"})
+    calls = []
+
+    @test_app.route("/test")
+    @cache.cached(timeout=60, key_prefix="test", query_string=True)
+    def view():
+        calls.append(1)
+        return "Response {0}".format(len(calls))
+
+    c = test_app.test_client()
+    assert c.get("/test?a=1&b=2").data == b"Response 1"
+    # The order of query arguments doesn't matter
+    assert c.get("/test?b=2&a=1").data == b"Response 1"
+    assert c.get("/test?a=2").data == b"Response 2"
+    assert len(calls) == 2
+
+    # Warming recomputes the cached response, once per period
+    assert cache.warm(test_app, "/test?a=1&b=2")
+    assert not cache.warm(test_app, "/test?b=2&a=1")
+    assert c.get("/test?a=1&b=2").data == b"Response 3"
+    assert len(calls) == 3
+
+
+def test_suggest():
+    """ Test prefix lookups in the suggestion index in suggest.py """
+    from suggest import SuggestionTable, normalize
+
+    assert normalize("Þórður Ástráðsson") == "thordur astradsson"
+
+    table = SuggestionTable(
+        [
+            ("Jón Jónsson", 5),
+            ("Jóna Jónsdóttir", 12),
+            ("Jón Ólafsson", 7),
+            ("Katrín Jakobsdóttir", 30),
+            ("", 100),
+        ]
+    )
+    assert len(table) == 4
+    assert table.lookup("j") == [
+        ("Jóna Jónsdóttir", 12),
+        ("Jón Ólafsson", 7),
+        ("Jón Jónsson", 5),
+    ]
+    assert table.lookup("Jon ", limit=1) == [("Jón Ólafsson", 7)]
+    assert table.lookup("jón ól") == [("Jón Ólafsson", 7)]
+    assert table.lookup("Katrin Jak") == [("Katrín Jakobsdóttir", 30)]
+    assert table.lookup("Bjarni") == []
+
+
 def test_numbers():
     """ Test number handling functionality in queries """
     from queries import numbers_to_neutral
@@ -530,6 +530,56 @@ def test_query_api(client):
 
 
 
+def test_query_alternatives():
+    """ Test processing of alternative query strings, in parallel and sequentially """
+
+    import query
+    from query import process_query
+
+    alternatives = ["blöb flöb glöb", "hvað er fimm sinnum tólf", "hvað er 2 plús 2"]
+    for parallel in (0, 3):
+        result = process_query(
+            alternatives, True, private=True, parallel_hypotheses=parallel
+        )
+        assert result["valid"]
+        assert "error" not in result
+        # The most likely successful alternative is chosen
+        assert result["answer"] == "60"
+    # The alternatives were parsed concurrently, on a pool
+    # with a worker thread for each of them
+    assert query._parse_executor_workers >= 3
+
+
+def test_failed_query_cache():
+    """ Test the negative cache of unparseable query strings """
+
+    from query import process_query, Query
+
+    garbage = "blöb flöb glöb"
+    r1 = process_query(garbage, True, private=True)
+    assert "error" in r1
+    assert (True, garbage) not in Query._failed_queries
+    assert (False, garbage) in Query._failed_queries
+    r2 = process_query(garbage, True, private=True)
+    assert r2["error"] == r1["error"]
+
+
+def test_circuit_breaker():
+    """ Test the circuit breaker used for external API requests """
+
+    from queries import _CircuitBreaker
+
+    cb = _CircuitBreaker(threshold=2, cooldown=60.0)
+    assert cb.allow("apis.is")
+    cb.failure("apis.is")
+    assert cb.allow("apis.is")
+    cb.failure("apis.is")
+    assert not cb.allow("apis.is")
+    assert cb.allow("example.com")
+    cb.success("apis.is")
+    assert cb.allow("apis.is")
+
+
 def test_query_utility_functions():
     """ Tests for various utility functions used by query modules. """
 
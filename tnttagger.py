@@ -23,6 +23,12 @@
     This module is based on the TnT Tagger module from the NLTK Project.
     It has been extensively simplified, adapted and optimized for speed.
 
+    Trained models can be stored as pickles, or in a compact format that
+    is memory-mapped when loaded (see TnTModel). To convert a pickled
+    model to the compact format, run this module as a main program:
+
+        python tnttagger.py [pickle_file [model_file]]
+
     The NLTK copyright notice and license follow:
     --------------------------------------------------------------------
 
@@ -51,17 +57,33 @@
 """
 
 import os
+import sys
+import mmap
 import time
+import struct
 import pickle
 import logging
+import threading
+import multiprocessing
 
 from math import log
+from array import array
+from bisect import bisect_left
+from functools import lru_cache
 from collections import defaultdict
 from contextlib import contextmanager
 
 from reynir.bindb import BIN_Db
 from reynir.bintokenizer import raw_tokenize, parse_tokens, paragraphs, TOK
-from postagger import IFD_Tagset, NgramTagger
+from postagger import IFD_Tagset, NgramTagger, TAGSET_CACHE
+
+
+# Compact model file format, see TnTModel
+_MAGIC = b"GRTNTMD1"
+_HEADER = struct.Struct("<8s12I")
+
+_TNT_MODEL_PICKLE = os.path.join("config", "TnT-model.pickle")
+_TNT_MODEL_FILE = os.path.join("config", "TnT-model.bin")
 
 
 @contextmanager
@@ -129,16 +151,35 @@ class UnknownWordTagger:
         self._ngram_tagger = NgramTagger()
 
     def tagset(self, word, at_sentence_start = False):
-        """ Return a list of (probability, tag) tuples for the given word """
-        toklist = list(parse_tokens(" ".join(word)))
-        token = toklist[0]
-        w = word[0]
+        """ Return a list of (probability, tag) tuples for the given word.
+            The result is cached in the process-wide tag set cache. """
+        key = ("unknown", tuple(word), at_sentence_start)
+        taglist = TAGSET_CACHE.lookup(key, lambda: self._tagset(word, at_sentence_start))
+        if taglist is None:
+            token = self._token(word)
+            if token.kind == TOK.WORD and token.val is None:
+                # The BÍN lookup failed: tag the word as one without
+                # meanings, but don't cache the result, so that the
+                # lookup is retried next time
+                taglist = self._ngram_tagger.tag_single_token(TOK.Word(token.txt, []))
+        return taglist
+
+    @staticmethod
+    def _token(word):
+        """ Return a token for the given word list """
+        return list(parse_tokens(" ".join(word)))[0]
+
+    def _tagset(self, word, at_sentence_start):
+        """ Look up the given word in BÍN and return its tag set,
+            or None if the lookup failed """
+        token = self._token(word)
         if token.kind == TOK.WORD and token.val is None:
             try:
                 with BIN_Db.get_db() as db:
                     w, m = db.lookup_word(token.txt, at_sentence_start)
             except Exception as e:
-                w, m = token.txt, []
+                logging.warning("Exception in UnknownWordTagger: {0}".format(e))
+                return None
             token = TOK.Word(w, m)
         return self._ngram_tagger.tag_single_token(token)
 
@@ -156,6 +197,237 @@ class UnknownWordTagger:
         return [ (w, 'Unk') ]
 
 
+def _pad8(n):
+    """ Return n rounded up to a multiple of 8 """
+    return (n + 7) & ~7
+
+
+class TnTModel:
+
+    """ A compiled TnT model, used for tagging. Tag states (tag, C) are
+        assigned integer ids, with 0 denoting the beginning of a sentence,
+        and the interpolation weights are applied in advance to the unigram,
+        bigram and trigram tag probabilities. The emission log probabilities
+        of the tags of each word in the vocabulary are also precomputed.
+
+        The model is kept in a single buffer in the compact file format
+        (see below), which is memory-mapped when the model is loaded from
+        a file, so it loads instantly and its pages are shared between
+        worker processes.
+
+        The file has the following structure (little-endian), with each
+        section padded to a multiple of 8 bytes:
+
+            Header: magic (8 bytes), beam size N, capitalization flag C,
+                number of states S, length of tag name block, number of
+                bigram entries, number of trigram contexts, number of
+                trigram entries, number of words V, length of word block,
+                number of emission entries, two reserved values (all uint32)
+            Tag names: the tag of each state, separated by newlines,
+                UTF-8 encoded
+            Capitalization flags: the C flag of each state (uint8)
+            Unigram probabilities: S float64 values
+            Bigrams: S + 1 offsets (uint32) into the following bigram
+                entries for each state, next state ids (uint32) and
+                probabilities (float64)
+            Trigrams: sorted context keys (uint32, state1 x S + state2),
+                offsets (uint32) for each context into the following
+                trigram entries, next state ids (uint32) and
+                probabilities (float64)
+            Vocabulary: V + 1 offsets (uint32) into the following block of
+                words, which are sorted and UTF-8 encoded
+            Emissions: V + 1 offsets (uint32) for each word into the
+                following emission entries, state ids (uint32) and
+                log probabilities (float64)
+    """
+
+    # Number of bigram and trigram rows kept as dicts for fast lookup
+    _ROW_CACHE_SIZE = 8192
+
+    def __init__(self, buf):
+        """ Initialize the model from a buffer in the compact format """
+        if sys.byteorder != "little":
+            raise ValueError("The TnT model requires a little-endian platform")
+        self._buf = buf
+        (
+            magic, self.N, C, S, names_len, nb, nt, ntt, V, words_len, ne, _, _
+        ) = _HEADER.unpack_from(buf, 0)
+        if magic != _MAGIC:
+            raise ValueError("Not a compact TnT model")
+        self.C = bool(C)
+        self.num_states = S
+        mv = memoryview(buf)
+        pos = _HEADER.size
+
+        def section(length, fmt=None):
+            nonlocal pos
+            data = mv[pos : pos + length]
+            pos += _pad8(length)
+            return data if fmt is None else data.cast(fmt)
+
+        self.tag_names = bytes(section(names_len)).decode("utf-8").split("\n")
+        cflags = bytes(section(S))
+        self.p_uni = section(S * 8, "d")
+        self._bi_off = section((S + 1) * 4, "I")
+        self._bi_tgt = section(nb * 4, "I")
+        self._bi_p = section(nb * 8, "d")
+        self._tri_keys = section(nt * 4, "I")
+        self._tri_off = section((nt + 1) * 4, "I")
+        self._tri_tgt = section(ntt * 4, "I")
+        self._tri_p = section(ntt * 8, "d")
+        self._word_off = section((V + 1) * 4, "I")
+        self._words_pos = pos
+        section(words_len)
+        self._em_off = section((V + 1) * 4, "I")
+        self._em_sid = section(ne * 4, "I")
+        self._em_lp = section(ne * 8, "d")
+        self._num_words = V
+        self._state_ids = {
+            (t, bool(c)): ix for ix, (t, c) in enumerate(zip(self.tag_names, cflags))
+        }
+        self.bigram = lru_cache(maxsize=self._ROW_CACHE_SIZE)(self._bigram)
+        self.trigram = lru_cache(maxsize=self._ROW_CACHE_SIZE)(self._trigram)
+
+    def state_id(self, tC):
+        """ Return the id of a (tag, C) state, or None if it is not in the model """
+        return self._state_ids.get(tC)
+
+    def _bigram(self, h):
+        """ Return a dict of next state ids and weighted
+            bigram probabilities following state h """
+        if h >= self.num_states:
+            # Not a state in the model
+            return dict()
+        lo, hi = self._bi_off[h], self._bi_off[h + 1]
+        return dict(zip(self._bi_tgt[lo:hi], self._bi_p[lo:hi]))
+
+    def _trigram(self, h1, h2):
+        """ Return a dict of next state ids and weighted trigram
+            probabilities following the states h1 and h2 """
+        if h1 >= self.num_states or h2 >= self.num_states:
+            # Not states in the model
+            return dict()
+        key = h1 * self.num_states + h2
+        ix = bisect_left(self._tri_keys, key)
+        if ix >= len(self._tri_keys) or self._tri_keys[ix] != key:
+            return dict()
+        lo, hi = self._tri_off[ix], self._tri_off[ix + 1]
+        return dict(zip(self._tri_tgt[lo:hi], self._tri_p[lo:hi]))
+
+    def emissions(self, word):
+        """ Return a list of (state id, log probability) tuples for the
+            tags of the given word, or None if the word is not known """
+        key = word.encode("utf-8")
+        buf = self._buf
+        off = self._word_off
+        base = self._words_pos
+        lo, hi = 0, self._num_words
+        while lo < hi:
+            mid = (lo + hi) // 2
+            w = buf[base + off[mid] : base + off[mid + 1]]
+            if w < key:
+                lo = mid + 1
+            elif w > key:
+                hi = mid
+            else:
+                a, b = self._em_off[mid], self._em_off[mid + 1]
+                return list(zip(self._em_sid[a:b], self._em_lp[a:b]))
+        return None
+
+    def write(self, filename):
+        """ Write the model to a file """
+        with open(filename, "wb") as f:
+            f.write(self._buf)
+
+    @classmethod
+    def from_file(cls, filename):
+        """ Load a model from a file, by memory-mapping it """
+        with open(filename, "rb") as f:
+            return cls(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+
+    @classmethod
+    def from_tagger(cls, tagger):
+        """ Compile a model from the frequency distributions of a trained tagger """
+        bos = ('BOS', False)
+        # State 0 is the beginning of sentence
+        states = [bos] + [tC for tC in tagger._uni if tC != bos]
+        ids = { tC: ix for ix, tC in enumerate(states) }
+        S = len(states)
+        assert S * S < 2 ** 32
+        uni = tagger._uni
+        p_uni = [ tagger._l1 * uni.freq(tC) for tC in states ]
+        log_uni = [ log(uni[tC]) if uni.get(tC) else 0.0 for tC in states ]
+
+        bi_off, bi_tgt, bi_p = [0], [], []
+        for h in states:
+            fd = tagger._bi.get(h)
+            if fd is not None:
+                for tC, cnt in fd.items():
+                    if cnt and tC in ids:
+                        bi_tgt.append(ids[tC])
+                        bi_p.append(tagger._l2 * fd.freq(tC))
+            bi_off.append(len(bi_tgt))
+
+        contexts = sorted(
+            (ids[h1] * S + ids[h2], fd)
+            for (h1, h2), fd in tagger._tri.items()
+            if h1 in ids and h2 in ids
+        )
+        tri_keys, tri_off, tri_tgt, tri_p = [], [0], [], []
+        for key, fd in contexts:
+            tri_keys.append(key)
+            for tC, cnt in fd.items():
+                if cnt and tC in ids:
+                    tri_tgt.append(ids[tC])
+                    tri_p.append(tagger._l3 * fd.freq(tC))
+            tri_off.append(len(tri_tgt))
+
+        # The capitalization flag of a known word's tags is determined
+        # by the word itself, so emissions are stored per state
+        words = sorted((w.encode("utf-8"), w) for w in tagger._wd)
+        word_off, em_off, em_sid, em_lp = [0], [0], [], []
+        word_blob = bytearray()
+        for wb, w in words:
+            word_blob += wb
+            word_off.append(len(word_blob))
+            C = tagger._C and w[0].isupper()
+            for t, cnt in tagger._wd[w].items():
+                sid = ids.get((t,C))
+                if cnt and sid is not None:
+                    em_sid.append(sid)
+                    em_lp.append(log(cnt) - log_uni[sid])
+            em_off.append(len(em_sid))
+
+        names = "\n".join(tC[0] for tC in states).encode("utf-8")
+        sections = [
+            names,
+            bytes(int(tC[1]) for tC in states),
+            array("d", p_uni).tobytes(),
+            array("I", bi_off).tobytes(),
+            array("I", bi_tgt).tobytes(),
+            array("d", bi_p).tobytes(),
+            array("I", tri_keys).tobytes(),
+            array("I", tri_off).tobytes(),
+            array("I", tri_tgt).tobytes(),
+            array("d", tri_p).tobytes(),
+            array("I", word_off).tobytes(),
+            bytes(word_blob),
+            array("I", em_off).tobytes(),
+            array("I", em_sid).tobytes(),
+            array("d", em_lp).tobytes(),
+        ]
+        buf = bytearray(
+            _HEADER.pack(
+                _MAGIC, tagger._N, int(tagger._C), S, len(names), len(bi_tgt),
+                len(tri_keys), len(tri_tgt), len(words), len(word_blob), len(em_sid), 0, 0
+            )
+        )
+        for section in sections:
+            buf += section
+            buf += bytes(_pad8(len(section)) - len(section))
+        return cls(bytes(buf))
+
+
 class TnT:
     """
     TnT - Statistical POS tagger
@@ -218,6 +490,8 @@ class TnT:
         self._C    = C
 
         self._unk = UnknownWordTagger()
+        # Compiled model for tagging, created when training is finished
+        self._model = None
 
         self._training = True # In training phase?
         self._count = 0 # Trained sentences
@@ -230,12 +504,14 @@ class TnT:
         """ Obtain the state of this object to be pickled """
         state = self.__dict__.copy()
         del state['_unk']
+        state.pop('_model', None)
         return state
 
     def __setstate__(self, state):
         """ Restore the state of this object from a pickle """
         self.__dict__.update(state)
         self._unk = UnknownWordTagger()
+        self._model = None
 
     def _freeze_N(self):
         """ Make sure all contained FreqDicts are 'frozen' """
@@ -251,6 +527,7 @@ class TnT:
             self._compute_lambda()
             # Training completed
             self._training = False
+            self._model = None
 
     @property
     def count(self):
@@ -264,14 +541,23 @@ class TnT:
 
     @staticmethod
     def load(filename):
-        """ Load a previously trained and stored model from file """
+        """ Load a previously trained and stored model from file,
+            either a pickle or a file in the compact format """
         try:
             with open(filename, "rb") as file:
+                if file.read(len(_MAGIC)) == _MAGIC:
+                    model = TnTModel.from_file(filename)
+                    tagger = TnT(N = model.N, C = model.C)
+                    tagger._training = False
+                    tagger._model = model
+                    return tagger
+                file.seek(0)
                 tagger = pickle.load(file)
             assert not tagger._training
             tagger._freeze_N()
             return tagger
-        except OSError:
+        except (OSError, ValueError) as e:
+            logging.warning("Unable to load TnT model from {0}: {1}".format(filename, e))
             return None
 
     def train(self, sentences):
@@ -391,7 +677,7 @@ class TnT:
         '''
         return -1 if v2 == 0 else v1 / v2
 
-    def tag_sents(self, sentences):
+    def tag_sents(self, sentences, unknown_cache=None):
         '''
         Tags each sentence in a list of sentences
         :param data:list of list of words
@@ -400,112 +686,179 @@ class TnT:
         Invokes tag(sent) function for each sentence
         compiles the results into a list of tagged sentences
         each tagged sentence is a list of (word, tag) tuples
+        The tag sets of unknown words are only looked up once for
+        all the sentences, using the given cache dict if any
         '''
-        return [ self.tag(sent) for sent in sentences ]
+        if unknown_cache is None:
+            unknown_cache = dict()
+        return [ self.tag(sent, unknown_cache) for sent in sentences ]
+
+    def _compile(self):
+        """ Compile the frequency distributions into a model that is
+            efficient for tagging """
+        self._model = TnTModel.from_tagger(self)
+
+    def store_compact(self, filename):
+        """ Store a previously trained model in a file in the compact
+            format, which can be loaded with load() but not trained further """
+        self._finish_training()
+        if self._model is None:
+            self._compile()
+        self._model.write(filename)
 
-    def tag(self, sentence):
+    def tag(self, sentence, unknown_cache=None):
         '''
         Tags a single sentence
         :param data: list of words
         :type data: [string,]
         :return: [(word, tag),]
-        Calls recursive function '_tagword'
-        to produce a list of tags
-        Associates the sequence of returned tags
-        with the correct words in the input sequence
+        Finds the most probable sequence of tags for the sentence
+        using the Viterbi algorithm over pairs of consecutive tags,
+        keeping at most N pairs at each word, and associates the
+        tags with the correct words in the input sequence
         returns a list of (word, tag) tuples
+        If a dict is passed as unknown_cache, the tag sets of
+        unknown words are looked up in it and stored there
         '''
         if self._training:
             self._finish_training()
+        if self._model is None:
+            self._compile()
 
         sent = list(sentence)
-        _wd = self._wd
-        _uni = self._uni
-        _bi = self._bi
-        _tri = self._tri
+        if not sent:
+            return []
+        model = self._model
+        num_states = model.num_states
+        p_uni = model.p_uni
         _C = self._C
+        # States for tags that don't occur in the model (from the
+        # unknown word tagger), local to this sentence
+        extra = dict()
 
-        current_state = [(0.0, [('BOS',False), ('BOS',False)])]
-        keyfunc = lambda x: x[0]
+        # The Viterbi scores: (previous state, current state) -> log probability
+        scores = { (0, 0): 0.0 }
+        # For each word, a dict of (previous state, current state) ->
+        # the state before the previous one, on the best path
+        backpointers = []
 
         for index, word in enumerate(sent):
 
-            new_state = []
-
             # if the Capitalisation is requested,
             # initalise the flag for this word
             C = _C and word[0].isupper()
 
-            # if word is known
-            # compute the set of possible tags
-            # and their associated log probabilities
-            if word in _wd:
-                self.known += 1
-
-                for (curr_sent_logprob, history) in current_state:
+            new_scores = dict()
+            back = dict()
 
-                    h1 = history[-1]
-                    h2 = tuple(history[-2:])
+            # if word is known
+            # obtain the set of possible tags
+            # and their associated log emission probabilities
+            candidates = model.emissions(word)
 
-                    for t in _wd[word]:
-                        tC = (t,C)
-                        p_uni = _uni.freq(tC)
-                        p_bi = _bi[h1].freq(tC)
-                        p_tri = _tri[h2].freq(tC)
-                        p_wd = _wd[word][t] / _uni[tC]
-                        p = self._l1 * p_uni + self._l2 * p_bi + self._l3 * p_tri
-                        p2 = log(p) + log(p_wd)
+            if candidates:
+                self.known += 1
 
-                        new_state.append((curr_sent_logprob + p2, history + [ tC ]))
+                for (h1, h2), lp in scores.items():
+                    bi = model.bigram(h2)
+                    tri = model.trigram(h1, h2)
+                    for sid, lp_wd in candidates:
+                        p = p_uni[sid] + bi.get(sid, 0.0) + tri.get(sid, 0.0)
+                        score = lp + log(p) + lp_wd
+                        key = (h2, sid)
+                        if key not in new_scores or score > new_scores[key]:
+                            new_scores[key] = score
+                            back[key] = h1
 
             else:
                 # otherwise a new word, set of possible tags is unknown
                 self.unknown += 1
 
                 taglist = None
-                if self._unk is not None:
+                key = (word, index == 0)
+                if unknown_cache is not None and key in unknown_cache:
+                    taglist = unknown_cache[key]
+                elif self._unk is not None:
                     # Apply the unknown word tagger
                     taglist = self._unk.tagset([word], index == 0)
+                    if unknown_cache is not None:
+                        unknown_cache[key] = taglist
                 if not taglist:
                     # if no unknown word tagger has been specified
                     # or no tag is found, use the tag 'Unk'
                     taglist = [ ('Unk', 1.0) ]
 
-                for (curr_sent_logprob, history) in current_state:
-                    for t, prob in taglist:
-                        new_state.append((curr_sent_logprob + log(prob), history + [ (t,C) ]))
-
-            # now have computed a set of possible new_states
-
-            # sort states by log prob
-            new_state.sort(reverse=True, key=keyfunc)
-
-            # set is now ordered greatest to least log probability
-            # del everything after N (threshold)
-            # this is the beam search cut
-            current_state = new_state[0:self._N]
-
-        # return the most probable tag history
-        tags = current_state[0][1]
-        return [ (w, tags[i + 2][0]) for i, w in enumerate(sent) ]
-
-
-# Global tagger singleton instance
+                candidates = []
+                for t, prob in taglist:
+                    tC = (t,C)
+                    sid = model.state_id(tC)
+                    if sid is None:
+                        sid = extra.get(tC)
+                        if sid is None:
+                            sid = extra[tC] = num_states + len(extra)
+                    candidates.append((sid, log(prob)))
+
+                for (h1, h2), lp in scores.items():
+                    for sid, lp_tag in candidates:
+                        score = lp + lp_tag
+                        key = (h2, sid)
+                        if key not in new_scores or score > new_scores[key]:
+                            new_scores[key] = score
+                            back[key] = h1
+
+            if len(new_scores) > self._N:
+                # Beam search cut: only keep the N most probable tag pairs
+                keep = sorted(new_scores, key=new_scores.get, reverse=True)
+                new_scores = { key: new_scores[key] for key in keep[0:self._N] }
+
+            scores = new_scores
+            backpointers.append(back)
+
+        # Follow the backpointers from the most probable final tag pair
+        names = model.tag_names + [
+            tC[0] for tC, sid in sorted(extra.items(), key=lambda x: x[1])
+        ]
+        h1, h2 = max(scores, key=scores.get)
+        tags = []
+        for back in reversed(backpointers):
+            tags.append(names[h2])
+            h1, h2 = back[(h1, h2)], h1
+        tags.reverse()
+        return [ (w, tags[i]) for i, w in enumerate(sent) ]
+
+
+# Global tagger singleton instance, False if no model could be loaded
 _TAGGER = None
+_TAGGER_LOCK = threading.Lock()
 # Translation dictionary
 _XLT = { "—" : "-", "–" : "-" }
 
-def ifd_tag(text):
-    """ Tokenize the given text and use a global singleton TnT tagger to tag it """
+def _load_tagger():
+    """ Load the global tagger the first time it's used, preferring
+        the compact model file to the pickle, which is much slower
+        to load and takes up more memory """
     global _TAGGER
     if _TAGGER is None:
-        # Load the tagger from a pickle the first time it's used
-        logging.info("Loading TnT model from {0}".format("config" + os.sep + "TnT-model.pickle"))
-        _TAGGER = TnT.load("config" + os.sep + "TnT-model.pickle")
-        if _TAGGER is None:
-            return [] # No tagger model - unable to tag
+        with _TAGGER_LOCK:
+            if _TAGGER is None:
+                fname = _TNT_MODEL_FILE
+                if not os.path.exists(fname):
+                    fname = _TNT_MODEL_PICKLE
+                logging.info("Loading TnT model from {0}".format(fname))
+                _TAGGER = TnT.load(fname) or False
+    return _TAGGER
+
+
+def ifd_tag(text, unknown_cache=None):
+    """ Tokenize the given text and use a global singleton TnT tagger to tag it.
+        All sentences of the text are tagged in a batch. To share lookups of
+        unknown words between batches, e.g. for many texts, pass the same
+        dict as unknown_cache for each of them. """
+    tagger = _load_tagger()
+    if not tagger:
+        return [] # No tagger model - unable to tag
     token_stream = raw_tokenize(text)
-    result = []
+    sentences = []
 
     def xlt(txt):
         """ Translate the token text as required before tagging it """
@@ -518,9 +871,67 @@ def ifd_tag(text):
         for _, sent in pg:
             toklist = [ xlt(t.txt) for t in sent if t.txt ]
             # print(f"Toklist: {toklist}")
-            tagged = _TAGGER.tag(toklist)
-            result.append(tagged)
+            sentences.append(toklist)
+
+    # Return a list of sentences, consisting of tokens
+    return tagger.tag_sents(sentences, unknown_cache)
+
+
+# Tagger instance in a worker process of tag_corpus()
+_WORKER_TAGGER = None
+
+
+def _init_corpus_worker(model_file):
+    """ Load the tagger in a worker process of tag_corpus() """
+    global _WORKER_TAGGER
+    _WORKER_TAGGER = TnT.load(model_file)
+
+
+def _tag_corpus_chunk(sentences):
+    """ Tag a chunk of sentences in a worker process of tag_corpus() """
+    if _WORKER_TAGGER is None:
+        raise ValueError("Unable to load TnT model in worker process")
+    return _WORKER_TAGGER.tag_sents(sentences)
+
+
+def tag_corpus(sentences, model_file=_TNT_MODEL_FILE, processes=None, chunk_size=100):
+    """ Tag an iterable of sentences (lists of words), typically from a
+        large corpus, in parallel in a pool of worker processes, each of which
+        loads the model from the given file. Using a model in the compact
+        format is recommended, since its pages are then shared between the
+        processes. Yields the tagged sentences, i.e. lists of (word, tag)
+        tuples, in order. """
+
+    def chunks():
+        chunk = []
+        for sent in sentences:
+            chunk.append(list(sent))
+            if len(chunk) >= chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    with multiprocessing.Pool(
+        processes, initializer=_init_corpus_worker, initargs=(model_file,)
+    ) as pool:
+        for tagged in pool.imap(_tag_corpus_chunk, chunks()):
+            yield from tagged
+
+
+
+def convert(pickle_file=_TNT_MODEL_PICKLE, model_file=_TNT_MODEL_FILE):
+    """ Convert a pickled TnT model to the compact format """
+    tagger = TnT.load(pickle_file)
+    if tagger is None:
+        print("Unable to load TnT model from {0}".format(pickle_file))
+        return
+    tagger.store_compact(model_file)
+    print("Wrote {0}".format(model_file))
+
 
-    # Return a list of paragraphs, consisting of sentences, consisting of tokens
-    return result
+if __name__ == "__main__":
 
+    # Convert a pickled model to the compact format:
+    # python tnttagger.py [pickle_file [model_file]]
+    convert(*sys.argv[1:3])
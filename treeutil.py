@@ -28,6 +28,7 @@
 import time
 import threading
 from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
 
 from fetcher import Fetcher
 from nertokenizer import recognize_entities
@@ -158,6 +159,20 @@ _TEST_ID_MAP = {  # Til að prófa í parse_text_to_bracket_form()
 }
 
 
+class _ConcurrentIncrementalParser(IncrementalParser):
+
+    """ An IncrementalParser whose sentences can be parsed concurrently
+        in multiple threads, updating the statistics under a lock """
+
+    def __init__(self, parser, toklist, verbose=False):
+        super().__init__(parser, toklist, verbose=verbose)
+        self._stats_lock = threading.Lock()
+
+    def _add_sentence(self, s, num):
+        with self._stats_lock:
+            super()._add_sentence(s, num)
+
+
 class TreeUtility:
 
     """ A wrapper around a set of static utility functions for working
@@ -300,10 +315,33 @@ class TreeUtility:
         s.go(tree)
         return s.result
 
+    # Thread pool for parsing sentences concurrently, created on first use
+    _executor = None
+    _executor_lock = threading.Lock()
+
+    @staticmethod
+    def _parse_executor():
+        """ Return the thread pool for parsing sentences concurrently,
+            or None if concurrent parsing is not enabled in the settings """
+        if Settings.PARSE_THREADS <= 1:
+            return None
+        with TreeUtility._executor_lock:
+            if TreeUtility._executor is None:
+                TreeUtility._executor = ThreadPoolExecutor(
+                    max_workers=Settings.PARSE_THREADS,
+                    thread_name_prefix="parser",
+                )
+            return TreeUtility._executor
+
     @staticmethod
     def _process_toklist(parser, session, toklist, xform):
         """ Low-level utility function to parse token lists and return
             the result of a transformation function (xform) for each sentence """
+        executor = TreeUtility._parse_executor()
+        if executor is not None:
+            return TreeUtility._process_toklist_concurrently(
+                executor, parser, toklist, xform
+            )
         pgs = []  # Paragraph list, containing sentences, containing tokens
         ip = IncrementalParser(parser, toklist, verbose=True)
         for p in ip.paragraphs():
@@ -316,7 +354,36 @@ class TreeUtility:
                     # Error in parse
                     pgs[-1].append(xform(sent.tokens, None, sent.err_index))
 
-        stats = dict(
+        return pgs, TreeUtility._parse_stats(ip)
+
+    @staticmethod
+    def _process_toklist_concurrently(executor, parser, toklist, xform):
+        """ Parse the sentences of a token list concurrently in the given
+            thread pool, and return the result of a transformation function
+            (xform) for each sentence, in order. The C++ parser core releases
+            the GIL, so long texts are parsed on multiple cores. """
+        ip = _ConcurrentIncrementalParser(parser, toklist, verbose=True)
+        sents = [list(p.sentences()) for p in ip.paragraphs()]
+        futures = [[executor.submit(sent.parse) for sent in p] for p in sents]
+        pgs = []  # Paragraph list, containing sentences, containing tokens
+        for p, p_futures in zip(sents, futures):
+            pgs.append([])
+            for sent, future in zip(p, p_futures):
+                # The transformation is done in this thread, as the
+                # sentences are parsed, since it needs the GIL anyway
+                if future.result():
+                    # Parsed successfully
+                    pgs[-1].append(xform(sent.tokens, sent.tree, None))
+                else:
+                    # Error in parse
+                    pgs[-1].append(xform(sent.tokens, None, sent.err_index))
+
+        return pgs, TreeUtility._parse_stats(ip)
+
+    @staticmethod
+    def _parse_stats(ip):
+        """ Return a dict of statistics from an IncrementalParser """
+        return dict(
             num_tokens=ip.num_tokens,
             num_sentences=ip.num_sentences,
             num_parsed=ip.num_parsed,
@@ -325,8 +392,6 @@ class TreeUtility:
             total_score=ip.total_score,
         )
 
-        return pgs, stats
-
     @staticmethod
     def _process_text(parser, session, text, all_names, xform):
         """ Low-level utility function to parse text and return the result of
@@ -411,8 +476,9 @@ class TreeUtility:
             return TreeUtility._process_toklist(parser, session, toklist, xform)
 
     @staticmethod
-    def parse_text(session, text, all_names=False):
-        """ Parse plain text and return the parsed paragraphs as simplified trees """
+    def raw_parse_text(parser, session, text, all_names=False):
+        """ Parse plain text and return the parsed paragraphs as simplified
+            trees. Uses a caller-provided parser object. """
 
         def xform(tokens, tree, err_index):
             """ Transformation function that yields a simplified parse tree
@@ -422,8 +488,15 @@ class TreeUtility:
             # Successfully parsed: return a simplified tree for the sentence
             return TreeUtility._simplify_tree(tokens, tree)
 
+        return TreeUtility._process_text(parser, session, text, all_names, xform)
+
+    @staticmethod
+    def parse_text(session, text, all_names=False):
+        """ Parse plain text and return the parsed paragraphs as simplified trees """
         with Fast_Parser(verbose=False) as parser:  # Don't emit diagnostic messages
-            return TreeUtility._process_text(parser, session, text, all_names, xform)
+            return TreeUtility.raw_parse_text(
+                parser, session, text, all_names=all_names
+            )
 
     @staticmethod
     def simple_parse(text):
@@ -0,0 +1,290 @@
+#!/usr/bin/env python3
+"""
+
+    Greynir: Natural language processing for Icelandic
+
+    Timezone index module
+
+    Copyright (C) 2020 Miðeind ehf.
+
+       This program is free software: you can redistribute it and/or modify
+       it under the terms of the GNU General Public License as published by
+       the Free Software Foundation, either version 3 of the License, or
+       (at your option) any later version.
+       This program is distributed in the hope that it will be useful,
+       but WITHOUT ANY WARRANTY; without even the implied warranty of
+       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+       GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see http://www.gnu.org/licenses/.
+
+
+    This module implements a compact, precomputed index for looking up
+    the timezone of a location given by its coordinates.
+
+    The index is a grid of cells covering the globe. Cells that lie
+    entirely within a single timezone simply store that timezone. Cells
+    on timezone boundaries are subdivided into a finer grid of subcells,
+    each of which stores the timezone at its center point, as determined
+    by point-in-polygon tests when the index is built. At the default
+    resolution (0.25° cells with 8x8 subcells), boundaries are thus
+    resolved to within about 3 km.
+
+    A cell is taken to lie within a single timezone if its corners, its
+    center and the centers of every other subcell in every other row
+    (a 4x4 grid at the default resolution) are all in that timezone.
+    An enclave or a narrow strip of another timezone that lies within
+    a cell is therefore only detected if it is more than about two
+    subcells (7 km at the default resolution) across; smaller ones
+    are stored as part of the surrounding timezone.
+
+    The index is stored in a binary file that is memory-mapped, so it
+    loads instantly and its pages are shared between worker processes.
+
+    The file has the following structure (little-endian):
+
+        Header: magic (8 bytes), subdivisions (uint16), padding (uint16),
+            cell size in degrees (float32), rows (uint32), columns (uint32),
+            number of timezone names (uint32), length of name block (uint32),
+            number of boundary cells (uint32)
+        Name block: timezone names separated by newlines, UTF-8 encoded,
+            padded to a multiple of 4 bytes
+        Cell grid: rows x columns uint16 values, padded to a multiple of
+            4 bytes. 0 means no timezone, _BOUNDARY means a boundary cell,
+            and other values are 1-based indices into the timezone names.
+        Boundary cells: sorted uint32 cell numbers (row x columns + column)
+        Subcell grids: subdivisions x subdivisions uint16 values for
+            each boundary cell, in the same order
+
+    To build the index file, which takes a while, run this module
+    as a main program (requires the tzwhere package):
+
+        python tzindex.py [output_file]
+
+"""
+
+import os
+import sys
+import mmap
+import struct
+import logging
+from bisect import bisect_left
+
+
+_MAGIC = b"GRTZIDX1"
+_HEADER = struct.Struct("<8sHHfIIIII")
+
+# Grid cell value indicating a cell that spans more than one timezone
+_BOUNDARY = 0xFFFF
+
+# Default grid resolution
+_CELL_DEGREES = 0.25
+_SUBDIVISIONS = 8
+# Every n-th subcell center in every n-th row is sampled
+# when checking whether a cell lies within a single timezone
+_CHECK_STRIDE = 2
+
+TIMEZONE_INDEX_FILE = os.path.join(
+    os.path.dirname(__file__), "resources", "timezones.idx"
+)
+
+
+def _pad4(n):
+    """ Return n rounded up to a multiple of 4 """
+    return (n + 3) & ~3
+
+
+class TimezoneIndex:
+
+    """ A memory-mapped timezone lookup index """
+
+    def __init__(self, fname=TIMEZONE_INDEX_FILE):
+        if sys.byteorder != "little":
+            raise ValueError("The timezone index requires a little-endian platform")
+        with open(fname, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        (
+            magic,
+            self._sub,
+            _,
+            self._cell,
+            self._rows,
+            self._cols,
+            num_names,
+            names_len,
+            num_boundary,
+        ) = _HEADER.unpack_from(self._mmap, 0)
+        if magic != _MAGIC:
+            raise ValueError("{0} is not a timezone index file".format(fname))
+        mv = memoryview(self._mmap)
+        pos = _HEADER.size
+        self._names = bytes(mv[pos : pos + names_len]).decode("utf-8").split("\n")
+        assert len(self._names) == num_names
+        pos += _pad4(names_len)
+        grid_len = self._rows * self._cols * 2
+        self._grid = mv[pos : pos + grid_len].cast("H")
+        pos += _pad4(grid_len)
+        self._boundary = mv[pos : pos + num_boundary * 4].cast("I")
+        pos += num_boundary * 4
+        sub_len = num_boundary * self._sub * self._sub * 2
+        self._subgrids = mv[pos : pos + sub_len].cast("H")
+
+    def lookup(self, lat, lon):
+        """ Return the name of the timezone at the given coordinates,
+            or None if no timezone is found """
+        cell = self._cell
+        y = (lat + 90.0) / cell
+        x = ((lon + 180.0) % 360.0) / cell
+        row = min(max(int(y), 0), self._rows - 1)
+        col = min(int(x), self._cols - 1)
+        cell_num = row * self._cols + col
+        v = self._grid[cell_num]
+        if v == _BOUNDARY:
+            # Boundary cell: look up the subcell
+            sub = self._sub
+            ix = bisect_left(self._boundary, cell_num)
+            srow = min(max(int((y - row) * sub), 0), sub - 1)
+            scol = min(max(int((x - col) * sub), 0), sub - 1)
+            v = self._subgrids[(ix * sub + srow) * sub + scol]
+        return self._names[v - 1] if v else None
+
+
+def build_index(
+    fname=TIMEZONE_INDEX_FILE,
+    cell=_CELL_DEGREES,
+    sub=_SUBDIVISIONS,
+    tzw=None,
+    stride=_CHECK_STRIDE,
+):
+    """ Build a timezone index file from the tzwhere polygon data,
+        or from another object with a compatible tzNameAt() method.
+        stride determines the subcell centers that are sampled when
+        checking whether a cell lies within a single timezone. """
+    if tzw is None:
+        from tzwhere import tzwhere
+
+        tzw = tzwhere.tzwhere(forceTZ=True)
+    names = []
+    name_ix = dict()
+
+    def tz_at(lat, lon):
+        """ Return the 1-based index of the timezone at the given point, or 0 """
+        name = tzw.tzNameAt(lat, lon, forceTZ=True)
+        if not name:
+            return 0
+        ix = name_ix.get(name)
+        if ix is None:
+            names.append(name)
+            ix = name_ix[name] = len(names)
+        return ix
+
+    rows = int(round(180.0 / cell))
+    cols = int(round(360.0 / cell))
+
+    # Sample the timezone at all cell corners, clamping the
+    # latitude to avoid degenerate lookups at the poles
+    corners = []
+    for r in range(rows + 1):
+        lat = min(max(-90.0 + r * cell, -89.999), 89.999)
+        corners.append([tz_at(lat, -180.0 + c * cell) for c in range(cols + 1)])
+        if r % 40 == 0:
+            print("Sampling corners: row {0} of {1}".format(r, rows))
+
+    grid = []
+    boundary = []
+    subgrids = []
+    step = cell / sub
+    # The subcells whose centers are sampled in all cells
+    checked = [
+        (sr, sc)
+        for sr in range(stride // 2, sub, stride)
+        for sc in range(stride // 2, sub, stride)
+    ]
+    for r in range(rows):
+        lat0 = -90.0 + r * cell
+        for c in range(cols):
+            lon0 = -180.0 + c * cell
+            center = tz_at(lat0 + cell / 2, lon0 + cell / 2)
+            samples = (
+                corners[r][c],
+                corners[r][c + 1],
+                corners[r + 1][c],
+                corners[r + 1][c + 1],
+            )
+            subcells = dict()
+            if all(s == center for s in samples):
+                # Also sample subcell centers within the cell, to detect
+                # enclaves and narrow strips of other timezones
+                for sr, sc in checked:
+                    tz = tz_at(lat0 + (sr + 0.5) * step, lon0 + (sc + 0.5) * step)
+                    subcells[(sr, sc)] = tz
+                    if tz != center:
+                        break
+                else:
+                    grid.append(center)
+                    continue
+            # Boundary cell: sample the center of each subcell
+            grid.append(_BOUNDARY)
+            boundary.append(r * cols + c)
+            for sr in range(sub):
+                for sc in range(sub):
+                    tz = subcells.get((sr, sc))
+                    if tz is None:
+                        tz = tz_at(lat0 + (sr + 0.5) * step, lon0 + (sc + 0.5) * step)
+                    subgrids.append(tz)
+        if r % 40 == 0:
+            print(
+                "Building grid: row {0} of {1}, {2} boundary cells".format(
+                    r, rows, len(boundary)
+                )
+            )
+
+    assert len(names) < _BOUNDARY
+    names_bytes = "\n".join(names).encode("utf-8")
+    with open(fname, "wb") as f:
+        f.write(
+            _HEADER.pack(
+                _MAGIC,
+                sub,
+                0,
+                cell,
+                rows,
+                cols,
+                len(names),
+                len(names_bytes),
+                len(boundary),
+            )
+        )
+        f.write(names_bytes.ljust(_pad4(len(names_bytes)), b"\0"))
+        grid_bytes = struct.pack("<{0}H".format(len(grid)), *grid)
+        f.write(grid_bytes.ljust(_pad4(len(grid_bytes)), b"\0"))
+        f.write(struct.pack("<{0}I".format(len(boundary)), *boundary))
+        f.write(struct.pack("<{0}H".format(len(subgrids)), *subgrids))
+    print(
+        "Wrote {0}: {1} timezones, {2} boundary cells".format(
+            fname, len(names), len(boundary)
+        )
+    )
+
+
+_INDEX = None
+
+
+def timezone_index():
+    """ Return the singleton timezone index, or None if the index file
+        is not available (in which case callers should fall back to
+        a slower method) """
+    global _INDEX
+    if _INDEX is None:
+        try:
+            _INDEX = TimezoneIndex()
+        except (OSError, ValueError) as e:
+            logging.warning("Unable to load timezone index: {0}".format(e))
+            _INDEX = False
+    return _INDEX or None
+
+
+if __name__ == "__main__":
+
+    build_index(*sys.argv[1:2])
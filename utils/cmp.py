@@ -37,6 +37,12 @@
 
     TAGGER=local python utils/cmp.py
 
+    Local tagging can be spread over several worker processes, each with
+    its own parser and database session, by setting the PROCESSES
+    environment variable:
+
+    TAGGER=local PROCESSES=4 python utils/cmp.py
+
 """
 
 import json
@@ -45,6 +51,7 @@ import os
 import sys
 import json
 import urllib.request
+import multiprocessing
 
 from urllib.parse import quote
 from timeit import default_timer as timer
@@ -73,6 +80,8 @@ USE_IFD_TAGGER = bool(os.environ.get("IFD", False))
 POS_PATH = ""
 IFD_PATH = ""
 USE_LOCAL_TAGGER = False
+# Number of worker processes for local tagging
+PROCESSES = int(os.environ.get("PROCESSES", 1))
 
 if TAGGER.lower() == "local":
     # Use in-process tagger
@@ -372,6 +381,38 @@ class Tagger:
     def session(cls):
         return cls()._create_session()
 
+class _Pretagged:
+
+    """ A stand-in for Tagger that returns the result of
+        tagging a sentence in a worker process """
+
+    def __init__(self, result):
+        self._result = result
+
+    def tag(self, text):
+        return self._result
+
+
+# The tagger of a worker process, and its session context
+_WORKER_TAGGER = None
+_WORKER_SESSION = None
+
+
+def _init_worker():
+    """ Enter a tagging session in a worker process of Comparison.start().
+        The session lasts for the lifetime of the process. """
+    global _WORKER_TAGGER, _WORKER_SESSION
+    _WORKER_SESSION = Tagger.session()
+    _WORKER_TAGGER = _WORKER_SESSION.__enter__()
+
+
+def _tag_sentence(sent):
+    """ Tag a corpus sentence in a worker process """
+    orðalisti = [triple[0] for triple in sent]
+    setning = Comparison().setningabygging(orðalisti)
+    return sent, _WORKER_TAGGER.tag(setning.strip())
+
+
 class Comparison():
 
     def __init__(self):
@@ -1341,7 +1382,13 @@ class Comparison():
     def start(self, process_func, filter_func = None, skip_func = None):
         corpus = Corpus()
         sentences = corpus.raw_sentence_stream(filter_func = filter_func, skip = skip_func)
-        if USE_LOCAL_TAGGER:
+        if USE_LOCAL_TAGGER and PROCESSES > 1:
+            # Tag the sentences in worker processes, and process
+            # the results in order as they come in
+            with multiprocessing.Pool(PROCESSES, initializer = _init_worker) as pool:
+                for sent, result in pool.imap(_tag_sentence, sentences, chunksize = 10):
+                    process_func(_Pretagged(result), sent)
+        elif USE_LOCAL_TAGGER:
             # Call the Greynir POS tagger directly in-process
             with Tagger.session() as tagger:
                 for sent in sentences:
@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+"""
+
+    Greynir: Natural language processing for Icelandic
+
+    Copyright (C) 2020 Miðeind ehf.
+
+       This program is free software: you can redistribute it and/or modify
+       it under the terms of the GNU General Public License as published by
+       the Free Software Foundation, either version 3 of the License, or
+       (at your option) any later version.
+       This program is distributed in the hope that it will be useful,
+       but WITHOUT ANY WARRANTY; without even the implied warranty of
+       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+       GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see http://www.gnu.org/licenses/.
+
+
+    This utility program rebuilds the daily rollup tables of the scraper
+    database (article and query statistics, word frequencies and the
+    person co-occurrence graph) from the underlying articles, queries
+    and words tables.
+
+    The rollup tables are maintained incrementally as articles are
+    stored and queries are logged, so this only needs to be run once
+    after the tables are created, or to repair them.
+
+"""
+
+import os
+import sys
+from datetime import datetime, timedelta
+
+# Hack to make this Python program executable from the utils subdirectory
+basepath, _ = os.path.split(os.path.realpath(__file__))
+_UTILS = os.sep + "utils"
+if basepath.endswith(_UTILS):
+    basepath = basepath[0 : -len(_UTILS)]
+    sys.path.append(basepath)
+
+from settings import Settings, ConfigError
+from db import SessionContext
+from db.queries import (
+    ChartsQuery,
+    QueriesQuery,
+    WordFrequencyQuery,
+    PersonGraphQuery,
+)
+
+
+def rebuild(days, words=True):
+    """ Rebuild the daily rollups, one day at a time, for the given
+        number of days back from today (inclusive). If words is False,
+        the word frequency and person graph tables are left alone. """
+    SessionContext.db.create_tables()
+    if words:
+        # The person graph is not broken down by day
+        PersonGraphQuery.rebuild()
+        print("Rebuilt person graph")
+    today = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+    for n in range(days, -1, -1):
+        start = today - timedelta(days=n)
+        end = start + timedelta(days=1)
+        with SessionContext(commit=True) as session:
+            ChartsQuery.rebuild(start, end, enclosing_session=session)
+            QueriesQuery.rebuild(start, end, enclosing_session=session)
+            if words:
+                WordFrequencyQuery.rebuild(start, end, enclosing_session=session)
+        print("Rebuilt rollups for {0}".format(start.date()))
+
+
+def main():
+
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Rebuilds the daily rollup tables of the scraper database"
+    )
+    parser.add_argument(
+        "--days",
+        dest="DAYS",
+        type=int,
+        default=30,
+        help="Number of days back to rebuild (default 30; use the full article history for a first build)",
+    )
+    parser.add_argument(
+        "--skip-words",
+        dest="SKIP_WORDS",
+        action="store_true",
+        help="Don't rebuild the word frequency and person graph tables, which is slow",
+    )
+    args = parser.parse_args()
+
+    try:
+        Settings.read(os.path.join(basepath, "config", "Greynir.conf"))
+    except ConfigError as e:
+        print("Configuration error: {0}".format(e))
+        sys.exit(1)
+
+    rebuild(args.DAYS, words=not args.SKIP_WORDS)
+
+
+if __name__ == "__main__":
+
+    main()
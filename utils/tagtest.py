@@ -44,11 +44,13 @@ from tokenizer import tokenize, TOK
 from db import SessionContext, desc
 from db.models import Article as ArticleRow
 from article import Article
-from postagger import NgramTagger, IFD_Corpus, IFD_Tagset
-from tnttagger import TnT
+from postagger import NgramTagger, IFD_Corpus, IFD_Tagset, TAGSET_CACHE
+from tnttagger import TnT, tag_corpus
 
 
 _TNT_MODEL_FILE = "config" + os.sep + "TnT-model.pickle"
+# Number of worker processes for TnT tagging of the test set
+PROCESSES = int(os.environ.get("PROCESSES", 1))
 
 
 @contextmanager
@@ -133,17 +135,22 @@ def test_tagger():
 
     def test_ifd_file(session):
         print("\n\n*** IFD TEST SET ***\n\n")
-        gen = IFD_Corpus().raw_sentence_stream(limit = TEST_SET)
+        sents = list(IFD_Corpus().raw_sentence_stream(limit = TEST_SET))
+        wordlists = [ [ triple[0] for triple in sent ] for sent in sents ]
+        # Tag all the sentences in one go, possibly in parallel
+        with timeit("TnT tagging"):
+            if PROCESSES > 1:
+                tntlists = list(tag_corpus(wordlists, _TNT_MODEL_FILE, processes = PROCESSES))
+            else:
+                tntlists = tnt_tagger.tag_sents(wordlists)
         dlist = None
-        for sent in gen:
-            orðalisti = [ triple[0] for triple in sent ]
+        for sent, orðalisti, tntlist in zip(sents, wordlists, tntlists):
             mörk_OTB = [ triple[1] for triple in sent ]
             lemmur_OTB = [ triple[2] for triple in sent ]
             txt = " ".join(orðalisti)
             if tagger is not None:
                 toklist = tokenize(txt, enclosing_session = session)
                 dlist = tagger.tag(toklist)
-            tntlist = tnt_tagger.tag(orðalisti)
             ix = 0
             print("\n{0}\n".format(txt))
             for tag, lemma, word, tnt_wt in zip(mörk_OTB, lemmur_OTB, orðalisti, tntlist):
@@ -230,6 +237,12 @@ def test_tagger():
             .format("", 100.0 * (partial_tag_tnt + correct_tag_tnt) / (total_tags - missing_tag_tnt)))
         print("Precision:    {0:8} {1:6.2f}%"
             .format("", 100.0 * correct_tag_tnt / (total_tags - missing_tag_tnt)))
+        if PROCESSES <= 1:
+            # With several processes, the TnT tagger's lookups are done
+            # in the worker processes, each of which has its own cache
+            stats = TAGSET_CACHE.stats()
+            print("\nTag set cache: {0} entries, {1} hits, {2} misses, hit rate {3:.2f}%"
+                .format(stats["size"], stats["hits"], stats["misses"], 100.0 * stats["hit_rate"]))
         print("\n-----------------------------------\n")
 
 
@@ -21,7 +21,8 @@
 
 
     This program trains a TnT POS tagging model.
-    Trained models are stored in the file `config/TnT-model.pickle`.
+    Trained models are stored in the file `config/TnT-model.pickle`,
+    and in the compact format in `config/TnT-model.bin`.
 
 """
 
@@ -45,6 +46,7 @@ from tnttagger import TnT
 
 
 _TNT_MODEL_FILE = os.path.join(basepath, "config", "TnT-model.pickle")
+_TNT_COMPACT_MODEL_FILE = os.path.join(basepath, "config", "TnT-model.bin")
 
 
 @contextmanager
@@ -57,7 +59,8 @@ def timeit(description = "Timing"):
 
 
 def train_tagger():
-    """ Train the TnT tagger and store its model in a pickle file """
+    """ Train the TnT tagger and store its model in a pickle file
+        and in a compact model file """
 
     # Number of training and test sentences
     TRAINING_SET = 0 # 25000
@@ -80,6 +83,8 @@ def train_tagger():
         tnt_tagger.train(word_tag_stream)
     with timeit(f"Store TnT model trained on {tnt_tagger.count} sentences"):
         tnt_tagger.store(_TNT_MODEL_FILE)
+    with timeit("Store compact TnT model"):
+        tnt_tagger.store_compact(_TNT_COMPACT_MODEL_FILE)
 
 
 if __name__ == "__main__":